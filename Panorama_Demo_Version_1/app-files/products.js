@@ -0,0 +1,23 @@
+// Sinh bởi TestPano/build_marzipano_tiles.py, không sửa tay
+var productIndex = [
+  {"key": "1a5ab6424adfa1e1", "structure": "l1_l1_1_1"},
+  {"key": "0907ced043a892f4", "structure": "l1_l1_2_2"},
+  {"key": "116d8fe1d94b004f", "structure": "l1_l1_2_2"},
+  {"key": "2d9dfc066215f1d0", "structure": "l1_l1_3_3"},
+  {"key": "961fab550347f6fa", "structure": "l1_l1_3_3"},
+  {"key": "0013bf73ebe076f7", "structure": "l2_l1_2_2_l2_3_3"},
+  {"key": "00334ac8f21d1b5c", "structure": "l2_l1_2_2_l2_3_3"},
+  {"key": "0006e253c720cf00", "structure": "l2_l1_2_2_l2_4_4"},
+  {"key": "000a87de36f83cca", "structure": "l2_l1_2_2_l2_4_4"},
+  {"key": "04172c95a916ac66", "structure": "l2_l1_3_3_l2_5_5"},
+  {"key": "05d0fc5832284cff", "structure": "l2_l1_3_3_l2_5_5"},
+  {"key": "0016314bd22c88bf", "structure": "l3_l1_2_2_l2_3_3_l3_5_5"},
+  {"key": "0020ca9e6b6b5d9d", "structure": "l3_l1_2_2_l2_3_3_l3_5_5"},
+  {"key": "000565a39fc5c236", "structure": "l3_l1_2_2_l2_3_3_l3_7_7"},
+  {"key": "0027992aa5064f2d", "structure": "l3_l1_2_2_l2_3_3_l3_7_7"},
+  {"key": "12708b97708d4808", "structure": "l3_l1_2_2_l2_4_4_l3_8_8"},
+  {"key": "19447476b3764967", "structure": "l3_l1_2_2_l2_4_4_l3_8_8"},
+  {"key": "091ac331c6f2238d", "structure": "l4_l1_2_2_l2_3_3_l3_5_5_l4_10_10"},
+  {"key": "1003664e21e92652", "structure": "l4_l1_2_2_l2_3_3_l3_5_5_l4_10_10"}
+];
+var availableProducts = productIndex.map(function(product) { return product.key; });
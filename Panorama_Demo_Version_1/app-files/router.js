@@ -1,49 +1,13 @@
 // router.js - Xử lý định tuyến URL cho Marzipano
 
-// Danh sách các product có sẵn - theo thứ tự trong cây thư mục
-var availableProducts = [
-  // l1_l1_1_1
-  '1a5ab6424adfa1e1',
-  
-  // l1_l1_2_2
-  '0907ced043a892f4',
-  '116d8fe1d94b004f',
-  
-  // l1_l1_3_3
-  '2d9dfc066215f1d0',
-  '961fab550347f6fa',
-  
-  // l2_l1_2_2_l2_3_3
-  '0013bf73ebe076f7',
-  '00334ac8f21d1b5c',
-  
-  // l2_l1_2_2_l2_4_4
-  '0006e253c720cf00',
-  '000a87de36f83cca',
-  
-  // l2_l1_3_3_l2_5_5
-  '04172c95a916ac66',
-  '05d0fc5832284cff',
-  
-  // l3_l1_2_2_l2_3_3_l3_5_5
-  '0016314bd22c88bf',
-  '0020ca9e6b6b5d9d',
-  
-  // l3_l1_2_2_l2_3_3_l3_7_7
-  '000565a39fc5c236',
-  '0027992aa5064f2d',
-  
-  // l3_l1_2_2_l2_4_4_l3_8_8
-  '12708b97708d4808',
-  '19447476b3764967',
-  
-  // l4_l1_2_2_l2_3_3_l3_5_5_l4_10_10
-  '091ac331c6f2238d',
-  '1003664e21e92652'
-];
+// Danh sách các product có sẵn (availableProducts) nằm trong products.js,
+// được sinh bởi TestPano/build_marzipano_tiles.py
 
 // Hàm này được gọi khi trang web tải xong
 function initRouter() {
+  // Tạo danh sách sản phẩm trong selector từ productIndex
+  populateProductSelector();
+
   // Kiểm tra URL hiện tại
   var path = window.location.pathname;
   
@@ -125,6 +89,28 @@ function loadProductData(productKey) {
   document.head.appendChild(script);
 }
 
+// Tạo các option cho selector, nhóm theo cấu trúc tile
+function populateProductSelector() {
+  var selector = document.getElementById('productSelector');
+  if (!selector) {
+    return;
+  }
+
+  var groups = {};
+  productIndex.forEach(function(product) {
+    var label = product.structure || 'unknown';
+    if (!groups[label]) {
+      groups[label] = document.createElement('optgroup');
+      groups[label].label = label;
+      selector.appendChild(groups[label]);
+    }
+    var option = document.createElement('option');
+    option.value = product.key;
+    option.textContent = label + ' / ' + product.key;
+    groups[label].appendChild(option);
+  });
+}
+
 // Cập nhật giá trị selector sản phẩm
 function updateProductSelector(productKey) {
   var selector = document.getElementById('productSelector');
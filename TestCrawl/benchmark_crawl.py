@@ -0,0 +1,182 @@
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from common.cdn_simulator import CdnSimulator, layout_weights, make_products
+from common.tile_integrity import LEVELS_FILE
+
+# Chạy 4_check_image_exists → 1_classify_tile_type → 2_download_tiles_from_mapping thật (subprocess,
+# như khi chạy tay) trên common/cdn_simulator.py với từng cấu hình mạng, ghi req/s, tile/s và thời gian.
+# Cùng PRODUCTS/SEED cho cùng dữ liệu: chạy lại sau mỗi thay đổi để so với dòng cũ trong RESULTS_FILE
+ROOT = os.path.dirname(os.path.abspath(__file__))
+WORK_DIR = os.path.join(ROOT, "benchmark_work")
+RESULTS_FILE = os.path.join(ROOT, "benchmark_results.jsonl")
+STRUCTURE_DIR = os.path.join(ROOT, "download_image", "output_structure")
+PRODUCTS = 100
+SEED = 0
+MISSING_RATE = 0.05
+STAGE_TIMEOUT = 1800
+POLL_INTERVAL = 0.5
+STAGES = [
+    ("check", os.path.join(ROOT, "mapping_key", "4_check_image_exists.py")),
+    ("classify", os.path.join(ROOT, "download_image", "1_classify_tile_type.py")),
+    ("download", os.path.join(ROOT, "download_image", "2_download_tiles_from_mapping.py")),
+]
+# Tham số của CdnSimulator; chọn cấu hình bằng tên: python benchmark_crawl.py baseline lossy
+CONFIGS = {
+    "baseline": {"latency": 0.02, "jitter": 0.01},
+    "slow": {"latency": 0.15, "jitter": 0.1},
+    "bandwidth": {"latency": 0.02, "jitter": 0.01, "bandwidth": 100_000},
+    "lossy": {"latency": 0.05, "jitter": 0.03, "error_rate": 0.03, "truncate_rate": 0.01},
+    "rate_limited": {"latency": 0.02, "jitter": 0.01, "rate_limit": 300, "max_in_flight": 32},
+}
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def prepare_work_dir(name, products):
+    # Thư mục trống cho mỗi cấu hình: cache, ledger và ảnh của lần trước không được dùng lại
+    work_dir = os.path.join(WORK_DIR, name)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir)
+    with open(os.path.join(work_dir, "product-mapping-image-key.txt"), "w") as f:
+        for product in products:
+            f.write(f"{product.key},{product.cdn_path}\n")
+    return work_dir
+
+def count_lines(path):
+    if not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        return sum(1 for line in f if line.strip())
+
+def count_tiles(path):
+    # preview.jpg nằm cạnh thư mục các mặt, không tính là tile
+    return sum(1 for _, _, files in os.walk(path) for fname in files
+               if fname.endswith(".jpg") and fname != "preview.jpg")
+
+def usable_products(image_dir):
+    # Product đã có ít nhất một level đủ tile (levels.txt), tức dựng được panorama
+    count = 0
+    if os.path.isdir(image_dir):
+        for structure in os.scandir(image_dir):
+            if structure.is_dir():
+                count += sum(1 for product in os.scandir(structure.path)
+                             if os.path.exists(os.path.join(product.path, LEVELS_FILE)))
+    return count
+
+async def watch_usable(image_dir, expected):
+    # Thời gian tới khi mọi product có panorama dùng được, tính từ lúc stage download bắt đầu
+    start = time.perf_counter()
+    while usable_products(image_dir) < expected:
+        await asyncio.sleep(POLL_INTERVAL)
+    return round(time.perf_counter() - start, 3)
+
+async def run_stage(sim, name, script, work_dir):
+    env = dict(os.environ, CRAWL_SITE_URL=sim.site_url, CRAWL_CDN_URL=sim.cdn_url, PYTHONUNBUFFERED="1")
+    before = sim.stats["cdn"].snapshot()
+    start = time.perf_counter()
+    with open(os.path.join(work_dir, f"{name}.log"), "w") as log:
+        process = await asyncio.create_subprocess_exec(sys.executable, script, cwd=work_dir, env=env,
+                                                       stdout=log, stderr=subprocess.STDOUT)
+        try:
+            code = await asyncio.wait_for(process.wait(), STAGE_TIMEOUT)
+        except asyncio.TimeoutError:
+            process.kill()
+            code = await process.wait()
+    elapsed = time.perf_counter() - start
+    after = sim.stats["cdn"].snapshot()
+    requests = after["requests"] - before["requests"]
+    tiles = after["tiles"] - before["tiles"]
+    statuses = {code: count - before["statuses"].get(code, 0) for code, count in after["statuses"].items()
+                if count != before["statuses"].get(code, 0)}
+    return {
+        "stage": name,
+        "exit_code": code,
+        "wall_time": round(elapsed, 3),
+        "requests": requests,
+        "requests_per_sec": round(requests / elapsed, 1),
+        "tiles": tiles,
+        "tiles_per_sec": round(tiles / elapsed, 1),
+        "bytes": after["bytes"] - before["bytes"],
+        "statuses": statuses,
+    }
+
+async def run_config(name, options, products):
+    work_dir = prepare_work_dir(name, products)
+    expected_valid = [p for p in products if p.has_preview and p.has_tiles]
+    expected_tiles = sum(p.tile_count() for p in expected_valid)
+    stages = []
+    start = time.perf_counter()
+    async with CdnSimulator(products, seed=SEED, **options) as sim:
+        for stage_name, script in STAGES:
+            watch = None
+            if stage_name == "download":
+                watch = asyncio.create_task(watch_usable(os.path.join(work_dir, "image_crawled"),
+                                                         len(expected_valid)))
+            result = await run_stage(sim, stage_name, script, work_dir)
+            if watch:
+                # Vẫn chưa xong sau một lượt kiểm tra nữa nghĩa là có product không dựng được
+                try:
+                    result["time_to_usable"] = await asyncio.wait_for(watch, POLL_INTERVAL * 2)
+                except asyncio.TimeoutError:
+                    result["time_to_usable"] = None
+            stages.append(result)
+            print(f"  {stage_name:<9} {result['wall_time']:7.2f}s  {result['requests_per_sec']:7.1f} req/s  "
+                  f"{result['tiles_per_sec']:7.1f} tile/s  status {result['statuses']}"
+                  + (f"  mọi product dùng được sau {result['time_to_usable']}s" if watch else "")
+                  + (f"  ❌ exit {result['exit_code']}" if result["exit_code"] else ""))
+        site = sim.stats["site"].snapshot()
+    wall_time = time.perf_counter() - start
+
+    # Kết quả phải đúng như dữ liệu giả lập, không thì con số tốc độ không có nghĩa
+    valid = count_lines(os.path.join(work_dir, "has_image.txt"))
+    tiles = count_tiles(os.path.join(work_dir, "image_crawled"))
+    return {
+        "config": name,
+        "options": options,
+        "products": len(products),
+        "wall_time": round(wall_time, 3),
+        "requests_per_sec": round(sum(s["requests"] for s in stages) / wall_time, 1),
+        "tiles_per_sec": round(sum(s["tiles"] for s in stages) / wall_time, 1),
+        "stages": stages,
+        "site_requests": site["requests"],
+        "valid_products": valid,
+        "expected_valid_products": len(expected_valid),
+        "tiles_on_disk": tiles,
+        "expected_tiles": expected_tiles,
+    }
+
+async def main(names):
+    products = make_products(PRODUCTS, layout_weights(STRUCTURE_DIR), missing_rate=MISSING_RATE, seed=SEED)
+    print(f"🧪 {len(products)} product giả lập, {sum(p.tile_count() for p in products)} tile")
+    revision = git_revision()
+    for name in names:
+        print(f"\n⚙️ {name}: {CONFIGS[name]}")
+        result = await run_config(name, CONFIGS[name], products)
+        result.update(timestamp=time.strftime("%Y-%m-%dT%H:%M:%S"), revision=revision, python=sys.version.split()[0])
+        ok = (result["valid_products"] == result["expected_valid_products"]
+              and result["tiles_on_disk"] == result["expected_tiles"])
+        print(f"  {'tổng':<9} {result['wall_time']:7.2f}s  {result['requests_per_sec']:7.1f} req/s  "
+              f"{result['tiles_per_sec']:7.1f} tile/s  "
+              f"{result['valid_products']}/{result['expected_valid_products']} product, "
+              f"{result['tiles_on_disk']}/{result['expected_tiles']} tile {'✅' if ok else '❌'}")
+        with open(RESULTS_FILE, "a") as f:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    print(f"\n📄 Kết quả được ghi thêm vào {RESULTS_FILE}")
+
+if __name__ == "__main__":
+    selected = sys.argv[1:] or list(CONFIGS)
+    unknown = [name for name in selected if name not in CONFIGS]
+    if unknown:
+        sys.exit(f"❌ Không có cấu hình: {', '.join(unknown)} (có: {', '.join(CONFIGS)})")
+    asyncio.run(main(selected))
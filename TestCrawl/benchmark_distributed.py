@@ -0,0 +1,133 @@
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from common.cdn_simulator import CdnSimulator, layout_weights, make_products
+from benchmark_crawl import (CONFIGS, MISSING_RATE, PRODUCTS, RESULTS_FILE, ROOT, SEED, STAGES, STRUCTURE_DIR,
+                             count_lines, count_tiles, git_revision, prepare_work_dir, run_stage)
+
+# Chạy distributed_coordinator.py + WORKERS process distributed_worker.py trên một máy (mỗi worker một thư mục,
+# như một node riêng) với common/cdn_simulator.py. Một worker bị kill -9 giữa chừng: lease của nó phải hết hạn
+# và được giao lại, cuối cùng mọi tile có ít nhất một bản trên các node (product dở trên node chết bị tải lại)
+COORDINATOR = os.path.join(ROOT, "download_image", "distributed_coordinator.py")
+WORKER = os.path.join(ROOT, "download_image", "distributed_worker.py")
+WORKERS = 3
+COORDINATOR_PORT = 8791
+LEASE_TTL = 5
+KILL_AFTER = 8.0  # giây sau khi worker khởi động; None để không kill
+TIMEOUT = 1800
+CONFIG = "baseline"
+
+def node_tiles(path):
+    # Đường dẫn tương đối của tile (bỏ preview.jpg) để gộp các node, tile trùng chỉ tính một lần
+    return {os.path.relpath(os.path.join(dirpath, fname), path)
+            for dirpath, _, files in os.walk(path) for fname in files
+            if fname.endswith(".jpg") and fname != "preview.jpg"}
+
+def spawn(script, cwd, env, log_name):
+    os.makedirs(cwd, exist_ok=True)
+    log = open(os.path.join(cwd, log_name), "w")
+    process = subprocess.Popen([sys.executable, script], cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+    return process
+
+async def wait_port(port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return True
+        except OSError:
+            await asyncio.sleep(0.1)
+    return False
+
+async def wait_process(process, timeout):
+    deadline = time.monotonic() + timeout
+    while process.poll() is None and time.monotonic() < deadline:
+        await asyncio.sleep(0.2)
+    if process.poll() is None:
+        process.kill()
+    return process.wait()
+
+async def main():
+    products = make_products(PRODUCTS, layout_weights(STRUCTURE_DIR), missing_rate=MISSING_RATE, seed=SEED)
+    expected_valid = [p for p in products if p.has_preview and p.has_tiles]
+    expected_tiles = sum(p.tile_count() for p in expected_valid)
+    name = f"distributed_{WORKERS}"
+    work_dir = prepare_work_dir(name, products)
+    print(f"🧪 {len(products)} product giả lập, {WORKERS} worker, lease {LEASE_TTL}s, kill sau {KILL_AFTER}s")
+
+    async with CdnSimulator(products, seed=SEED, **CONFIGS[CONFIG]) as sim:
+        # has_image.txt từ 4_check_image_exists.py như khi chạy tay
+        check = await run_stage(sim, *STAGES[0], work_dir)
+        print(f"  check     {check['wall_time']:7.2f}s")
+
+        env = dict(os.environ, CRAWL_SITE_URL=sim.site_url, CRAWL_CDN_URL=sim.cdn_url, PYTHONUNBUFFERED="1",
+                   CRAWL_COORDINATOR_PORT=str(COORDINATOR_PORT), CRAWL_LEASE_TTL=str(LEASE_TTL),
+                   CRAWL_COORDINATOR_URL=f"http://127.0.0.1:{COORDINATOR_PORT}")
+        before = sim.stats["cdn"].snapshot()
+        start = time.perf_counter()
+        coordinator = spawn(COORDINATOR, work_dir, env, "coordinator.log")
+        if not await wait_port(COORDINATOR_PORT):
+            coordinator.kill()
+            sys.exit("❌ Coordinator không khởi động được, xem coordinator.log")
+        workers = [spawn(WORKER, os.path.join(work_dir, f"worker_{i}"), dict(env, CRAWL_WORKER_ID=f"worker_{i}"),
+                         "worker.log")
+                   for i in range(1, WORKERS + 1)]
+        killed = False
+        if KILL_AFTER is not None:
+            await asyncio.sleep(KILL_AFTER)
+            if workers[0].poll() is None:
+                workers[0].send_signal(signal.SIGKILL)
+                killed = True
+                print(f"  💀 kill worker_1 sau {KILL_AFTER}s")
+        code = await wait_process(coordinator, TIMEOUT)
+        worker_codes = [await wait_process(worker, 30) for worker in workers]
+        elapsed = time.perf_counter() - start
+        after = sim.stats["cdn"].snapshot()
+
+    requests = after["requests"] - before["requests"]
+    tiles_served = after["tiles"] - before["tiles"]
+    node_dirs = [os.path.join(work_dir, f"worker_{i}", "image_crawled") for i in range(1, WORKERS + 1)]
+    tiles = len(set().union(*(node_tiles(path) for path in node_dirs)))
+    copies = sum(count_tiles(path) for path in node_dirs)
+    valid = count_lines(os.path.join(work_dir, "has_image.txt"))
+    with open(os.path.join(work_dir, "coordinator.log")) as f:
+        report = [line.strip() for line in f if line.startswith(("🗂️ Coordinator:", "📒"))]
+    ok = code == 0 and valid == len(expected_valid) and tiles == expected_tiles
+    print(f"  workers   {elapsed:7.2f}s  {requests / elapsed:7.1f} req/s  {tiles_served / elapsed:7.1f} tile/s  "
+          f"exit {code}/{worker_codes}")
+    for line in report:
+        print(f"  {line}")
+    print(f"  {valid}/{len(expected_valid)} product, {tiles}/{expected_tiles} tile trên {WORKERS} node, "
+          f"{copies - tiles} bản trùng, {tiles_served - expected_tiles} tile tải lại {'✅' if ok else '❌'}")
+
+    result = {
+        "config": name,
+        "options": dict(CONFIGS[CONFIG], workers=WORKERS, lease_ttl=LEASE_TTL,
+                        kill_after=KILL_AFTER if killed else None),
+        "products": len(products),
+        "wall_time": round(elapsed + check["wall_time"], 3),
+        "requests_per_sec": round(requests / elapsed, 1),
+        "tiles_per_sec": round(tiles_served / elapsed, 1),
+        "stages": [check],
+        "valid_products": valid,
+        "expected_valid_products": len(expected_valid),
+        "tiles_on_disk": tiles,
+        "duplicate_tiles": copies - tiles,
+        "expected_tiles": expected_tiles,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+    }
+    with open(RESULTS_FILE, "a") as f:
+        f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,227 @@
+import os
+import re
+import time
+import asyncio
+from collections import Counter
+from urllib.parse import urljoin, urlparse
+import aiohttp
+
+from common.rate_controller import unlimited_slot
+
+# CRAWL_SITE_URL trỏ sang site khác (ví dụ common/cdn_simulator.py); đường dẫn CDN trong trang vẫn là imgscdn
+SITE_URL = os.environ.get("CRAWL_SITE_URL", "http://www.ajun720.cn")
+TOUR_URL = SITE_URL + "/tour/{key}"
+CDN_PATTERN = re.compile(r"https?://imgscdn\.ajun720\.cn/(\d+/works/[a-zA-Z0-9]+)")
+POOL_SIZE = 20
+NAVIGATION_TIMEOUT = 60  # giây cho page.goto
+RESOLVE_TIMEOUT = 5  # giây chờ thêm request CDN sau khi trang đã tải xong
+# Chỉ cần URL của request CDN, không cần tải nội dung nặng
+BLOCKED_RESOURCES = {"image", "media", "font", "stylesheet"}
+# Script/XML được trang tour tham chiếu, nơi đường dẫn CDN hay nằm khi không có sẵn trong HTML
+RESOURCE_PATTERN = re.compile(r"""(?:<script[^>]+src|xml)\s*[=:]\s*["']([^"']+)["']""", re.I)
+MAX_RESOURCES = 8
+STATIC_TIMEOUT = 10
+STATIC_RETRY = 2
+# Ảnh thumb thường là của product khác (danh sách liên quan), không dùng để xác định
+THUMB_SUFFIX = "/thumb"
+# Nhãn stage trong telemetry: GET trang tour/script và lần mở trang bằng trình duyệt
+STATIC_STAGE = "resolve"
+PLAYWRIGHT_STAGE = "playwright"
+
+def extract_cdn_path(text):
+    paths = {match.group(1) for match in CDN_PATTERN.finditer(text)
+             if not text.startswith(THUMB_SUFFIX, match.end())}
+    # Nhiều đường dẫn khác nhau thì không đoán, để Playwright xử lý
+    return paths.pop() if len(paths) == 1 else None
+
+class StaticResolver:
+    name = "static"
+
+    def __init__(self, session, tour_url=TOUR_URL, max_resources=MAX_RESOURCES,
+                 timeout=STATIC_TIMEOUT, retries=STATIC_RETRY, metrics=None):
+        self.session = session
+        self.metrics = metrics
+        self.tour_url = tour_url
+        self.max_resources = max_resources
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self.resolved = 0
+        self.failed = 0
+        self.requests = 0
+        self.started_at = time.perf_counter()
+        # Script dùng chung (jquery, nav...) đã tải mà không chứa đường dẫn CDN
+        self._barren = set()
+
+    async def _get(self, url):
+        for attempt in range(1, self.retries + 1):
+            self.requests += 1
+            try:
+                async with unlimited_slot(self.metrics, STATIC_STAGE, url) as slot, \
+                        self.session.get(url, timeout=self.timeout) as resp:
+                    slot.status(resp.status)
+                    if resp.status != 200:
+                        return None
+                    text = await resp.text(errors="ignore")
+                    slot.received(len(text))
+                    return text
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt == self.retries:
+                    return None
+
+    def _resources(self, page_url, html, key):
+        host = urlparse(page_url).netloc
+        urls = []
+        for ref in RESOURCE_PATTERN.findall(html):
+            url = urljoin(page_url, ref)
+            if urlparse(url).netloc == host and url not in self._barren and url not in urls:
+                urls.append(url)
+        # Ưu tiên tài nguyên riêng của key, sau đó mới tới script dùng chung
+        urls.sort(key=lambda url: key not in url)
+        return urls[:self.max_resources]
+
+    async def resolve(self, key):
+        page_url = self.tour_url.format(key=key)
+        html = await self._get(page_url)
+        cdn_path = extract_cdn_path(html) if html else None
+
+        if html and not cdn_path:
+            urls = self._resources(page_url, html, key)
+            bodies = await asyncio.gather(*(self._get(url) for url in urls))
+            for url, body in zip(urls, bodies):
+                cdn_path = extract_cdn_path(body) if body else None
+                if cdn_path:
+                    break
+                if body is not None and key not in url:
+                    self._barren.add(url)
+
+        if cdn_path:
+            self.resolved += 1
+        else:
+            self.failed += 1
+        return cdn_path
+
+    def keys_per_minute(self):
+        elapsed = time.perf_counter() - self.started_at
+        return (self.resolved + self.failed) / elapsed * 60 if elapsed else 0.0
+
+class ChainResolver:
+    name = "chain"
+
+    def __init__(self, *resolvers):
+        self.resolvers = resolvers
+        self.wins = Counter()
+        self.source = {}
+
+    async def resolve(self, key):
+        for resolver in self.resolvers:
+            cdn_path = await resolver.resolve(key)
+            if cdn_path:
+                self.wins[resolver.name] += 1
+                self.source[key] = resolver.name
+                return cdn_path
+        return None
+
+    def report(self):
+        return ", ".join(f"{resolver.name} {self.wins[resolver.name]}" for resolver in self.resolvers)
+
+class PlaywrightResolver:
+    name = "playwright"
+
+    def __init__(self, browser, pool_size=POOL_SIZE, tour_url=TOUR_URL, user_agent="Mozilla/5.0",
+                 resolve_timeout=RESOLVE_TIMEOUT, block_resources=True, metrics=None):
+        self.browser = browser
+        self.metrics = metrics
+        self.pool_size = pool_size
+        self.tour_url = tour_url
+        self.user_agent = user_agent
+        self.resolve_timeout = resolve_timeout
+        self.block_resources = block_resources
+        self.context = None
+        self.pages = asyncio.Queue()
+        self.resolved = 0
+        self.failed = 0
+        self.started_at = None
+
+    async def start(self):
+        self.context = await self.browser.new_context(user_agent=self.user_agent)
+        if self.block_resources:
+            await self.context.route("**/*", self._route)
+        for _ in range(self.pool_size):
+            self.pages.put_nowait(await self.context.new_page())
+        self.started_at = time.perf_counter()
+        return self
+
+    async def close(self):
+        if self.context:
+            await self.context.close()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _route(self, route):
+        request = route.request
+        # Request CDN đã được ghi nhận qua sự kiện "request", không cần tải thật
+        if request.resource_type in BLOCKED_RESOURCES or CDN_PATTERN.search(request.url):
+            await route.abort()
+        else:
+            await route.continue_()
+
+    async def resolve(self, key):
+        page = await self.pages.get()
+        found = asyncio.get_running_loop().create_future()
+
+        def handle_request(request):
+            match = CDN_PATTERN.search(request.url)
+            if match and not found.done():
+                found.set_result(match.group(1))
+
+        page.on("request", handle_request)
+        url = self.tour_url.format(key=key)
+        started = time.monotonic()
+        navigation = asyncio.ensure_future(page.goto(url, timeout=NAVIGATION_TIMEOUT * 1000))
+        error = None
+        try:
+            # Trả về ngay khi thấy request CDN đầu tiên thay vì chờ cố định 8-10s
+            await asyncio.wait({found, navigation}, return_when=asyncio.FIRST_COMPLETED)
+            if not found.done() and navigation.done():
+                error = navigation.exception()
+                if error is None:
+                    # Trang đã tải xong nhưng script có thể gọi CDN muộn hơn một chút
+                    await asyncio.wait({found}, timeout=self.resolve_timeout)
+        finally:
+            page.remove_listener("request", handle_request)
+            navigation.cancel()
+            if navigation.done() and not navigation.cancelled():
+                # found và lỗi điều hướng xong cùng một vòng wait: lấy exception để asyncio không cảnh báo
+                # "Task exception was never retrieved" (cancel() không có tác dụng với task đã xong)
+                navigation.exception()
+            try:
+                await page.goto("about:blank")
+            except Exception:
+                # Trang hỏng thì thay bằng trang mới để pool không bị thiếu
+                await page.close()
+                page = await self.context.new_page()
+            self.pages.put_nowait(page)
+
+        if error is not None and not found.done():
+            print(f"⚠️ Lỗi tải {key}: {error}")
+        if self.metrics:
+            # Một lần mở trang tính là một request, tới lúc thấy request CDN hoặc hết thời gian chờ
+            self.metrics.observe(PLAYWRIGHT_STAGE, urlparse(url).netloc, time.monotonic() - started,
+                                 "ok" if found.done() else "failed",
+                                 exc_type=type(error) if error is not None and not found.done() else None)
+
+        if found.done():
+            self.resolved += 1
+            return found.result()
+        self.failed += 1
+        return None
+
+    def keys_per_minute(self):
+        if not self.started_at:
+            return 0.0
+        elapsed = time.perf_counter() - self.started_at
+        return (self.resolved + self.failed) / elapsed * 60 if elapsed else 0.0
@@ -0,0 +1,254 @@
+import io
+import os
+import re
+import time
+import random
+import asyncio
+import hashlib
+
+from aiohttp import web
+
+from common.tile_downloader import parse_structure_from_filename
+
+# Thay cho www.ajun720.cn và imgscdn.ajun720.cn khi benchmark: các script được trỏ sang đây bằng
+# CRAWL_SITE_URL / CRAWL_CDN_URL (xem common/grid_discovery.py, common/cdn_extractor.py)
+HOST = "127.0.0.1"
+SITE_PORT = 8781
+CDN_PORT = 8782
+TILE_SIZE = 512
+TILE_QUALITY = 80
+# Dùng khi không có output_structure/ để lấy phân bố layout thật
+LAYOUTS = ("l1_l1_2_2", "l2_l1_2_2_l2_3_3", "l3_l1_2_2_l2_3_3_l3_5_5", "l3_l1_2_2_l2_3_3_l3_7_7")
+HACKING_PAGE = "<html><body>Hacking attempt!</body></html>"
+TOUR_PAGE = ('<html><head><script src="/tour/tour.js"></script></head><body><div id="pano"></div>'
+             '<script>embedpano({{xml: "https://imgscdn.ajun720.cn/{cdn_path}/tour.xml", target: "pano"}});'
+             '</script></body></html>')
+TILE_RE = re.compile(r"^/(\d+/works/\w+)/([fblrud])/l(\d+)/(\d+)/l\d+_[fblrud]_(\d+)_(\d+)\.jpg$")
+PREVIEW_RE = re.compile(r"^/(\d+/works/\w+)/preview\.jpg$")
+
+def make_jpeg(width, height, seed=0, quality=TILE_QUALITY):
+    # Nhiễu làm mờ: dung lượng gần với tile thật hơn ảnh một màu, và TileVerifier đọc được
+    from PIL import Image, ImageFilter
+
+    rng = random.Random(seed)
+    image = Image.effect_noise((width, height), 60).filter(ImageFilter.GaussianBlur(2))
+    image = Image.merge("RGB", [image.point(lambda v, shift=rng.randint(0, 80): min(255, v + shift))
+                                for _ in range(3)])
+    buf = io.BytesIO()
+    image.save(buf, "JPEG", quality=quality)
+    return buf.getvalue()
+
+def layout_weights(structure_dir):
+    # Phân bố layout theo số dòng trong output_structure/, như download_image/benchmark_discovery.py
+    weighted = {}
+    if structure_dir and os.path.isdir(structure_dir):
+        for fname in sorted(os.listdir(structure_dir)):
+            if fname.endswith(".txt"):
+                with open(os.path.join(structure_dir, fname)) as f:
+                    weighted[fname[:-4]] = max(sum(1 for line in f if line.strip()), 1)
+    return weighted or {name: 1 for name in LAYOUTS}
+
+class SimProduct:
+    def __init__(self, key, cdn_path, structure, has_preview=True, has_tiles=True, has_cdn=True, blocked=False):
+        self.key = key
+        self.cdn_path = cdn_path
+        self.structure = structure
+        self.levels = parse_structure_from_filename(structure)
+        self.has_preview = has_preview
+        self.has_tiles = has_tiles
+        self.has_cdn = has_cdn
+        self.blocked = blocked
+
+    def tile_count(self):
+        return sum(rows * cols for _, rows, cols in self.levels) * 6
+
+    def has_tile(self, level_num, row, col):
+        if not self.has_tiles:
+            return False
+        for lv, rows, cols in self.levels:
+            if lv == level_num:
+                return 1 <= row <= rows and 1 <= col <= cols
+        return False
+
+def make_products(count, layouts=None, missing_rate=0.0, no_cdn_rate=0.0, blocked_rate=0.0, seed=0):
+    # Cùng seed cho cùng danh sách product: kết quả benchmark so được giữa các lần chạy
+    rng = random.Random(seed)
+    layouts = layouts or {name: 1 for name in LAYOUTS}
+    names, weights = zip(*sorted(layouts.items()))
+    products = []
+    for _ in range(count):
+        key = f"{rng.getrandbits(64):016x}"
+        cdn_path = f"{rng.randint(100, 999)}/works/{rng.getrandbits(64):016x}"
+        missing = rng.random() < missing_rate
+        products.append(SimProduct(
+            key, cdn_path, rng.choices(names, weights=weights)[0],
+            # Product thiếu ảnh: nửa thiếu preview, nửa thiếu cả tile
+            has_preview=not (missing and rng.random() < 0.5),
+            has_tiles=not missing or rng.random() < 0.5,
+            has_cdn=rng.random() >= no_cdn_rate,
+            blocked=rng.random() < blocked_rate,
+        ))
+    return products
+
+class SimStats:
+    def __init__(self):
+        self.requests = 0
+        self.statuses = {}
+        self.bytes = 0
+        self.tiles = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def snapshot(self):
+        return {"requests": self.requests, "statuses": dict(self.statuses), "bytes": self.bytes,
+                "tiles": self.tiles, "max_in_flight": self.max_in_flight}
+
+class TokenBucket:
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+class CdnSimulator:
+    # Hai server aiohttp: trang tour (www) và CDN ảnh (imgscdn). Latency, băng thông, tỉ lệ lỗi,
+    # tile bị cắt cụt và giới hạn tốc độ cấu hình được; mọi request được đếm trong stats
+    def __init__(self, products, latency=0.02, jitter=0.01, bandwidth=None, error_rate=0.0, truncate_rate=0.0,
+                 rate_limit=None, max_in_flight=None, block_rate=0.0, seed=0):
+        self.products = {product.key: product for product in products}
+        self.by_path = {product.cdn_path: product for product in products}
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth  # byte/s cho mỗi response
+        self.error_rate = error_rate  # tỉ lệ 500
+        self.truncate_rate = truncate_rate  # tỉ lệ tile 200 nhưng bị cắt nửa
+        self.rate_limit = rate_limit  # request/s cho mỗi host, quá thì 429 (CDN) hoặc "hacking attempt" (tour)
+        self.max_in_flight = max_in_flight  # request đồng thời cho mỗi host, quá thì 503
+        self.block_rate = block_rate  # tỉ lệ trang tour trả "hacking attempt" dù key không bị chặn
+        self.rng = random.Random(seed)
+        self.stats = {"site": SimStats(), "cdn": SimStats()}
+        self._buckets = {name: TokenBucket(rate_limit) for name in self.stats} if rate_limit else {}
+        self._tiles = {}
+        self._runners = []
+        self.site_url = None
+        self.cdn_url = None
+
+    def tile_body(self, level_num):
+        # Một ảnh cho mỗi level là đủ: nội dung không ảnh hưởng tới tốc độ tải
+        if level_num not in self._tiles:
+            self._tiles[level_num] = make_jpeg(TILE_SIZE, TILE_SIZE, seed=level_num)
+        return self._tiles[level_num]
+
+    async def _delay(self):
+        delay = self.latency + self.rng.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _middleware(self, name, overload_response):
+        @web.middleware
+        async def middleware(request, handler):
+            stats = self.stats[name]
+            stats.requests += 1
+            stats.in_flight += 1
+            stats.max_in_flight = max(stats.max_in_flight, stats.in_flight)
+            try:
+                await self._delay()
+                if self.max_in_flight and stats.in_flight > self.max_in_flight:
+                    resp = web.Response(status=503)
+                elif self._buckets and not self._buckets[name].take():
+                    resp = overload_response()
+                elif self.error_rate and self.rng.random() < self.error_rate:
+                    resp = web.Response(status=500)
+                else:
+                    resp = await handler(request)
+                size = len(resp.body) if resp.body is not None and request.method != "HEAD" else 0
+                if self.bandwidth and size:
+                    await asyncio.sleep(size / self.bandwidth)
+                stats.statuses[resp.status] = stats.statuses.get(resp.status, 0) + 1
+                stats.bytes += size
+                return resp
+            finally:
+                stats.in_flight -= 1
+
+        return middleware
+
+    async def tour_page(self, request):
+        product = self.products.get(request.match_info["key"])
+        if product is None:
+            return web.Response(status=404)
+        if product.blocked or (self.block_rate and self.rng.random() < self.block_rate):
+            return web.Response(text=HACKING_PAGE, content_type="text/html")
+        if not product.has_cdn:
+            return web.Response(text="<html><body>Sản phẩm không có ảnh 360</body></html>", content_type="text/html")
+        return web.Response(text=TOUR_PAGE.format(cdn_path=product.cdn_path), content_type="text/html")
+
+    async def cdn_file(self, request):
+        path = request.path
+        match = TILE_RE.match(path)
+        if match:
+            cdn_path, _, level_num, row, _, col = match.groups()
+            product = self.by_path.get(cdn_path)
+            if product is None or not product.has_tile(int(level_num), int(row), int(col)):
+                return web.Response(status=404)
+            body = self.tile_body(int(level_num))
+            if request.method == "GET":
+                self.stats["cdn"].tiles += 1
+        else:
+            match = PREVIEW_RE.match(path)
+            product = self.by_path.get(match.group(1)) if match else None
+            if product is None or not product.has_preview:
+                return web.Response(status=404)
+            body = self.tile_body(0)
+
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+        if request.method == "GET" and self.truncate_rate and self.rng.random() < self.truncate_rate:
+            body = body[:len(body) // 2]
+        return web.Response(body=body, content_type="image/jpeg", headers={"ETag": etag})
+
+    def site_app(self):
+        app = web.Application(middlewares=[self._middleware("site", lambda: web.Response(
+            text=HACKING_PAGE, content_type="text/html"))])
+        app.router.add_get("/", lambda request: web.Response(text="<html>ajun720</html>", content_type="text/html"))
+        app.router.add_get("/tour/{key}", self.tour_page)
+        # ProductValidator.tour_blocked GET thẳng {TOUR_URL}/{key}
+        app.router.add_get("/{key}", self.tour_page)
+        return app
+
+    def cdn_app(self):
+        app = web.Application(middlewares=[self._middleware("cdn", lambda: web.Response(status=429))])
+        app.router.add_get("/{path:.+}", self.cdn_file)
+        return app
+
+    async def start(self, host=HOST, site_port=SITE_PORT, cdn_port=CDN_PORT):
+        # Tạo sẵn ảnh để request đầu tiên không tính cả thời gian mã hoá JPEG
+        for level_num in {lv for product in self.products.values() for lv, _, _ in product.levels} | {0}:
+            self.tile_body(level_num)
+        for app, port in ((self.site_app(), site_port), (self.cdn_app(), cdn_port)):
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            await web.TCPSite(runner, host, port).start()
+            self._runners.append(runner)
+        self.site_url = f"http://{host}:{site_port}"
+        self.cdn_url = f"http://{host}:{cdn_port}"
+        return self
+
+    async def close(self):
+        for runner in self._runners:
+            await runner.cleanup()
+        self._runners = []
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
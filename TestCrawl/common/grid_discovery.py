@@ -0,0 +1,132 @@
+import os
+import asyncio
+
+# CRAWL_CDN_URL trỏ mọi stage sang CDN khác, ví dụ common/cdn_simulator.py khi benchmark
+BASE_URL = os.environ.get("CRAWL_CDN_URL", "https://imgscdn.ajun720.cn")
+MAX_LEVEL = 6
+MAX_ROW = 10
+MAX_COL = 20
+FACE = "b"
+# Level 1 thường là 2x2, các level sau lớn lên khoảng 1.5-2 lần (2_3_5_10, 2_3_7, 2_4_8...)
+FIRST_LEVEL_HINT = 2
+GROWTH = 1.6
+
+def tile_url(base_url, cdn_path, level_num, row, col, face=FACE):
+    level = f"l{level_num}"
+    return f"{base_url}/{cdn_path}/{face}/{level}/{row}/{level}_{face}_{row}_{col}.jpg"
+
+class GridProber:
+    def __init__(self, check, cdn_path, base_url=BASE_URL, face=FACE):
+        self.check = check
+        self.cdn_path = cdn_path
+        self.base_url = base_url
+        self.face = face
+        self.requests = 0
+        self._probes = {}
+
+    def exists(self, level_num, row, col):
+        # Cùng một ô có thể được hỏi bởi cả tìm hàng lẫn tìm cột, chỉ gửi một request
+        url = tile_url(self.base_url, self.cdn_path, level_num, row, col, self.face)
+        if url not in self._probes:
+            self.requests += 1
+            self._probes[url] = asyncio.ensure_future(self.check(url))
+        return self._probes[url]
+
+    def known(self, level_num, row, col):
+        # Kết quả đã có mà không cần gửi thêm request, None nếu chưa biết
+        probe = self._probes.get(tile_url(self.base_url, self.cdn_path, level_num, row, col, self.face))
+        if probe is None or not probe.done() or probe.exception():
+            return None
+        return probe.result()
+
+async def find_extent(exists, limit, hint=None):
+    # Tìm n lớn nhất trong [1, limit] mà exists(n) đúng, biết exists(1) đúng và tính đơn điệu
+    lo, hi = 1, limit + 1
+    if hint is not None:
+        hint = max(1, min(hint, limit))
+        if hint < limit:
+            hint_ok, next_ok = await asyncio.gather(exists(hint), exists(hint + 1))
+        else:
+            hint_ok, next_ok = await exists(hint), False
+        if hint_ok and not next_ok:
+            return hint
+        if hint_ok:
+            lo = hint + 1
+        else:
+            hi = hint
+
+    step = 1
+    while lo + step < hi:
+        if await exists(lo + step):
+            lo += step
+            step *= 2
+        else:
+            hi = lo + step
+            break
+
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if await exists(mid):
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+async def discover_level(prober, level_num, hint=None):
+    rows, cols = await asyncio.gather(
+        find_extent(lambda r: prober.exists(level_num, r, 1), MAX_ROW, hint),
+        find_extent(lambda c: prober.exists(level_num, 1, c), MAX_COL, hint),
+    )
+    return (f"l{level_num}", rows, cols)
+
+def predict_size(first_size, level_num):
+    return round(first_size * GROWTH ** (level_num - 1))
+
+async def discover_structure(check, cdn_path, base_url=BASE_URL, hints=None, prober=None):
+    prober = prober or GridProber(check, cdn_path, base_url)
+
+    # Ô đầu của mọi level được hỏi cùng lúc, các level có mặt là đoạn liên tiếp từ l1
+    firsts = await asyncio.gather(*(prober.exists(lv, 1, 1) for lv in range(1, MAX_LEVEL + 1)))
+    level_count = 0
+    for ok in firsts:
+        if not ok:
+            break
+        level_count += 1
+    if not level_count:
+        return [], prober.requests
+
+    hints = hints or {}
+    first = await discover_level(prober, 1, hints.get(1, FIRST_LEVEL_HINT))
+    first_size = max(first[1], first[2])
+    rest = await asyncio.gather(*(
+        discover_level(prober, lv, hints.get(lv, predict_size(first_size, lv)))
+        for lv in range(2, level_count + 1)
+    ))
+    return [first] + list(rest), prober.requests
+
+async def get_structure_sequential(check, cdn_path, base_url=BASE_URL):
+    # Thuật toán dò tuần tự ban đầu của 1_classify_tile_type.py, giữ lại để so sánh
+    structure = []
+    requests = 0
+
+    for level_num in range(1, MAX_LEVEL + 1):
+        requests += 1
+        if not await check(tile_url(base_url, cdn_path, level_num, 1, 1)):
+            break
+
+        max_row, max_col = 0, 0
+        for row in range(1, MAX_ROW + 1):
+            col_count = 0
+            for col in range(1, MAX_COL + 1):
+                requests += 1
+                if await check(tile_url(base_url, cdn_path, level_num, row, col)):
+                    col_count += 1
+                else:
+                    break
+            if col_count == 0:
+                break
+            max_row += 1
+            max_col = max(max_col, col_count)
+
+        structure.append((f"l{level_num}", max_row, max_col))
+    return structure, requests
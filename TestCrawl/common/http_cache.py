@@ -0,0 +1,195 @@
+import os
+import time
+import sqlite3
+
+from common.rate_controller import HTTP_STAGE, unlimited_slot
+
+HTTP_CACHE_FILE = "http_cache.sqlite3"
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 2.0
+CHUNK_SIZE = 1 << 16
+# Kết quả HEAD 200 được dùng lại trong khoảng này mà không hỏi lại CDN
+HEAD_TTL = 7 * 24 * 3600
+# 404 cũng được dùng lại giữa các stage, nhưng ngắn hơn vì ảnh có thể được upload sau
+MISS_TTL = 6 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    url TEXT PRIMARY KEY,
+    status INTEGER NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    size INTEGER,
+    checked_at REAL NOT NULL
+);
+"""
+
+def content_size(resp):
+    # Với 206, tổng kích thước nằm sau dấu "/" của Content-Range
+    content_range = resp.headers.get("Content-Range", "")
+    if "/" in content_range and not content_range.endswith("/*"):
+        return int(content_range.rsplit("/", 1)[1])
+    length = resp.headers.get("Content-Length")
+    return int(length) if length is not None else None
+
+class HttpCache:
+    def __init__(self, path=HTTP_CACHE_FILE, head_ttl=HEAD_TTL, miss_ttl=MISS_TTL, revalidate=False,
+                 controller=None, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.head_ttl = head_ttl
+        self.miss_ttl = miss_ttl
+        # RateController (common/rate_controller.py) cho các request thật sự gửi đi
+        self.controller = controller
+        # True: file đã đủ vẫn được hỏi lại CDN bằng If-None-Match/If-Modified-Since
+        self.revalidate = revalidate
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._entries = {}
+        self._last_flush = time.monotonic()
+        self.hits = 0
+        self.not_modified = 0
+        self.resumed = 0
+        self.fetched = 0
+        self.bytes = 0
+
+    def get(self, url):
+        if url in self._entries:
+            return self._entries[url]
+        row = self.conn.execute(
+            "SELECT url, status, etag, last_modified, size, checked_at FROM entries WHERE url = ?",
+            (url,)).fetchone()
+        return row
+
+    def record(self, url, status, headers=None, size=None):
+        headers = headers or {}
+        previous = self.get(url)
+        etag = headers.get("ETag") or (previous[2] if previous else None)
+        last_modified = headers.get("Last-Modified") or (previous[3] if previous else None)
+        self._entries[url] = (url, status, etag, last_modified, size, time.time())
+        if (len(self._entries) >= self.batch_size
+                or time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def forget(self, url):
+        # Bỏ bản ghi của url (ví dụ file tải về bị hỏng) để lần sau tải lại toàn bộ
+        self._entries.pop(url, None)
+        with self.conn:
+            self.conn.execute("DELETE FROM entries WHERE url = ?", (url,))
+
+    def flush(self):
+        self._last_flush = time.monotonic()
+        if not self._entries:
+            return
+        entries, self._entries = self._entries, {}
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO entries (url, status, etag, last_modified, size, checked_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)", entries.values())
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def _slot(self, url, stage):
+        return self.controller.slot(url, stage) if self.controller else unlimited_slot(stage=stage, url=url)
+
+    def validators(self, url):
+        entry = self.get(url)
+        headers = {}
+        if entry and entry[2]:
+            headers["If-None-Match"] = entry[2]
+        if entry and entry[3]:
+            headers["If-Modified-Since"] = entry[3]
+        return headers
+
+    def fresh_status(self, url):
+        entry = self.get(url)
+        if entry is None:
+            return None
+        age = time.time() - entry[5]
+        if (entry[1] == 200 and age < self.head_ttl) or (entry[1] == 404 and age < self.miss_ttl):
+            return entry[1]
+        return None
+
+    async def head(self, session, url, stage=HTTP_STAGE, **kwargs):
+        # Trả về status, dùng lại kết quả 200/404 còn hạn thay vì gửi request
+        status = self.fresh_status(url)
+        if status is not None:
+            self.hits += 1
+            return status
+        async with self._slot(url, stage) as slot, session.head(url, **kwargs) as resp:
+            slot.status(resp.status)
+            self.record(url, resp.status, resp.headers, content_size(resp))
+            return resp.status
+
+    def verified(self, url, dest):
+        entry = self.get(url)
+        return (entry is not None and entry[1] == 200 and entry[4] is not None
+                and os.path.exists(dest) and os.path.getsize(dest) == entry[4])
+
+    async def download(self, session, url, dest, resume=False, stage=HTTP_STAGE):
+        # Trả về số byte đã nhận (0 nếu không cần tải lại) khi dest chứa bản đầy đủ của url, None nếu lỗi
+        verified = self.verified(url, dest)
+        if verified and not self.revalidate:
+            self.hits += 1
+            return 0
+
+        if os.path.exists(dest) and self.get(url) is None:
+            # File có từ trước khi có cache: chỉ so kích thước bằng HEAD, không tải thân
+            async with self._slot(url, stage) as slot, session.head(url) as resp:
+                slot.status(resp.status)
+                size = content_size(resp)
+                if resp.status == 200 and size == os.path.getsize(dest):
+                    self.record(url, 200, resp.headers, size)
+                    self.hits += 1
+                    return 0
+
+        # Chỉ gửi validator khi bản trên đĩa đúng là bản đã ghi nhận, file hỏng thì tải lại toàn bộ
+        headers = self.validators(url) if verified else {}
+        part_path = f"{dest}.part"
+        offset = os.path.getsize(part_path) if resume and os.path.exists(part_path) else 0
+        entry = self.get(url)
+        if offset and entry and (entry[2] or entry[3]):
+            # If-Range: server chỉ trả 206 khi bản trên CDN vẫn là bản đã tải dở
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = entry[2] or entry[3]
+        else:
+            offset = 0
+
+        async with self._slot(url, stage) as slot, session.get(url, headers=headers) as resp:
+            slot.status(resp.status)
+            if resp.status == 304:
+                self.record(url, 200, resp.headers, os.path.getsize(dest))
+                self.not_modified += 1
+                return 0
+            if resp.status not in (200, 206):
+                return None
+
+            size = content_size(resp)
+            # Ghi size và validator ngay để lần sau có thể resume phần .part
+            self.record(url, resp.status, resp.headers, size)
+            os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+            mode = "ab" if resp.status == 206 else "wb"
+            if resp.status == 206:
+                self.resumed += 1
+            received = 0
+            with open(part_path, mode) as f:
+                async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                    f.write(chunk)
+                    received += len(chunk)
+                    self.bytes += len(chunk)
+                    slot.received(len(chunk))
+
+        if size is not None and os.path.getsize(part_path) != size:
+            return None
+        os.replace(part_path, dest)
+        self.record(url, 200, None, os.path.getsize(dest))
+        self.fetched += 1
+        return received
+
+    def report(self):
+        return (f"🗄️ HTTP cache: {self.hits} bỏ qua, {self.not_modified} 304, "
+                f"{self.resumed} resume, {self.fetched} tải mới, {self.bytes / 1e6:.1f} MB nhận")
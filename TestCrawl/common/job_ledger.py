@@ -0,0 +1,176 @@
+import os
+import time
+import sqlite3
+import hashlib
+
+LEDGER_FILE = "crawl_jobs.sqlite3"
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 2.0
+# Số byte đầu file được băm để nhận ra file bị ghi lại tại chỗ (cùng inode, không ngắn đi)
+HEAD_SIZE = 4096
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    stage TEXT NOT NULL,
+    product_key TEXT NOT NULL,
+    grp TEXT NOT NULL DEFAULT '',
+    payload TEXT NOT NULL DEFAULT '',
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (stage, product_key)
+);
+CREATE INDEX IF NOT EXISTS jobs_stage_status ON jobs (stage, status, grp);
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    stage TEXT NOT NULL,
+    inode INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    head TEXT
+);
+"""
+
+def parse_line(line):
+    key, _, payload = line.partition(",")
+    return key, payload
+
+def format_line(key, payload):
+    return f"{key},{payload}" if payload else key
+
+def file_head(path, size):
+    # Hash của min(size, HEAD_SIZE) byte đầu, phần đã đọc tới offset đã lưu
+    with open(path, "rb") as f:
+        return hashlib.blake2b(f.read(min(size, HEAD_SIZE)), digest_size=16).hexdigest()
+
+class JobLedger:
+    def __init__(self, path=LEDGER_FILE, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(sources)")}
+        if "head" not in columns:
+            # Ledger tạo trước khi lưu hash đầu file: các file này chỉ được so inode và kích thước
+            self.conn.execute("ALTER TABLE sources ADD COLUMN head TEXT")
+        self._updates = []
+        self._last_flush = time.monotonic()
+
+    def add(self, stage, rows, grp="", reset=False):
+        query = "INSERT INTO jobs (stage, product_key, grp, payload, updated_at) VALUES (?, ?, ?, ?, ?) "
+        if reset:
+            query += ("ON CONFLICT(stage, product_key) DO UPDATE SET status = 'pending', "
+                      "grp = excluded.grp, payload = excluded.payload, updated_at = excluded.updated_at")
+        else:
+            query += "ON CONFLICT(stage, product_key) DO NOTHING"
+        with self.conn:
+            self.conn.executemany(query, ((stage, key, grp, payload, time.time()) for key, payload in rows))
+
+    def set_status(self, stage, key, status, payload=None):
+        self._updates.append((status, payload, time.time(), stage, key))
+        if (len(self._updates) >= self.batch_size
+                or time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        self._last_flush = time.monotonic()
+        if not self._updates:
+            return
+        updates, self._updates = self._updates, []
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE jobs SET status = ?, payload = COALESCE(?, payload), updated_at = ?, "
+                "attempts = attempts + 1 WHERE stage = ? AND product_key = ?",
+                updates,
+            )
+
+    def jobs(self, stage, status=None, grp=None):
+        query = "SELECT product_key, payload, grp FROM jobs WHERE stage = ?"
+        params = [stage]
+        if status is not None:
+            query += " AND status = ?"
+            params.append(status)
+        if grp is not None:
+            query += " AND grp = ?"
+            params.append(grp)
+        return self.conn.execute(query + " ORDER BY rowid", params).fetchall()
+
+    def unfinished(self, stage, grp=None):
+        query = "SELECT product_key, payload, grp FROM jobs WHERE stage = ? AND status != ?"
+        params = [stage, DONE]
+        if grp is not None:
+            query += " AND grp = ?"
+            params.append(grp)
+        return self.conn.execute(query + " ORDER BY rowid", params).fetchall()
+
+    def counts(self, stage):
+        rows = self.conn.execute("SELECT status, COUNT(*) FROM jobs WHERE stage = ? GROUP BY status", (stage,))
+        return dict(rows.fetchall())
+
+    def import_txt(self, stage, path, grp="", require_payload=False):
+        # Chỉ đọc phần mới ghi thêm kể từ lần nhập trước, tránh đọc lại cả danh sách khi resume
+        if not os.path.exists(path):
+            return 0
+        stat = os.stat(path)
+        row = self.conn.execute("SELECT inode, offset, head FROM sources WHERE path = ?", (path,)).fetchone()
+        # File bị tạo lại, ngắn đi hoặc bị ghi lại tại chỗ (đầu file khác): đọc lại từ đầu
+        rewritten = (row is None or row[0] != stat.st_ino or row[1] > stat.st_size
+                     or (row[2] is not None and file_head(path, row[1]) != row[2]))
+        offset = 0 if rewritten else row[1]
+        if offset == stat.st_size:
+            return 0
+
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        # Dòng cuối chưa có "\n" có thể đang được ghi dở, để lần sau đọc
+        data = data[:data.rfind(b"\n") + 1]
+        offset += len(data)
+
+        rows = []
+        for line in data.decode().splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            key, payload = parse_line(line)
+            if require_payload and not payload:
+                print(f"❌ Bỏ qua dòng lỗi: {line}")
+                continue
+            rows.append((key, payload))
+
+        # File do script khác tạo lại (chạy lại trên một phần key) chỉ thêm/đặt lại các dòng có trong file,
+        # key không có trong file giữ nguyên trạng thái. Danh sách còn lại do export_txt ghi đã khớp với
+        # ledger lúc ghi và được lưu offset ngay, nên không bị coi là file ghi lại
+        self.add(stage, rows, grp, reset=rewritten and row is not None)
+        self._save_offset(stage, path, offset)
+        return len(rows)
+
+    def export_txt(self, stage, path, status=None, grp=None, unfinished=False):
+        self.flush()
+        rows = self.unfinished(stage, grp) if unfinished else self.jobs(stage, status, grp)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            for key, payload, _ in rows:
+                f.write(format_line(key, payload) + "\n")
+        os.replace(tmp_path, path)
+        self._save_offset(stage, path, os.path.getsize(path))
+        return len(rows)
+
+    def _save_offset(self, stage, path, offset):
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO sources (path, stage, inode, offset, head) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET stage = excluded.stage, inode = excluded.inode, "
+                "offset = excluded.offset, head = excluded.head",
+                (path, stage, os.stat(path).st_ino, offset, file_head(path, offset)),
+            )
+
+    def close(self):
+        self.flush()
+        self.conn.close()
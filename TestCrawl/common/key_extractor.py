@@ -0,0 +1,169 @@
+import os
+import re
+import sqlite3
+
+KEY_SET_FILE = "key_set.sqlite3"
+# Mỗi product có hai link tới trang tour trong trang danh sách (ảnh + tiêu đề), nên output.txt cũ bị lặp từng cặp
+KEY_PATTERN = re.compile(rb'href="/tour/([0-9a-f]{16})"')
+# Một match dài tối đa chừng này byte, giữ lại ở cuối chunk để không cắt đôi link giữa hai lần đọc
+MAX_MATCH = 64
+CHUNK_SIZE = 1 << 20
+# Chèn key ngẫu nhiên vào B-tree là phần tốn nhất: commit theo lô lớn và cache trang lớn hơn mặc định (2MB)
+BATCH_SIZE = 50000
+CACHE_SIZE_KB = 64 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS keys (
+    product_key TEXT PRIMARY KEY
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS pages (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    keys INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    inode INTEGER NOT NULL,
+    offset INTEGER NOT NULL
+);
+"""
+
+def page_number(path):
+    # crawl_2.html trước crawl_10.html để thứ tự key giống thứ tự trang đã crawl
+    digits = re.findall(r"\d+", os.path.basename(path))
+    return (int(digits[-1]) if digits else 0, path)
+
+def extract_keys(path, chunk_size=CHUNK_SIZE):
+    # Quét regex trên bytes theo từng chunk, không dựng DOM và không nạp cả file vào bộ nhớ.
+    # Trả về (path, các key theo thứ tự xuất hiện, đã bỏ trùng trong trang)
+    keys = []
+    seen = set()
+    tail = b""
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            data = tail + chunk
+            last_end = 0
+            for match in KEY_PATTERN.finditer(data):
+                key = match.group(1).decode()
+                if key not in seen:
+                    seen.add(key)
+                    keys.append(key)
+                last_end = match.end()
+            tail = data[max(last_end, len(data) - MAX_MATCH):]
+    return path, keys
+
+class KeySet:
+    # Tập key đã biết trên đĩa (SQLite, không giữ trong RAM) cùng trạng thái của từng trang đã quét,
+    # nên lần chạy sau chỉ đọc trang mới/đã thay đổi và chỉ ghi thêm key mới
+    def __init__(self, path=KEY_SET_FILE):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+        self.conn.executescript(SCHEMA)
+        self.added = 0
+        self.duplicates = 0
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM keys").fetchone()[0]
+
+    def _insert(self, keys):
+        # Trả về các key chưa có trong tập; gọi bên trong một transaction
+        new_keys = []
+        for key in keys:
+            cursor = self.conn.execute("INSERT OR IGNORE INTO keys (product_key) VALUES (?)", (key,))
+            if cursor.rowcount:
+                new_keys.append(key)
+        return new_keys
+
+    def page_changed(self, path):
+        stat = os.stat(path)
+        row = self.conn.execute("SELECT size, mtime_ns FROM pages WHERE path = ?", (path,)).fetchone()
+        return row is None or row != (stat.st_size, stat.st_mtime_ns)
+
+    def _save_page(self, path, count):
+        stat = os.stat(path)
+        self.conn.execute(
+            "INSERT INTO pages (path, size, mtime_ns, keys) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(path) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns, "
+            "keys = excluded.keys",
+            (path, stat.st_size, stat.st_mtime_ns, count),
+        )
+
+    def _save_offset(self, path):
+        stat = os.stat(path)
+        self.conn.execute(
+            "INSERT INTO sources (path, inode, offset) VALUES (?, ?, ?) "
+            "ON CONFLICT(path) DO UPDATE SET inode = excluded.inode, offset = excluded.offset",
+            (path, stat.st_ino, stat.st_size),
+        )
+
+    def sync_file(self, path):
+        # Đưa vào tập các key có trong file danh sách mà tập chưa biết: lần chạy đầu (file làm tay),
+        # key thêm tay, hoặc key đã ghi file nhưng dừng trước khi commit. Chỉ đọc phần sau offset đã lưu
+        if not os.path.exists(path):
+            return 0
+        stat = os.stat(path)
+        row = self.conn.execute("SELECT inode, offset FROM sources WHERE path = ?", (path,)).fetchone()
+        offset = 0 if row is None or row[0] != stat.st_ino or row[1] > stat.st_size else row[1]
+        if offset == stat.st_size:
+            return 0
+        with open(path, "rb") as f:
+            f.seek(offset)
+            keys = [line.strip() for line in f.read().decode().splitlines() if line.strip()]
+        with self.conn:
+            count = len(self._insert(keys))
+            self._save_offset(path)
+        return count
+
+    def add_pages(self, results, output_path):
+        # results: (path, keys) theo thứ tự trang. Key mới được ghi thêm vào output_path rồi mới commit,
+        # dừng giữa chừng thì sync_file của lần sau nhận lại phần đã ghi nên không bị lặp
+        needs_newline = False
+        if os.path.exists(output_path) and os.path.getsize(output_path):
+            # File làm tay có thể thiếu "\n" ở dòng cuối, không để key mới dính vào key cũ
+            with open(output_path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b"\n"
+        new_total = 0
+        with open(output_path, "a") as output:
+            if needs_newline:
+                output.write("\n")
+            batch = []
+            pending = 0
+            for path, keys in results:
+                batch.append((path, keys))
+                pending += len(keys)
+                if pending >= BATCH_SIZE:
+                    new_total += self._commit(batch, output, output_path)
+                    batch = []
+                    pending = 0
+            if batch:
+                new_total += self._commit(batch, output, output_path)
+        return new_total
+
+    def _commit(self, batch, output, output_path):
+        new_keys = []
+        with self.conn:
+            for path, keys in batch:
+                page_keys = self._insert(keys)
+                self.added += len(page_keys)
+                self.duplicates += len(keys) - len(page_keys)
+                new_keys.extend(page_keys)
+                self._save_page(path, len(keys))
+            if new_keys:
+                output.write("".join(f"{key}\n" for key in new_keys))
+            output.flush()
+            os.fsync(output.fileno())
+            self._save_offset(output_path)
+        return len(new_keys)
+
+    def report(self):
+        return f"🔑 Tập key: {len(self)} key, thêm {self.added} mới, {self.duplicates} trùng"
+
+    def close(self):
+        self.conn.close()
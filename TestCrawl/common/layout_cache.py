@@ -0,0 +1,125 @@
+import os
+import json
+import asyncio
+
+from common.grid_discovery import BASE_URL, MAX_LEVEL, MAX_ROW, MAX_COL, GridProber, discover_structure
+from common.tile_downloader import parse_structure_from_filename
+
+LAYOUT_CACHE_FILE = "layout_signatures.json"
+# Số signature phổ biến nhất được thử trước khi dò đầy đủ
+MAX_CANDIDATES = 3
+
+def signature_name(structure):
+    parts = [f"l{len(structure)}"]
+    for level, row, col in structure:
+        parts.append(f"{level}_{row}_{col}")
+    return "_".join(parts)
+
+def expected_probes(levels):
+    # Ô cuối mỗi level tồn tại, ô kế tiếp theo hàng/cột và level kế tiếp thì không
+    probes = []
+    for lv, rows, cols in levels:
+        probes.append(((lv, rows, cols), True))
+        if rows < MAX_ROW:
+            probes.append(((lv, rows + 1, cols), False))
+        if cols < MAX_COL:
+            probes.append(((lv, rows, cols + 1), False))
+    if len(levels) < MAX_LEVEL:
+        probes.append(((len(levels) + 1, 1, 1), False))
+    return probes
+
+def layout_check(levels):
+    # HEAD giả lập từ một layout đã biết, dùng để tính chi phí dò đầy đủ mà không gửi request
+    sizes = {lv: (rows, cols) for lv, rows, cols in levels}
+
+    async def check(url):
+        lv, _, row, col = url.rsplit("/", 1)[-1][:-len(".jpg")].split("_")
+        rows, cols = sizes.get(int(lv[1:]), (0, 0))
+        return int(row) <= rows and int(col) <= cols
+    return check
+
+async def verify_layout(prober, levels):
+    probes = expected_probes(levels)
+    # Bỏ qua ngay nếu một kết quả đã biết mâu thuẫn, không tốn request
+    for (lv, r, c), expected in probes:
+        known = prober.known(lv, r, c)
+        if known is not None and known != expected:
+            return False
+    results = await asyncio.gather(*(prober.exists(lv, r, c) for (lv, r, c), _ in probes))
+    return all(result == expected for result, (_, expected) in zip(results, probes))
+
+class LayoutCache:
+    def __init__(self, path=LAYOUT_CACHE_FILE, max_candidates=MAX_CANDIDATES):
+        self.path = path
+        self.max_candidates = max_candidates
+        self.counts = {}
+        self.hits = 0
+        self.misses = 0
+        self.hit_requests = 0
+        self.miss_requests = 0
+        self.saved_requests = 0
+        self._discovery_costs = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.counts = json.load(f)
+
+    def seed_from_dir(self, structure_dir):
+        # Lần đầu chạy: lấy tần suất từ số dòng trong các file output_structure/
+        if self.counts or not os.path.isdir(structure_dir):
+            return
+        for fname in os.listdir(structure_dir):
+            if fname.endswith(".txt"):
+                with open(os.path.join(structure_dir, fname)) as f:
+                    self.counts[fname[:-4]] = sum(1 for line in f if line.strip())
+
+    def ranked(self):
+        return sorted(self.counts, key=self.counts.get, reverse=True)
+
+    def record(self, structure):
+        name = signature_name(structure)
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.counts, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    async def classify(self, check, cdn_path, base_url=BASE_URL):
+        prober = GridProber(check, cdn_path, base_url)
+
+        for name in self.ranked()[:self.max_candidates]:
+            levels = parse_structure_from_filename(name)
+            if await verify_layout(prober, levels):
+                self.hits += 1
+                self.hit_requests += prober.requests
+                self.saved_requests += await self.discovery_cost(name, levels) - prober.requests
+                structure = [(f"l{lv}", rows, cols) for lv, rows, cols in levels]
+                self.record(structure)
+                return structure, prober.requests, True
+
+        structure, _ = await discover_structure(check, cdn_path, base_url, prober=prober)
+        self.misses += 1
+        self.miss_requests += prober.requests
+        if structure:
+            levels = [(int(level[1:]), rows, cols) for level, rows, cols in structure]
+            # Miss tốn thêm request xác minh nên phần "tiết kiệm" ở đây thường âm
+            self.saved_requests += await self.discovery_cost(signature_name(structure), levels) - prober.requests
+            self.record(structure)
+        return structure, prober.requests, False
+
+    async def discovery_cost(self, name, levels):
+        if name not in self._discovery_costs:
+            _, requests = await discover_structure(layout_check(levels), "", "")
+            self._discovery_costs[name] = requests
+        return self._discovery_costs[name]
+
+    def report(self):
+        total = self.hits + self.misses
+        if not total:
+            return "📊 Cache layout: chưa phân loại product nào"
+        return (f"📊 Cache layout: hit {self.hits}/{total} ({self.hits / total:.0%}), "
+                f"{(self.hit_requests + self.miss_requests) / total:.1f} request/product, "
+                f"tiết kiệm {self.saved_requests} request so với dò đầy đủ")
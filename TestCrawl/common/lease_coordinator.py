@@ -0,0 +1,245 @@
+import time
+import asyncio
+
+import aiohttp
+from aiohttp import web
+
+from common.job_ledger import DONE, FAILED
+from common.rate_controller import backoff_delay
+
+COORDINATOR_PORT = 8790
+# Lease hết hạn nếu worker không gửi heartbeat trong LEASE_TTL giây: product được giao cho worker khác
+LEASE_TTL = 60.0
+LEASE_BATCH = 20
+# Product bị worker báo lỗi được giao lại tới khi đủ số lần thử này (đếm riêng trong lease_attempts,
+# jobs.attempts còn tăng theo các lượt thử lại / level của 2_download_tiles_from_mapping.py)
+MAX_ATTEMPTS = 3
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=30)
+CLIENT_RETRY = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    lease_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    stage TEXT NOT NULL,
+    worker TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS lease_items (
+    stage TEXT NOT NULL,
+    product_key TEXT NOT NULL,
+    lease_id INTEGER NOT NULL,
+    PRIMARY KEY (stage, product_key)
+);
+CREATE INDEX IF NOT EXISTS lease_items_lease ON lease_items (lease_id);
+CREATE TABLE IF NOT EXISTS lease_attempts (
+    stage TEXT NOT NULL,
+    product_key TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (stage, product_key)
+);
+"""
+
+class LeaseCoordinator:
+    # Chia product trong JobLedger thành lô cho nhiều worker (nhiều máy / nhiều IP). Mỗi lô là một lease
+    # có hạn: worker gia hạn bằng heartbeat, báo kết quả khi xong; lease hết hạn thì product trở lại hàng chờ.
+    # Chỉ một process coordinator mở file SQLite, worker nói chuyện qua HTTP (coordinator_app)
+    def __init__(self, ledger, ttl=LEASE_TTL, batch_size=LEASE_BATCH, max_attempts=MAX_ATTEMPTS,
+                 on_complete=None):
+        self.ledger = ledger
+        self.conn = ledger.conn
+        self.conn.executescript(SCHEMA)
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        # on_complete(stage, key, payload, grp, result): ví dụ classify xong thì thêm job download
+        self.on_complete = on_complete
+        self.granted = 0
+        self.expired = 0
+        self.completed = 0
+        self.workers = {}
+
+    def expire(self, now=None):
+        now = now or time.time()
+        expired = [row[0] for row in self.conn.execute(
+            "SELECT lease_id FROM leases WHERE expires_at < ?", (now,))]
+        if not expired:
+            return 0
+        with self.conn:
+            self.conn.executemany("DELETE FROM lease_items WHERE lease_id = ?", ((i,) for i in expired))
+            self.conn.executemany("DELETE FROM leases WHERE lease_id = ?", ((i,) for i in expired))
+        self.expired += len(expired)
+        print(f"⏰ {len(expired)} lease hết hạn, product được giao lại")
+        return len(expired)
+
+    def acquire(self, stage, worker, limit=None):
+        # Trả về lease mới gồm tối đa limit product chưa xong và chưa bị lease khác giữ, None nếu hết việc
+        self.ledger.flush()
+        now = time.time()
+        self.expire(now)
+        self.workers[worker] = now
+        rows = self.conn.execute(
+            "SELECT j.product_key, j.payload, j.grp FROM jobs j LEFT JOIN lease_attempts a "
+            "ON a.stage = j.stage AND a.product_key = j.product_key "
+            "WHERE j.stage = ? AND j.status != ? AND COALESCE(a.attempts, 0) < ? "
+            "AND j.product_key NOT IN (SELECT product_key FROM lease_items WHERE stage = ?) "
+            "ORDER BY COALESCE(a.attempts, 0), j.rowid LIMIT ?",
+            (stage, DONE, self.max_attempts, stage, min(limit or self.batch_size, self.batch_size)),
+        ).fetchall()
+        if not rows:
+            return None
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO leases (stage, worker, expires_at, created_at) VALUES (?, ?, ?, ?)",
+                (stage, worker, now + self.ttl, now))
+            lease_id = cursor.lastrowid
+            self.conn.executemany("INSERT INTO lease_items (stage, product_key, lease_id) VALUES (?, ?, ?)",
+                                  ((stage, key, lease_id) for key, _, _ in rows))
+        self.granted += 1
+        return {"lease_id": lease_id, "stage": stage, "ttl": self.ttl, "items": [list(row) for row in rows]}
+
+    def heartbeat(self, lease_id, worker):
+        # False nếu lease đã hết hạn (và có thể đã giao cho worker khác): worker nên bỏ lô này
+        self.workers[worker] = time.time()
+        with self.conn:
+            cursor = self.conn.execute("UPDATE leases SET expires_at = ? WHERE lease_id = ? AND worker = ?",
+                                       (time.time() + self.ttl, lease_id, worker))
+        return cursor.rowcount == 1
+
+    def complete(self, lease_id, worker, stage, results):
+        # results: [key, status, result]. DONE vẫn được ghi dù lease đã hết hạn: tile đã tải là tải xong.
+        # Lỗi từ lease đã hết hạn bị bỏ qua nếu product đang nằm trong lease của worker khác.
+        # Product không có trong results được trả lại hàng chờ mà không tính là một lần thử
+        self.workers[worker] = time.time()
+        held = self.conn.execute("SELECT 1 FROM leases WHERE lease_id = ? AND worker = ?",
+                                 (lease_id, worker)).fetchone() is not None
+        now = time.time()
+        finished = []
+        with self.conn:
+            for key, status, result in results:
+                row = self.conn.execute("SELECT payload, grp, status FROM jobs WHERE stage = ? AND product_key = ?",
+                                        (stage, key)).fetchone()
+                # Worker khác đã xong product này sau khi lease cũ hết hạn
+                if row is None or row[2] == DONE:
+                    continue
+                status = DONE if status == DONE else FAILED
+                if status == FAILED:
+                    holder = self.conn.execute("SELECT lease_id FROM lease_items WHERE stage = ? AND product_key = ?",
+                                               (stage, key)).fetchone()
+                    if holder is not None and holder[0] != lease_id:
+                        continue
+                    self.conn.execute(
+                        "INSERT INTO lease_attempts (stage, product_key, attempts) VALUES (?, ?, 1) "
+                        "ON CONFLICT(stage, product_key) DO UPDATE SET attempts = attempts + 1", (stage, key))
+                self.conn.execute(
+                    "UPDATE jobs SET status = ?, updated_at = ?, attempts = attempts + 1 "
+                    "WHERE stage = ? AND product_key = ?", (status, now, stage, key))
+                if status == DONE:
+                    finished.append((stage, key, row[0], row[1], result))
+            if held:
+                self.conn.execute("DELETE FROM lease_items WHERE lease_id = ?", (lease_id,))
+                self.conn.execute("DELETE FROM leases WHERE lease_id = ?", (lease_id,))
+        self.completed += len(finished)
+        if self.on_complete:
+            for item in finished:
+                self.on_complete(*item)
+        return held
+
+    def release(self, lease_id, worker):
+        return self.complete(lease_id, worker, None, [])
+
+    def active_leases(self):
+        return self.conn.execute("SELECT COUNT(*) FROM leases").fetchone()[0]
+
+    def remaining(self, stage):
+        # Product còn có thể được giao (chưa xong, chưa hết lượt thử), kể cả đang nằm trong lease
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM jobs j LEFT JOIN lease_attempts a "
+            "ON a.stage = j.stage AND a.product_key = j.product_key "
+            "WHERE j.stage = ? AND j.status != ? AND COALESCE(a.attempts, 0) < ?",
+            (stage, DONE, self.max_attempts)).fetchone()[0]
+
+    def status(self, stages):
+        self.ledger.flush()
+        self.expire()
+        remaining = {stage: self.remaining(stage) for stage in stages}
+        return {
+            "stages": {stage: self.ledger.counts(stage) for stage in stages},
+            "remaining": remaining,
+            "leases": self.active_leases(),
+            # Worker dừng khi không còn product nào chờ hay đang chạy ở mọi stage
+            "finished": not any(remaining.values()),
+        }
+
+    def report(self):
+        return (f"🗂️ Coordinator: {self.granted} lease đã giao, {self.expired} hết hạn, "
+                f"{self.completed} product xong, {len(self.workers)} worker, {self.active_leases()} lease đang chạy")
+
+def coordinator_app(coordinator, stages):
+    # API JSON cho worker: POST /lease, /heartbeat, /complete, /release và GET /status
+    async def lease(request):
+        body = await request.json()
+        return web.json_response(coordinator.acquire(body["stage"], body["worker"], body.get("limit")))
+
+    async def heartbeat(request):
+        body = await request.json()
+        return web.json_response({"held": coordinator.heartbeat(body["lease_id"], body["worker"])})
+
+    async def complete(request):
+        body = await request.json()
+        held = coordinator.complete(body["lease_id"], body["worker"], body["stage"], body["results"])
+        return web.json_response({"held": held})
+
+    async def release(request):
+        body = await request.json()
+        return web.json_response({"held": coordinator.release(body["lease_id"], body["worker"])})
+
+    async def status(request):
+        return web.json_response(coordinator.status(stages))
+
+    app = web.Application()
+    app.router.add_post("/lease", lease)
+    app.router.add_post("/heartbeat", heartbeat)
+    app.router.add_post("/complete", complete)
+    app.router.add_post("/release", release)
+    app.router.add_get("/status", status)
+    return app
+
+class CoordinatorClient:
+    # Phía worker của coordinator_app; lỗi mạng tạm thời được thử lại, quá CLIENT_RETRY lần thì raise
+    def __init__(self, session, url, worker, retries=CLIENT_RETRY):
+        self.session = session
+        self.url = url.rstrip("/")
+        self.worker = worker
+        self.retries = retries
+
+    async def _call(self, method, path, body=None):
+        for attempt in range(1, self.retries + 1):
+            try:
+                async with self.session.request(method, f"{self.url}{path}", json=body,
+                                                timeout=REQUEST_TIMEOUT) as resp:
+                    resp.raise_for_status()
+                    return await resp.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == self.retries:
+                    raise
+                print(f"⚠️ Coordinator {path} lần {attempt}: {e!r}")
+                await asyncio.sleep(backoff_delay(attempt))
+
+    async def lease(self, stage, limit=None):
+        return await self._call("POST", "/lease", {"stage": stage, "worker": self.worker, "limit": limit})
+
+    async def heartbeat(self, lease):
+        body = {"lease_id": lease["lease_id"], "worker": self.worker}
+        return (await self._call("POST", "/heartbeat", body))["held"]
+
+    async def complete(self, lease, results):
+        body = {"lease_id": lease["lease_id"], "worker": self.worker, "stage": lease["stage"], "results": results}
+        return (await self._call("POST", "/complete", body))["held"]
+
+    async def release(self, lease):
+        body = {"lease_id": lease["lease_id"], "worker": self.worker}
+        return (await self._call("POST", "/release", body))["held"]
+
+    async def status(self):
+        return await self._call("GET", "/status")
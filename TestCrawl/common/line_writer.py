@@ -0,0 +1,132 @@
+import os
+import time
+import asyncio
+
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 1.0
+# Hàng đợi giới hạn: worker ghi nhanh hơn đĩa thì phải chờ thay vì dồn dòng trong bộ nhớ
+QUEUE_SIZE = 10000
+
+_CLOSE = object()
+_FLUSH = object()
+
+class LineWriter:
+    # Một task ghi duy nhất cho mỗi file: các coroutine chỉ đẩy dòng vào hàng đợi, task gom thành lô,
+    # ghi + fsync ngoài event loop. atomic=True ghi vào <path>.tmp rồi đổi tên khi close(),
+    # close(commit=False) để lại bản dở dang ở <path>.partial.
+    def __init__(self, path, mode="a", atomic=False, on_flush=None,
+                 batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.atomic = atomic
+        # Gọi với các dòng của lô sau khi lô đã fsync, ví dụ để đánh dấu DONE trong ledger
+        self.on_flush = on_flush
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.tmp_path = f"{path}.tmp" if atomic else path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file = open(self.tmp_path, "w" if atomic else mode)
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.task = None
+        self.lines = 0
+        self.flushes = 0
+
+    async def start(self):
+        self.task = asyncio.create_task(self._run())
+        return self
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        # Có lỗi thì vẫn giữ các dòng đã ghi (file thường, hoặc <path>.partial khi atomic),
+        # nhưng không thay file đích bằng bản dở dang
+        await self.close(commit=exc_type is None)
+        return False
+
+    async def write(self, line):
+        await self.queue.put(line)
+
+    def _write_batch(self, batch):
+        self.file.write("".join(f"{line}\n" for line in batch))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    async def _flush(self, batch):
+        await asyncio.to_thread(self._write_batch, batch)
+        self.lines += len(batch)
+        self.flushes += 1
+        if self.on_flush:
+            self.on_flush(batch)
+
+    async def _run(self):
+        batch = []
+        taken = 0  # số phần tử đã lấy khỏi hàng đợi nhưng chưa task_done()
+        deadline = None
+        while True:
+            # Không có dòng nào đang chờ thì ngủ tới khi có dòng mới, không thức dậy vô ích
+            timeout = max(deadline - time.monotonic(), 0) if batch else None
+            try:
+                items = [await asyncio.wait_for(self.queue.get(), timeout)]
+            except asyncio.TimeoutError:
+                items = []
+            # Lấy luôn các dòng đã nằm sẵn trong hàng đợi
+            while items and len(batch) + len(items) < self.batch_size and not self.queue.empty():
+                items.append(self.queue.get_nowait())
+            taken += len(items)
+            lines = [item for item in items if item is not _CLOSE and item is not _FLUSH]
+            if lines and not batch:
+                deadline = time.monotonic() + self.flush_interval
+            batch.extend(lines)
+            closing = _CLOSE in items
+            forced = closing or _FLUSH in items or len(batch) >= self.batch_size
+            if batch and (forced or time.monotonic() >= deadline):
+                await self._flush(batch)
+                batch = []
+            if not batch:
+                for _ in range(taken):
+                    self.queue.task_done()
+                taken = 0
+            if closing:
+                return
+
+    async def flush(self):
+        # Chờ tới khi mọi dòng đã write() trước đó nằm trên đĩa
+        await self.queue.put(_FLUSH)
+        await self.queue.join()
+
+    async def close(self, commit=True):
+        if self.task:
+            await self.queue.put(_CLOSE)
+            await self.task
+            self.task = None
+        if self.file.closed:
+            return
+        self.file.close()
+        if self.atomic:
+            if commit:
+                os.replace(self.tmp_path, self.path)
+            else:
+                os.replace(self.tmp_path, f"{self.path}.partial")
+
+class LineWriterGroup:
+    # Nhiều file đích (ví dụ mỗi cấu trúc tile một file), writer được mở khi có dòng đầu tiên
+    def __init__(self, **writer_options):
+        self.writer_options = writer_options
+        self.writers = {}
+
+    async def write(self, path, line):
+        writer = self.writers.get(path)
+        if writer is None:
+            writer = self.writers[path] = await LineWriter(path, **self.writer_options).start()
+        await writer.write(line)
+
+    async def close(self, commit=True):
+        for writer in self.writers.values():
+            await writer.close(commit)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close(commit=exc_type is None)
+        return False
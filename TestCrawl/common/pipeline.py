@@ -0,0 +1,136 @@
+import time
+import asyncio
+
+# Hàng đợi vào mỗi stage chứa tối đa concurrency * QUEUE_FACTOR item: đầy thì stage trước phải chờ
+QUEUE_FACTOR = 2
+REPORT_INTERVAL = 10.0
+
+_DONE = object()
+
+class Stage:
+    # func(item) trả về item cho stage sau, hoặc None nếu item dừng ở stage này (lỗi, không có ảnh...)
+    def __init__(self, name, func, concurrency, queue_size=None):
+        self.name = name
+        self.func = func
+        self.concurrency = concurrency
+        self.queue = asyncio.Queue(maxsize=queue_size or concurrency * QUEUE_FACTOR)
+        self.busy = 0
+        self.done = 0
+        self.passed = 0
+        self.errors = 0
+        self.max_depth = 0
+        # Tổng thời gian worker chạy func và thời gian chờ stage sau còn chỗ
+        self.busy_time = 0.0
+        self.blocked_time = 0.0
+        # Lúc item đầu tiên bắt đầu và item cuối cùng xong ở stage này
+        self.first_start = None
+        self.last_end = None
+
+    async def put(self, item):
+        await self.queue.put(item)
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    async def _worker(self, next_stage):
+        while True:
+            item = await self.queue.get()
+            if item is _DONE:
+                return
+            self.busy += 1
+            start = time.perf_counter()
+            if self.first_start is None:
+                self.first_start = start
+            try:
+                result = await self.func(item)
+            except Exception as e:
+                # Một product lỗi không được làm dừng cả pipeline
+                print(f"⚠️ [{self.name}] {item}: {e!r}")
+                self.errors += 1
+                result = None
+            finally:
+                self.busy -= 1
+                self.last_end = time.perf_counter()
+                self.busy_time += self.last_end - start
+            self.done += 1
+            if result is None:
+                continue
+            self.passed += 1
+            if next_stage:
+                start = time.perf_counter()
+                await next_stage.put(result)
+                self.blocked_time += time.perf_counter() - start
+
+    def span(self):
+        return self.last_end - self.first_start if self.first_start is not None else 0.0
+
+    def utilization(self, elapsed):
+        # Tỉ lệ worker bận: stage gần 100% trong khi stage trước bị chặn là nút thắt
+        return self.busy_time / (elapsed * self.concurrency) if elapsed else 0.0
+
+    def status(self):
+        return (f"{self.name} [chờ {self.queue.qsize()}/{self.queue.maxsize}, "
+                f"chạy {self.busy}/{self.concurrency}, xong {self.done}]")
+
+    def report(self, elapsed):
+        return (f"  {self.name:<10} xong {self.done}, qua {self.passed}, lỗi {self.errors}, "
+                f"bận {self.utilization(elapsed):.0%}, hàng đợi tối đa {self.max_depth}/{self.queue.maxsize}, "
+                f"chờ stage sau {self.blocked_time:.1f}s, từ item đầu tới item cuối {self.span():.1f}s")
+
+class Pipeline:
+    # Nối các stage bằng hàng đợi có giới hạn: item đi tiếp ngay khi xong stage trước,
+    # mỗi stage có số worker riêng nên thời gian tổng gần với stage chậm nhất thay vì tổng các stage
+    def __init__(self, stages, report_interval=REPORT_INTERVAL):
+        self.stages = stages
+        self.report_interval = report_interval
+        self.elapsed = 0.0
+        self._started_at = None
+
+    def status(self):
+        return " → ".join(stage.status() for stage in self.stages)
+
+    async def _monitor(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            print(f"📈 {time.perf_counter() - self._started_at:.0f}s: {self.status()}")
+
+    async def _feed(self, items):
+        first = self.stages[0]
+        if hasattr(items, "__aiter__"):
+            async for item in items:
+                await first.put(item)
+        else:
+            for item in items:
+                await first.put(item)
+
+    async def run(self, items):
+        self._started_at = time.perf_counter()
+        workers = []
+        for i, stage in enumerate(self.stages):
+            next_stage = self.stages[i + 1] if i + 1 < len(self.stages) else None
+            workers.append([asyncio.create_task(stage._worker(next_stage)) for _ in range(stage.concurrency)])
+        monitor = asyncio.create_task(self._monitor())
+        try:
+            await self._feed(items)
+            # Mỗi worker thoát khi gặp một _DONE; stage sau chỉ được đóng khi stage trước đã đẩy hết item
+            for stage, stage_workers in zip(self.stages, workers):
+                for _ in stage_workers:
+                    await stage.queue.put(_DONE)
+                await asyncio.gather(*stage_workers)
+        finally:
+            monitor.cancel()
+            tasks = [task for stage_workers in workers for task in stage_workers]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(monitor, *tasks, return_exceptions=True)
+            self.elapsed = time.perf_counter() - self._started_at
+
+    def bottleneck(self):
+        return max(self.stages, key=lambda stage: stage.utilization(self.elapsed))
+
+    def report(self):
+        # Tổng thời gian đo được từ item đầu tới item cuối của từng stage, so với thời gian thật
+        # để thấy các stage chạy chồng lên nhau bao nhiêu
+        spans = sum(stage.span() for stage in self.stages)
+        lines = [f"🧵 Pipeline {self.elapsed:.1f}s (tổng thời gian các stage {spans:.1f}s), "
+                 f"nút thắt: {self.bottleneck().name}"]
+        lines.extend(stage.report(self.elapsed) for stage in self.stages)
+        return "\n".join(lines)
@@ -0,0 +1,129 @@
+import os
+import asyncio
+
+from common.grid_discovery import BASE_URL, tile_url
+from common.rate_controller import backoff_delay, unlimited_slot
+
+# Cùng biến môi trường với common/cdn_extractor.py
+TOUR_URL = os.environ.get("CRAWL_SITE_URL", "http://www.ajun720.cn")
+CHECK_STRING = "hacking attempt"
+MAX_RETRY = 3
+TIMEOUT = 10
+# Nhãn stage của HEAD ảnh và GET trang tour trong telemetry
+METRICS_STAGE = "validate"
+
+# Trạng thái cuối cùng của một product sau một lượt kiểm tra
+VALID = "valid"
+MISSING_PREVIEW = "missing_preview"
+MISSING_TILE = "missing_tile"
+MISSING_IMAGES = "missing_images"
+BLOCKED = "blocked"
+REACHABLE = "reachable"  # không có CDN path nhưng trang tour không báo hacking attempt
+
+def preview_url(image_path, base_url=BASE_URL):
+    return f"{base_url}/{image_path}/preview.jpg"
+
+def first_tile_url(image_path, base_url=BASE_URL):
+    # Cùng URL mà 1_classify_tile_type.py dò đầu tiên, nên HEAD ở đây là cache hit ở stage sau
+    return tile_url(base_url, image_path, 1, 1, 1)
+
+def image_status(preview_ok, tile_ok):
+    if preview_ok and tile_ok:
+        return VALID
+    if not preview_ok and not tile_ok:
+        return MISSING_IMAGES
+    return MISSING_TILE if preview_ok else MISSING_PREVIEW
+
+def format_record(record):
+    return ",".join([record["key"], record["status"], record["image_path"] or ""])
+
+class ProductValidator:
+    # Một lượt kiểm tra cho mỗi product: HEAD preview + tile đầu tiên và (khi chưa có CDN path)
+    # GET trang tour tìm "hacking attempt", chạy song song trên một session dùng chung.
+    # Kết quả HEAD đi qua HttpCache nên được dùng lại giữa các stage và các lần chạy.
+    def __init__(self, session, cache=None, controller=None, base_url=BASE_URL, tour_url=TOUR_URL,
+                 retries=MAX_RETRY):
+        self.session = session
+        self.cache = cache
+        self.controller = controller
+        self.base_url = base_url
+        self.tour_url = tour_url
+        self.retries = retries
+        self.requests = 0
+        self.counts = {}
+
+    def _slot(self, url):
+        if self.controller:
+            return self.controller.slot(url, METRICS_STAGE)
+        return unlimited_slot(stage=METRICS_STAGE, url=url)
+
+    async def _head(self, url):
+        if self.cache:
+            return await self.cache.head(self.session, url, METRICS_STAGE, timeout=TIMEOUT)
+        async with self._slot(url) as slot, self.session.head(url, timeout=TIMEOUT) as resp:
+            slot.status(resp.status)
+            return resp.status
+
+    async def image_exists(self, url):
+        # 200/404 là câu trả lời chắc chắn, lỗi mạng và 5xx thì thử lại
+        for attempt in range(1, self.retries + 1):
+            try:
+                status = await self._head(url)
+                if status in (200, 404):
+                    return status == 200
+            except Exception:
+                pass
+            await asyncio.sleep(backoff_delay(attempt))
+        return False
+
+    async def tour_blocked(self, key):
+        # True khi lần thử cuối vẫn trả "hacking attempt"; lần đầu có thể chỉ do gửi quá nhanh
+        url = f"{self.tour_url}/{key}"
+        blocked = False
+        for attempt in range(1, self.retries + 1):
+            blocked = False
+            try:
+                async with self._slot(url) as slot, self.session.get(url, timeout=TIMEOUT) as resp:
+                    self.requests += 1
+                    slot.status(resp.status)
+                    text = await resp.text()
+                    if CHECK_STRING not in text.lower():
+                        return False
+                    slot.block()
+                    blocked = True
+            except Exception as e:
+                print(f"⚠️ [ERROR] {key} lần {attempt}: {e}")
+            if attempt < self.retries:
+                await asyncio.sleep(backoff_delay(attempt))
+        return blocked
+
+    async def check_images(self, image_path):
+        return await asyncio.gather(self.image_exists(preview_url(image_path, self.base_url)),
+                                    self.image_exists(first_tile_url(image_path, self.base_url)))
+
+    async def validate(self, key, image_path=None, check_tour=None):
+        # check_tour mặc định chỉ khi chưa có CDN path: product có ảnh thì trang tour chắc chắn hoạt động
+        check_tour = not image_path if check_tour is None else check_tour
+        probes = [self.check_images(image_path)] if image_path else []
+        if check_tour:
+            probes.append(self.tour_blocked(key))
+        results = await asyncio.gather(*probes)
+
+        record = {"key": key, "image_path": image_path, "preview": None, "tile": None, "blocked": None}
+        if image_path:
+            record["preview"], record["tile"] = results[0]
+        if check_tour:
+            record["blocked"] = results[-1]
+
+        if record["blocked"]:
+            record["status"] = BLOCKED
+        elif image_path:
+            record["status"] = image_status(record["preview"], record["tile"])
+        else:
+            record["status"] = REACHABLE
+        self.counts[record["status"]] = self.counts.get(record["status"], 0) + 1
+        return record
+
+    def report(self):
+        counts = ", ".join(f"{status} {count}" for status, count in sorted(self.counts.items()))
+        return f"🔎 Kiểm tra: {counts or 'chưa có product'}, {self.requests} GET trang tour"
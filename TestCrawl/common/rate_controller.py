@@ -0,0 +1,219 @@
+import time
+import random
+import asyncio
+from urllib.parse import urlparse
+
+INITIAL_WINDOW = 4
+MIN_WINDOW = 1
+MAX_WINDOW = 64
+INITIAL_RATE = 20.0  # request/s mỗi host lúc bắt đầu
+MIN_RATE = 1.0
+MAX_RATE = 500.0
+RATE_STEP = 0.5  # request/s cộng thêm sau mỗi request khỏe
+DECREASE = 0.5  # nhân window và rate khi gặp lỗi
+# Latency vượt quá baseline bao nhiêu lần thì coi là server đang quá tải, ngừng tăng
+LATENCY_TOLERANCE = 2.0
+BASELINE_DRIFT = 1.01
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+# Cả host dừng gửi trong lúc backoff nên giới hạn ngắn hơn backoff của từng request
+# (giới hạn này áp dụng cả khi đã nhân BLOCK_PENALTY)
+HOST_BACKOFF_CAP = 4.0
+# "hacking attempt" là tín hiệu chặn của origin: backoff của host bắt đầu từ BACKOFF_BASE * BLOCK_PENALTY
+BLOCK_PENALTY = 2.0
+# Lỗi lẻ tẻ (500, timeout) không giảm tốc; chỉ giảm khi tỉ lệ lỗi gần đây vượt ngưỡng
+ERROR_SMOOTHING = 0.05
+ERROR_THRESHOLD = 0.15
+# Mã trạng thái server dùng để báo quá tải, coi như bị chặn
+OVERLOAD_STATUSES = (429, 503)
+
+# Nhãn stage mặc định của request trong telemetry
+HTTP_STAGE = "http"
+
+OK = "ok"
+FAILED = "failed"
+BLOCKED = "blocked"
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    # Exponential backoff với full jitter: các request lỗi cùng lúc không thử lại cùng lúc
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+def status_outcome(status):
+    if is_healthy_status(status):
+        return OK
+    return BLOCKED if status in OVERLOAD_STATUSES else FAILED
+
+def is_healthy_status(status):
+    # 404 là câu trả lời hợp lệ (tile/level không tồn tại). Trong các mã lỗi, chỉ OVERLOAD_STATUSES (429, 503)
+    # là tín hiệu quá tải; 403, 500... là FAILED, chỉ giảm tốc khi tỉ lệ lỗi vượt ERROR_THRESHOLD
+    return status < 400 or status == 404
+
+class HostLimiter:
+    def __init__(self, initial_window=INITIAL_WINDOW, min_window=MIN_WINDOW, max_window=MAX_WINDOW,
+                 initial_rate=INITIAL_RATE, max_rate=MAX_RATE):
+        self.window = float(initial_window)
+        self.min_window = min_window
+        self.max_window = max_window
+        self.rate = initial_rate
+        self.max_rate = max_rate
+        self.tokens = 1.0
+        self.in_flight = 0
+        self.waiting = 0
+        self.base_latency = None
+        self.failures = 0  # lỗi liên tiếp, quyết định độ dài backoff
+        self.error_rate = 0.0
+        # Slow start: tăng theo cấp số nhân cho tới tín hiệu quá tải đầu tiên, sau đó mới cộng dần
+        self.slow_start = True
+        self.backoff_until = 0.0
+        self._refilled_at = time.monotonic()
+        self._decreased_at = 0.0
+        self._released = asyncio.Event()
+        self.requests = 0
+        self.errors = 0
+        self.blocked = 0
+        self.peak_window = self.window
+
+    def _refill(self, now):
+        # Bucket chứa tối đa một window token để không bắn dồn sau khi rảnh
+        self.tokens = min(max(self.window, 1.0), self.tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    async def acquire(self):
+        self.waiting += 1
+        try:
+            while True:
+                now = time.monotonic()
+                if now < self.backoff_until:
+                    await asyncio.sleep(self.backoff_until - now)
+                    continue
+                if self.in_flight >= int(self.window):
+                    self._released.clear()
+                    await self._released.wait()
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.in_flight += 1
+                    self.requests += 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+        finally:
+            self.waiting -= 1
+
+    def release(self, outcome, latency):
+        # Chỉ nới giới hạn khi còn request đang chờ, tránh phình ra lúc tải nhẹ
+        saturated = self.waiting > 0
+        self.in_flight -= 1
+        if outcome == OK:
+            self._on_success(latency, saturated)
+        else:
+            self._on_failure(outcome == BLOCKED)
+        self._released.set()
+
+    def _on_success(self, latency, saturated=True):
+        self.failures = 0
+        self.error_rate *= 1 - ERROR_SMOOTHING
+        if self.base_latency is None:
+            self.base_latency = latency
+        self.base_latency = min(latency, self.base_latency * BASELINE_DRIFT)
+        if latency > self.base_latency * LATENCY_TOLERANCE or not saturated:
+            return
+        if self.slow_start:
+            # Window và rate gần như gấp đôi sau mỗi vòng request đầy window
+            self.window = min(self.max_window, self.window + 1)
+            self.rate = min(self.max_rate, self.rate * (1 + 1 / self.window))
+        else:
+            # Additive increase: khoảng +1 window sau mỗi vòng request đầy window
+            self.window = min(self.max_window, self.window + 1 / self.window)
+            self.rate = min(self.max_rate, self.rate + RATE_STEP)
+        self.peak_window = max(self.peak_window, self.window)
+
+    def _on_failure(self, blocked):
+        now = time.monotonic()
+        self.errors += 1
+        self.blocked += blocked
+        self.error_rate = self.error_rate * (1 - ERROR_SMOOTHING) + ERROR_SMOOTHING
+        if not blocked and self.error_rate < ERROR_THRESHOLD:
+            return
+        # Nhiều request lỗi trong cùng một vòng (đã gửi trước khi giảm) chỉ tính là một lần
+        if now - self._decreased_at <= max(self.base_latency or 0, 0.1):
+            return
+        self.failures += 1
+        self.slow_start = False
+        self.window = max(self.min_window, self.window * DECREASE)
+        self.rate = max(MIN_RATE, self.rate * DECREASE)
+        self._decreased_at = now
+        base = BACKOFF_BASE * (BLOCK_PENALTY if blocked else 1)
+        delay = backoff_delay(self.failures, base=base, cap=HOST_BACKOFF_CAP)
+        self.backoff_until = max(self.backoff_until, now + delay)
+
+class Slot:
+    def __init__(self, limiter, metrics=None, stage=None, host=None):
+        self.limiter = limiter
+        # Metrics (common/telemetry.py): latency, byte và nguyên nhân lỗi của request theo stage/host
+        self.metrics = metrics
+        self.stage = stage
+        self.host = host
+        self.outcome = None
+        self.code = None
+        self.size = 0
+        self.started = 0.0
+
+    def ok(self):
+        self.outcome = OK
+
+    def fail(self):
+        self.outcome = FAILED
+
+    def block(self):
+        self.outcome = BLOCKED
+
+    def status(self, code):
+        self.code = code
+        self.outcome = status_outcome(code)
+
+    def received(self, size):
+        self.size += size
+
+    async def __aenter__(self):
+        if self.limiter:
+            await self.limiter.acquire()
+        self.started = time.monotonic()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        latency = time.monotonic() - self.started
+        # Exception (timeout, mất kết nối) mà chưa ghi nhận kết quả thì tính là lỗi
+        outcome = self.outcome or (FAILED if exc_type else OK)
+        if self.limiter:
+            self.limiter.release(outcome, latency)
+        if self.metrics:
+            self.metrics.observe(self.stage, self.host, latency, outcome, self.code, exc_type, self.size)
+        return False
+
+class RateController:
+    def __init__(self, metrics=None, **limiter_options):
+        self.metrics = metrics
+        self.limiter_options = limiter_options
+        self.hosts = {}
+
+    def limiter(self, url):
+        host = urlparse(url).netloc
+        if host not in self.hosts:
+            self.hosts[host] = HostLimiter(**self.limiter_options)
+        return self.hosts[host]
+
+    def slot(self, url, stage=HTTP_STAGE):
+        return Slot(self.limiter(url), self.metrics, stage, urlparse(url).netloc)
+
+    def report(self):
+        lines = []
+        for host, limiter in self.hosts.items():
+            lines.append(f"🚦 {host}: {limiter.requests} request, {limiter.errors} lỗi, "
+                         f"{limiter.blocked} bị chặn, window {limiter.window:.1f} "
+                         f"(đỉnh {limiter.peak_window:.1f}), {limiter.rate:.0f} request/s")
+        return "\n".join(lines) or "🚦 Chưa có request nào"
+
+def unlimited_slot(metrics=None, stage=HTTP_STAGE, url=""):
+    # Slot không giới hạn, dùng khi stage không truyền controller; vẫn đo request nếu có metrics
+    return Slot(None, metrics, stage, urlparse(url).netloc)
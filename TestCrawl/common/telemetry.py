@@ -0,0 +1,220 @@
+import os
+import json
+import time
+import random
+import asyncio
+from bisect import bisect_left
+
+METRICS_FILE = "crawl_metrics.prom"
+METRICS_JSON_FILE = "crawl_metrics.json"
+REPORT_INTERVAL = 10.0
+# Giây; bucket kiểu Prometheus, phân vị được nội suy trong bucket
+LATENCY_BUCKETS = (0.005, 0.01, 0.02, 0.03, 0.05, 0.075, 0.1, 0.15, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0,
+                   10.0, 30.0, 60.0)
+# Tỉ lệ request thành công được in ra; 0 = tắt (print từng tile tốn CPU và I/O terminal ở 40+ request song song)
+LOG_SAMPLE_RATE = 0.0
+
+# Nguyên nhân một lần thử thất bại (và phải thử lại)
+TIMEOUT = "timeout"
+NETWORK = "network"
+STATUS = "status"
+BLOCKED = "blocked"  # "hacking attempt", 429, 503
+FAILED = "failed"
+
+def failure_cause(outcome, code, exc_type):
+    # outcome theo common/rate_controller.py: "ok", "failed", "blocked"
+    if outcome == "ok" and exc_type is None:
+        return None
+    # TimeoutError của Playwright không kế thừa asyncio.TimeoutError
+    if exc_type is not None and (issubclass(exc_type, asyncio.TimeoutError) or exc_type.__name__ == "TimeoutError"):
+        return TIMEOUT
+    if exc_type is not None:
+        return NETWORK
+    if outcome == "blocked":
+        return BLOCKED
+    return STATUS if code is not None else FAILED
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # phần tử cuối là +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+class RequestStats:
+    def __init__(self):
+        self.latency = Histogram()
+        self.bytes = 0
+        self.failures = {}
+
+class Metrics:
+    # Số request, byte, histogram latency theo (stage, host) và lỗi theo nguyên nhân.
+    # Slot của RateController gọi observe cho mọi request; in tóm tắt định kỳ và ghi file Prometheus/JSON
+    def __init__(self, path=METRICS_FILE, json_path=METRICS_JSON_FILE, report_interval=REPORT_INTERVAL,
+                 log_sample_rate=LOG_SAMPLE_RATE):
+        self.path = path
+        self.json_path = json_path
+        self.report_interval = report_interval
+        self.log_sample_rate = log_sample_rate
+        self.requests = {}
+        self.counters = {}
+        self.started_at = time.perf_counter()
+        self._task = None
+        self._last = (self.started_at, {})
+
+    def observe(self, stage, host, latency, outcome="ok", code=None, exc_type=None, size=0):
+        if exc_type is not None and issubclass(exc_type, asyncio.CancelledError):
+            return
+        stats = self.requests.get((stage, host))
+        if stats is None:
+            stats = self.requests[(stage, host)] = RequestStats()
+        stats.latency.observe(latency)
+        stats.bytes += size
+        cause = failure_cause(outcome, code, exc_type)
+        if cause:
+            stats.failures[cause] = stats.failures.get(cause, 0) + 1
+
+    def inc(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def log(self, message):
+        if self.log_sample_rate and random.random() < self.log_sample_rate:
+            print(message)
+
+    def _stage_totals(self):
+        totals = {}
+        for (stage, _), stats in self.requests.items():
+            total = totals.setdefault(stage, RequestStats())
+            total.latency.merge(stats.latency)
+            total.bytes += stats.bytes
+            for cause, count in stats.failures.items():
+                total.failures[cause] = total.failures.get(cause, 0) + count
+        return totals
+
+    def summary(self):
+        # Một dòng: tốc độ tính trên khoảng từ lần tóm tắt trước, phân vị tính từ đầu
+        now = time.perf_counter()
+        last_time, last_counts = self._last
+        interval = max(now - last_time, 1e-9)
+        counts = {}
+        parts = []
+        for stage, total in sorted(self._stage_totals().items()):
+            counts[stage] = (total.latency.count, total.bytes)
+            prev_requests, prev_bytes = last_counts.get(stage, (0, 0))
+            failures = ", ".join(f"{cause} {count}" for cause, count in sorted(total.failures.items()))
+            parts.append(f"{stage} {(total.latency.count - prev_requests) / interval:.0f} req/s "
+                         f"{(total.bytes - prev_bytes) / interval / 1e6:.1f} MB/s "
+                         f"p50 {total.latency.quantile(0.5) * 1000:.0f}ms "
+                         f"p95 {total.latency.quantile(0.95) * 1000:.0f}ms "
+                         f"p99 {total.latency.quantile(0.99) * 1000:.0f}ms"
+                         + (f" (lỗi: {failures})" if failures else ""))
+        for name, value in sorted(self.counters.items()):
+            prev = last_counts.get(f"#{name}", 0)
+            counts[f"#{name}"] = value
+            parts.append(f"{name} {value} ({(value - prev) / interval:.1f}/s)")
+        self._last = (now, counts)
+        return f"📊 {now - self.started_at:.0f}s | " + (" | ".join(parts) or "chưa có request")
+
+    def to_json(self):
+        stages = []
+        for (stage, host), stats in sorted(self.requests.items()):
+            latency = stats.latency
+            stages.append({
+                "stage": stage,
+                "host": host,
+                "requests": latency.count,
+                "bytes": stats.bytes,
+                "failures": stats.failures,
+                "latency": {
+                    "p50": latency.quantile(0.5),
+                    "p95": latency.quantile(0.95),
+                    "p99": latency.quantile(0.99),
+                    "max": latency.max,
+                    "sum": latency.sum,
+                },
+            })
+        return {"uptime": time.perf_counter() - self.started_at, "requests": stages, "counters": self.counters}
+
+    def to_prometheus(self):
+        lines = ["# TYPE crawl_request_duration_seconds histogram"]
+        for (stage, host), stats in sorted(self.requests.items()):
+            labels = f'stage="{stage}",host="{host}"'
+            cumulative = 0
+            for bound, count in zip(stats.latency.buckets, stats.latency.counts):
+                cumulative += count
+                lines.append(f'crawl_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'crawl_request_duration_seconds_bucket{{{labels},le="+Inf"}} {stats.latency.count}')
+            lines.append(f"crawl_request_duration_seconds_sum{{{labels}}} {stats.latency.sum:.6f}")
+            lines.append(f"crawl_request_duration_seconds_count{{{labels}}} {stats.latency.count}")
+        lines.append("# TYPE crawl_response_bytes_total counter")
+        for (stage, host), stats in sorted(self.requests.items()):
+            lines.append(f'crawl_response_bytes_total{{stage="{stage}",host="{host}"}} {stats.bytes}')
+        lines.append("# TYPE crawl_request_failures_total counter")
+        for (stage, host), stats in sorted(self.requests.items()):
+            for cause, count in sorted(stats.failures.items()):
+                lines.append(f'crawl_request_failures_total{{stage="{stage}",host="{host}",cause="{cause}"}} {count}')
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"# TYPE crawl_{name}_total counter")
+            lines.append(f"crawl_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        # Ghi file tạm rồi đổi tên: scraper/người đọc không bao giờ thấy file ghi dở
+        for path, content in ((self.path, self.to_prometheus()),
+                              (self.json_path, json.dumps(self.to_json(), indent=2, ensure_ascii=False))):
+            if not path:
+                continue
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            print(self.summary())
+            self.write()
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.write()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
@@ -0,0 +1,276 @@
+import os
+import time
+import asyncio
+import aiohttp
+
+from common.rate_controller import backoff_delay, unlimited_slot
+from common.worker_pool import run_bounded
+from common.tile_integrity import load_levels, load_manifest, tile_position, write_levels, write_manifest
+from common.grid_discovery import BASE_URL
+
+FACES = ["f", "b", "l", "r", "u", "d"]
+OUTPUT_DIR = "image_crawled"
+MAX_IN_FLIGHT = 40
+MAX_RETRY = 3
+TIMEOUT = 10
+KEEPALIVE_TIMEOUT = 60
+DNS_CACHE_TTL = 300
+# File lớn được tải tiếp bằng Range khi bị ngắt giữa chừng
+RESUMABLE_FILES = ("preview.jpg",)
+# Nhãn stage của request tile trong telemetry
+METRICS_STAGE = "download"
+
+def parse_structure_from_filename(filename):
+    parts = filename.replace(".txt", "").split("_")
+    levels = []
+    i = 0
+    while i < len(parts):
+        if parts[i].startswith("l") and i + 2 < len(parts):
+            try:
+                lv = int(parts[i][1:])
+                row = int(parts[i + 1])
+                col = int(parts[i + 2])
+                levels.append((lv, row, col))
+                i += 3
+            except ValueError:
+                i += 1
+        else:
+            i += 1
+    return levels
+
+def make_connector(max_in_flight=MAX_IN_FLIGHT):
+    return aiohttp.TCPConnector(
+        limit=max_in_flight,
+        limit_per_host=max_in_flight,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=DNS_CACHE_TTL,
+    )
+
+def make_session(max_in_flight=MAX_IN_FLIGHT):
+    return aiohttp.ClientSession(
+        connector=make_connector(max_in_flight),
+        timeout=aiohttp.ClientTimeout(total=TIMEOUT),
+    )
+
+def tile_count(levels, preview=True):
+    # Khớp với số phần tử product_tiles sinh ra: preview + mọi ô của 6 mặt
+    return int(preview) + len(FACES) * sum(rows * cols for _, rows, cols in levels)
+
+def product_tiles(image_path, levels, folder_path, base_url=BASE_URL, preview=True):
+    if preview:
+        yield f"{base_url}/{image_path}/preview.jpg", os.path.join(folder_path, "preview.jpg")
+    for face in FACES:
+        for lv, rows, cols in levels:
+            for r in range(1, rows + 1):
+                for c in range(1, cols + 1):
+                    img_name = f"l{lv}_{face}_{r}_{c}.jpg"
+                    url = f"{base_url}/{image_path}/{face}/l{lv}/{r}/{img_name}"
+                    yield url, os.path.join(folder_path, face, f"l{lv}", str(r), img_name)
+
+class ProductJob:
+    def __init__(self, key, image_path, levels, subfolder_name, fetch_levels=None, preview=True):
+        self.key = key
+        self.image_path = image_path
+        self.levels = levels
+        self.subfolder_name = subfolder_name
+        # Chế độ tải dần (2_download_tiles_from_mapping.py): mỗi lượt chỉ tải một phần các level
+        self.fetch_levels = levels if fetch_levels is None else fetch_levels
+        self.preview = preview
+        self.folder_path = ""
+        self.pending = 0
+        self.failed = False
+        # Đường dẫn tương đối -> (size, hash) của các tile đã kiểm tra, ghi ra manifest khi xong product
+        self.manifest = {}
+
+class TileDownloader:
+    def __init__(self, session, output_dir=OUTPUT_DIR, base_url=BASE_URL,
+                 max_in_flight=MAX_IN_FLIGHT, on_product_done=None, store=None, cache=None,
+                 controller=None, verifier=None, metrics=None):
+        self.session = session
+        # Metrics (common/telemetry.py): đếm tile/tile hỏng, log từng tile chỉ khi bật lấy mẫu
+        self.metrics = metrics
+        # TileVerifier (common/tile_integrity.py): tile hỏng được tải lại ngay thay vì lọt tới bước stitch
+        self.verifier = verifier
+        # RateController: max_in_flight chỉ còn là trần, số request thật do controller điều chỉnh
+        self.controller = controller
+        # TileStore (common/tile_store.py): ghi tile vào pack theo hash thay vì file riêng
+        self.store = store
+        # HttpCache (common/http_cache.py): bỏ qua tile đã có đủ trên đĩa, request có điều kiện
+        self.cache = cache
+        self.output_dir = output_dir
+        self.base_url = base_url
+        self.max_in_flight = max_in_flight
+        self.on_product_done = on_product_done
+        self.tiles = 0
+        self.bytes = 0
+        self.skipped = 0
+        self.products_ok = 0
+        self.products_failed = 0
+
+    def _slot(self, url):
+        if self.controller:
+            return self.controller.slot(url, METRICS_STAGE)
+        return unlimited_slot(self.metrics, METRICS_STAGE, url)
+
+    async def fetch(self, url, log_id):
+        for attempt in range(1, MAX_RETRY + 1):
+            try:
+                async with self._slot(url) as slot, self.session.get(url) as resp:
+                    slot.status(resp.status)
+                    if resp.status == 200:
+                        content = await resp.read()
+                        slot.received(len(content))
+                        if self.metrics:
+                            self.metrics.log(f"[✅] ({log_id}) Success: {url}")
+                        return content
+                    print(f"[⚠️] ({log_id}) Attempt {attempt}: Status {resp.status}")
+            except Exception as e:
+                print(f"[❌] ({log_id}) Attempt {attempt}: {e!r}")
+            await asyncio.sleep(backoff_delay(attempt))
+        return None
+
+    async def fetch_cached(self, url, dest, log_id, attempt):
+        # Một lần gọi cache; vòng thử lại nằm ở _download để lỗi mạng và tile hỏng dùng chung MAX_RETRY lượt
+        try:
+            received = await self.cache.download(self.session, url, dest, resume=dest.endswith(RESUMABLE_FILES),
+                                                 stage=METRICS_STAGE)
+            if received is not None:
+                return received
+            print(f"[⚠️] ({log_id}) Attempt {attempt}: không tải được")
+        except Exception as e:
+            print(f"[❌] ({log_id}) Attempt {attempt}: {e!r}")
+        return None
+
+    async def _finish(self, job, ok):
+        if not ok:
+            job.failed = True
+        job.pending -= 1
+        if job.pending:
+            return
+        if job.failed:
+            self.products_failed += 1
+            print(f"⚠️ Product {job.key} failed. Sẽ được thử lại sau.")
+        else:
+            self.products_ok += 1
+            # Level đã đủ tile: stage stitch dựng panorama từ level cao nhất trong đó
+            fetched = {lv for lv, _, _ in job.fetch_levels}
+            if self.store:
+                # Pack và index phải xuống đĩa trước khi ledger đánh dấu DONE; fsync chạy ngoài event loop
+                await self.store.commit_async(job.key, (self.store.product_levels(job.key) or set()) | fetched)
+            else:
+                if self.verifier:
+                    # Stage sau chỉ cần so manifest thay vì kiểm tra lại từng tile
+                    write_manifest(job.folder_path, job.manifest)
+                write_levels(job.folder_path, (load_levels(job.folder_path) or set()) | fetched)
+        if self.on_product_done:
+            self.on_product_done(job, not job.failed)
+
+    def _tile_done(self, size):
+        self.tiles += 1
+        self.bytes += size
+        if self.metrics:
+            self.metrics.inc("tiles")
+
+    async def _download(self, job, url, dest):
+        log_id = f"{job.key} - {os.path.basename(dest)}"
+        if self.store and self.store.exists(f"{job.key}/{dest}"):
+            # Tile đã nằm trong store từ lần chạy trước
+            self.skipped += 1
+            return True
+
+        position = tile_position(job.levels, dest)
+        for attempt in range(1, MAX_RETRY + 1):
+            if self.cache and not self.store:
+                received = await self.fetch_cached(url, dest, log_id, attempt)
+                if received is None:
+                    await asyncio.sleep(backoff_delay(attempt))
+                    continue
+                rel_path = os.path.relpath(dest, job.folder_path)
+                entry = job.manifest.get(rel_path)
+                if received == 0 and entry and entry[0] == os.path.getsize(dest):
+                    # Cache không tải lại và manifest của lần trước đã có tile này: không băm/kiểm tra lại
+                    self.skipped += 1
+                    return True
+                error = None
+                if self.verifier:
+                    error, digest = await self.verifier.verify_file(dest, position)
+                if error:
+                    # Xóa cả bản ghi cache, nếu không lần sau file hỏng vẫn được coi là đủ
+                    os.remove(dest)
+                    self.cache.forget(url)
+                else:
+                    if self.verifier:
+                        job.manifest[rel_path] = (os.path.getsize(dest), digest)
+                    self._tile_done(received)
+                    return True
+            else:
+                content = await self.fetch(url, log_id)
+                if not content:
+                    return False
+                error = None
+                if self.verifier:
+                    error, digest = await self.verifier.verify(content, position)
+                if not error:
+                    if self.store:
+                        self.store.put(job.key, dest, content)
+                    else:
+                        os.makedirs(os.path.dirname(dest), exist_ok=True)
+                        with open(dest, "wb") as f:
+                            f.write(content)
+                        if self.verifier:
+                            job.manifest[os.path.relpath(dest, job.folder_path)] = (len(content), digest)
+                    self._tile_done(len(content))
+                    return True
+            if self.metrics:
+                self.metrics.inc("corrupt_tiles")
+            print(f"[🧪] ({log_id}) Attempt {attempt}: tile hỏng ({error}), tải lại")
+        return False
+
+    async def _run_tile(self, item):
+        job, url, dest = item
+        ok = False
+        try:
+            # Product đã hỏng thì bỏ qua các tile còn lại, cả product sẽ được thử lại
+            if not job.failed:
+                ok = await self._download(job, url, dest)
+        finally:
+            await self._finish(job, ok)
+
+    def _tiles(self, jobs):
+        # Sinh tile theo nhu cầu của worker: không product nào được bung hết ra bộ nhớ trước
+        for job in jobs:
+            if self.store:
+                # Trong store, đường dẫn tile tương đối với product
+                self.store.add_product(job.key, job.subfolder_name)
+                folder_path = ""
+            else:
+                folder_path = os.path.join(self.output_dir, job.subfolder_name, job.key)
+            job.folder_path = folder_path
+            job.pending = tile_count(job.fetch_levels, job.preview)
+            if self.verifier and not self.store:
+                # Manifest của lần chạy / lượt trước được giữ lại, tile đã có trong đó không phải kiểm tra lại
+                job.manifest = load_manifest(folder_path) or {}
+            print(f"\n📦 Crawling product: {job.key} in file {job.subfolder_name}")
+            for url, dest in product_tiles(job.image_path, job.fetch_levels, folder_path, self.base_url,
+                                           job.preview):
+                yield job, url, dest
+
+    async def download_product(self, job, max_in_flight=None):
+        # Tải một product ngay khi nó tới (run_pipeline.py), trả về True nếu đủ mọi tile
+        await run_bounded(self._run_tile, self._tiles([job]), max_in_flight or self.max_in_flight)
+        return not job.failed
+
+    async def run(self, jobs):
+        start = time.perf_counter()
+        await run_bounded(self._run_tile, self._tiles(jobs), self.max_in_flight)
+
+        elapsed = time.perf_counter() - start
+        rate = self.tiles / elapsed if elapsed else 0
+        print(f"\n📊 {self.tiles} tile, {self.bytes / 1e6:.1f} MB trong {elapsed:.1f}s "
+              f"({rate:.1f} tile/s), product OK {self.products_ok}, lỗi {self.products_failed}")
+        if self.cache:
+            print(self.cache.report())
+        if self.verifier:
+            print(self.verifier.report())
+        if self.controller:
+            print(self.controller.report())
@@ -0,0 +1,185 @@
+import io
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+# Cùng hàm băm với store: hash trong manifest và trong store phải khớp nhau
+from common.tile_store import tile_hash
+
+TILE_SIZE = 512
+MANIFEST_FILE = "manifest.txt"
+# Các level đã tải đủ của product, một số mỗi dòng; stage stitch dùng level cao nhất trong file
+LEVELS_FILE = "levels.txt"
+MAX_WORKERS = min(8, os.cpu_count() or 1)
+
+SOI = b"\xff\xd8"
+EOI = b"\xff\xd9"
+# SOF0..SOF15 trừ DHT (C4), JPG (C8), DAC (CC): marker chứa kích thước ảnh
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# Marker không có phần độ dài theo sau
+STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7}
+
+def jpeg_size(data):
+    # (width, height) đọc từ header SOF, không giải mã ảnh. None nếu không phải JPEG hợp lệ
+    if not data.startswith(SOI):
+        return None
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1  # byte đệm giữa các marker
+            continue
+        if marker in STANDALONE_MARKERS:
+            pos += 2
+            continue
+        length = int.from_bytes(data[pos + 2:pos + 4], "big")
+        if marker in SOF_MARKERS:
+            if pos + 9 > len(data):
+                return None
+            height = int.from_bytes(data[pos + 5:pos + 7], "big")
+            width = int.from_bytes(data[pos + 7:pos + 9], "big")
+            return width, height
+        if marker == 0xDA or length < 2:
+            return None  # tới dữ liệu ảnh mà chưa thấy SOF
+        pos += 2 + length
+    return None
+
+def tile_position(levels, filename):
+    # (rows, cols, r, c) của l<lv>_<face>_<r>_<c>.jpg theo structure của product, None với preview.jpg
+    parts = os.path.splitext(os.path.basename(filename))[0].split("_")
+    if len(parts) != 4 or not parts[0].startswith("l"):
+        return None
+    try:
+        lv, r, c = int(parts[0][1:]), int(parts[2]), int(parts[3])
+    except ValueError:
+        return None
+    for level, rows, cols in levels:
+        if level == lv:
+            return rows, cols, r, c
+    return None
+
+def decode_check(data, size):
+    # Giải mã ở chế độ draft (1/8 kích thước): bắt bảng Huffman/quantization và header scan hỏng.
+    # Dữ liệu scan bị cắt nhưng vẫn có EOI chỉ là cảnh báo của libjpeg, không bắt được ở đây
+    from PIL import Image
+    with Image.open(io.BytesIO(data)) as image:
+        image.draft("RGB", (max(size[0] // 8, 1), max(size[1] // 8, 1)))
+        image.load()
+
+def check_tile(data, position=None, decode=False, tile_size=TILE_SIZE):
+    # Trả về None nếu tile hợp lệ, ngược lại là lý do lỗi
+    if not data:
+        return "rỗng"
+    if not data.startswith(SOI):
+        return "thiếu SOI"
+    # Một số CDN đệm byte 0 hoặc xuống dòng sau EOI
+    if not data.rstrip(b"\x00\r\n ").endswith(EOI):
+        return "thiếu EOI (bị cắt)"
+    size = jpeg_size(data)
+    if size is None:
+        return "không đọc được header SOF"
+    width, height = size
+    if position:
+        # Ô bên trong đúng tile_size, hàng/cột cuối có thể nhỏ hơn nhưng không lớn hơn
+        rows, cols, r, c = position
+        if r > rows or c > cols:
+            return f"ô ({r},{c}) ngoài lưới {rows}x{cols}"
+        if not (0 < width <= tile_size and 0 < height <= tile_size):
+            return f"kích thước {width}x{height} vượt {tile_size}"
+        if (c < cols and width != tile_size) or (r < rows and height != tile_size):
+            return f"kích thước {width}x{height}, cần {tile_size}"
+    if decode:
+        try:
+            decode_check(data, size)
+        except Exception as e:
+            return f"giải mã lỗi: {e}"
+    return None
+
+def write_manifest(product_dir, entries):
+    # entries: {đường dẫn tương đối: (size, hash)}; ghi file tạm rồi đổi tên
+    path = os.path.join(product_dir, MANIFEST_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        for rel_path in sorted(entries):
+            size, digest = entries[rel_path]
+            f.write(f"{rel_path},{size},{digest}\n")
+    os.replace(tmp_path, path)
+
+def load_manifest(product_dir):
+    path = os.path.join(product_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    entries = {}
+    with open(path) as f:
+        for line in f:
+            rel_path, size, digest = line.rstrip("\n").rsplit(",", 2)
+            entries[rel_path] = (int(size), digest)
+    return entries
+
+def manifest_matches(product_dir, manifest=None):
+    # So kích thước file với manifest: chỉ stat, không đọc lại tile đã kiểm tra lúc tải
+    manifest = manifest if manifest is not None else load_manifest(product_dir)
+    if not manifest:
+        return False
+    for rel_path, (size, _) in manifest.items():
+        path = os.path.join(product_dir, rel_path)
+        if not os.path.exists(path) or os.path.getsize(path) != size:
+            return False
+    return True
+
+def write_levels(product_dir, levels):
+    path = os.path.join(product_dir, LEVELS_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        for lv in sorted(levels):
+            f.write(f"{lv}\n")
+    os.replace(tmp_path, path)
+
+def load_levels(product_dir):
+    # None khi product được tải trước khi có levels.txt: khi đó chỉ biết level cao nhất có trên đĩa
+    path = os.path.join(product_dir, LEVELS_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return {int(line) for line in f if line.strip()}
+
+class TileVerifier:
+    # Kiểm tra tile trong thread pool để không chặn event loop của downloader
+    def __init__(self, max_workers=MAX_WORKERS, decode=False):
+        self.decode = decode
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tile-verify")
+        self.verified = 0
+        self.corrupt = 0
+
+    def _check(self, data, position):
+        return check_tile(data, position, self.decode), tile_hash(data)
+
+    def _check_file(self, path, position):
+        with open(path, "rb") as f:
+            return self._check(f.read(), position)
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        error, digest = await loop.run_in_executor(self.pool, func, *args)
+        if error:
+            self.corrupt += 1
+        else:
+            self.verified += 1
+        return error, digest
+
+    async def verify(self, data, position=None):
+        # Trả về (lỗi hoặc None, hash)
+        return await self._run(self._check, data, position)
+
+    async def verify_file(self, path, position=None):
+        # Như verify nhưng đọc file trong thread, dùng cho tile HttpCache đã ghi thẳng xuống đĩa
+        return await self._run(self._check_file, path, position)
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+
+    def report(self):
+        mode = "header + draft decode" if self.decode else "header"
+        return f"🧪 Kiểm tra tile ({mode}): {self.verified} hợp lệ, {self.corrupt} lần tile hỏng"
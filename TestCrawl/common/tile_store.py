@@ -0,0 +1,224 @@
+import io
+import os
+import time
+import asyncio
+import sqlite3
+import hashlib
+
+TILE_STORE_DIR = "tile_store"
+INDEX_FILE = "index.sqlite3"
+# Blob được chia vào 16 shard theo ký tự đầu của hash, mỗi shard cuộn sang pack mới khi đầy
+SHARD_CHARS = 1
+MAX_PACK_SIZE = 1 << 30
+HASH_SIZE = 16
+BLOCK_SIZE = 4096  # để ước lượng dung lượng đĩa khi mỗi tile là một file riêng
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    pack TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS products (
+    product_key TEXT PRIMARY KEY,
+    structure TEXT NOT NULL DEFAULT '',
+    updated_at REAL NOT NULL DEFAULT 0,
+    levels TEXT
+);
+CREATE TABLE IF NOT EXISTS tiles (
+    product_key TEXT NOT NULL,
+    path TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    PRIMARY KEY (product_key, path)
+);
+CREATE INDEX IF NOT EXISTS tiles_hash ON tiles (hash);
+"""
+
+def tile_hash(data):
+    return hashlib.blake2b(data, digest_size=HASH_SIZE).hexdigest()
+
+def disk_usage(size, block_size=BLOCK_SIZE):
+    return -(-size // block_size) * block_size
+
+class TileStore:
+    def __init__(self, root=TILE_STORE_DIR, max_pack_size=MAX_PACK_SIZE):
+        self.root = root
+        self.max_pack_size = max_pack_size
+        os.makedirs(os.path.join(root, "packs"), exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(root, INDEX_FILE))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(products)")}
+        if "levels" not in columns:
+            # Index tạo trước khi store ghi level đã đủ
+            self.conn.execute("ALTER TABLE products ADD COLUMN levels TEXT")
+        self._writers = {}
+        self._readers = {}
+        # Blob đã ghi vào pack nhưng chưa commit, tránh ghi trùng trong cùng một lô
+        self._pending = {}
+
+    def _pack_for(self, digest, size):
+        shard = digest[:SHARD_CHARS]
+        writer = self._writers.get(shard)
+        if writer is None or writer.tell() + size > self.max_pack_size:
+            if writer is not None:
+                # Blob trong pack cũ có thể vẫn chờ commit
+                writer.flush()
+                os.fsync(writer.fileno())
+                writer.close()
+            shard_dir = os.path.join(self.root, "packs", shard)
+            os.makedirs(shard_dir, exist_ok=True)
+            packs = sorted(int(name[:-5]) for name in os.listdir(shard_dir) if name.endswith(".pack"))
+            seq = packs[-1] if packs else 0
+            path = os.path.join(shard_dir, f"{seq:05d}.pack")
+            if os.path.exists(path) and os.path.getsize(path) + size > self.max_pack_size:
+                path = os.path.join(shard_dir, f"{seq + 1:05d}.pack")
+            writer = open(path, "ab")
+            self._writers[shard] = writer
+        return writer
+
+    def put(self, product_key, path, data):
+        # Trả về (hash, True nếu là blob mới)
+        digest = tile_hash(data)
+        known = digest in self._pending or self.conn.execute(
+            "SELECT 1 FROM blobs WHERE hash = ?", (digest,)).fetchone()
+        if not known:
+            writer = self._pack_for(digest, len(data))
+            offset = writer.tell()
+            writer.write(data)
+            pack = os.path.relpath(writer.name, self.root)
+            self._pending[digest] = (digest, pack, offset, len(data))
+        self.conn.execute("INSERT OR REPLACE INTO tiles (product_key, path, hash) VALUES (?, ?, ?)",
+                          (product_key, path.replace(os.sep, "/"), digest))
+        return digest, not known
+
+    def add_product(self, product_key, structure=""):
+        self.conn.execute(
+            "INSERT INTO products (product_key, structure, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(product_key) DO UPDATE SET structure = excluded.structure",
+            (product_key, structure, 0))
+
+    def _flush(self):
+        # Blob đang chờ và bản sao fd của các pack: pack có thể bị đóng (cuộn sang pack mới) trong lúc fsync
+        for writer in self._writers.values():
+            writer.flush()
+        return dict(self._pending), [os.dup(writer.fileno()) for writer in self._writers.values()]
+
+    @staticmethod
+    def _fsync(fds):
+        for fd in fds:
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def commit(self, product_key=None, levels=None):
+        # levels: các level đã đủ tile của product_key (như levels.txt), stage stitch chỉ dùng các level này.
+        # Dữ liệu pack phải xuống đĩa trước khi index trỏ tới nó
+        pending, fds = self._flush()
+        self._fsync(fds)
+        self._index(pending, product_key, levels)
+
+    async def commit_async(self, product_key=None, levels=None):
+        # Như commit nhưng fsync chạy trong thread, event loop vẫn tải và put tile của product khác
+        pending, fds = self._flush()
+        await asyncio.to_thread(self._fsync, fds)
+        self._index(pending, product_key, levels)
+
+    def _index(self, pending, product_key, levels):
+        # Blob put sau lúc _flush vẫn chờ lần commit sau; blob chung với commit khác chỉ bị xóa khỏi
+        # _pending khi đã có trong index
+        with self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO blobs (hash, pack, offset, size) VALUES (?, ?, ?, ?)",
+                                  pending.values())
+            if product_key is not None:
+                self.conn.execute("UPDATE products SET updated_at = ?, levels = COALESCE(?, levels) "
+                                  "WHERE product_key = ?",
+                                  (time.time(), None if levels is None else ",".join(map(str, sorted(levels))),
+                                   product_key))
+        for digest in pending:
+            self._pending.pop(digest, None)
+
+    def close(self):
+        self.commit()
+        for handle in list(self._writers.values()) + list(self._readers.values()):
+            handle.close()
+        self._writers.clear()
+        self._readers.clear()
+        self.conn.close()
+
+    # --- API đọc: cùng đường dẫn tương đối như dưới image_crawled/<structure>/<key>/ ---
+
+    def _split(self, path):
+        product_key, _, rel_path = path.replace(os.sep, "/").partition("/")
+        return product_key, rel_path
+
+    def read(self, path):
+        product_key, rel_path = self._split(path)
+        row = self.conn.execute(
+            "SELECT b.pack, b.offset, b.size FROM tiles t JOIN blobs b ON b.hash = t.hash "
+            "WHERE t.product_key = ? AND t.path = ?", (product_key, rel_path)).fetchone()
+        if row is None:
+            raise FileNotFoundError(path)
+        pack, offset, size = row
+        reader = self._readers.get(pack)
+        if reader is None:
+            reader = self._readers[pack] = open(os.path.join(self.root, pack), "rb")
+        return os.pread(reader.fileno(), size, offset)
+
+    def open(self, path):
+        return io.BytesIO(self.read(path))
+
+    def exists(self, path):
+        product_key, rel_path = self._split(path)
+        return self.conn.execute("SELECT 1 FROM tiles WHERE product_key = ? AND path = ?",
+                                 (product_key, rel_path)).fetchone() is not None
+
+    def list(self, prefix):
+        # Mọi đường dẫn "<key>/<face>/l<lv>/..." bắt đầu bằng prefix
+        product_key, rel_prefix = self._split(prefix.rstrip("/"))
+        rows = self.conn.execute("SELECT path FROM tiles WHERE product_key = ? ORDER BY path", (product_key,))
+        rel_prefix = rel_prefix + "/" if rel_prefix else ""
+        return [f"{product_key}/{path}" for path, in rows if path.startswith(rel_prefix)]
+
+    def manifest(self, product_key):
+        return dict(self.conn.execute("SELECT path, hash FROM tiles WHERE product_key = ?", (product_key,)))
+
+    def products(self):
+        return self.conn.execute(
+            "SELECT product_key, structure, updated_at FROM products ORDER BY structure, product_key").fetchall()
+
+    def product_mtime(self, product_key):
+        row = self.conn.execute("SELECT updated_at FROM products WHERE product_key = ?", (product_key,)).fetchone()
+        return row[0] if row else 0
+
+    def product_levels(self, product_key):
+        # Như load_levels: None khi product được commit trước khi store ghi level (chỉ biết level có trong store)
+        row = self.conn.execute("SELECT levels FROM products WHERE product_key = ?", (product_key,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return {int(lv) for lv in row[0].split(",") if lv}
+
+    def stats(self):
+        tiles, logical, logical_disk = self.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(b.size), 0), COALESCE(SUM((b.size + ? - 1) / ? * ?), 0) "
+            "FROM tiles t JOIN blobs b ON b.hash = t.hash",
+            (BLOCK_SIZE, BLOCK_SIZE, BLOCK_SIZE)).fetchone()
+        blobs, stored = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        return {
+            "tiles": tiles,
+            "blobs": blobs,
+            "logical_bytes": logical,
+            "stored_bytes": stored,
+            # Dung lượng đĩa nếu mỗi tile là một file riêng, so với các pack file
+            "saved_bytes": logical_disk - stored,
+            "dedup_ratio": logical / stored if stored else 1.0,
+        }
+
+    def report(self):
+        s = self.stats()
+        return (f"📦 Tile store: {s['tiles']} tile → {s['blobs']} blob duy nhất, "
+                f"dedup {s['dedup_ratio']:.2f}x, {s['logical_bytes'] / 1e6:.1f} MB → "
+                f"{s['stored_bytes'] / 1e6:.1f} MB, tiết kiệm {s['saved_bytes'] / 1e6:.1f} MB đĩa")
@@ -0,0 +1,61 @@
+import asyncio
+
+# Số kết quả được phép nằm chờ trong hàng đợi cho mỗi worker trước khi worker phải dừng lại
+RESULT_BUFFER = 2
+
+_DONE = object()
+
+async def _iterate(items):
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+async def map_unordered(func, items, concurrency, result_buffer=RESULT_BUFFER):
+    # N worker lấy lần lượt từ iterator (list, generator hoặc async generator) và trả (item, kết quả)
+    # theo thứ tự xong trước. Chỉ có tối đa concurrency coroutine và vài kết quả nằm trong bộ nhớ,
+    # dù đầu vào có bao nhiêu phần tử.
+    source = _iterate(items)
+    # Async generator không cho phép hai __anext__ chạy cùng lúc
+    lock = asyncio.Lock()
+    results = asyncio.Queue(maxsize=max(concurrency * result_buffer, 1))
+
+    async def worker():
+        try:
+            while True:
+                async with lock:
+                    try:
+                        item = await source.__anext__()
+                    except StopAsyncIteration:
+                        break
+                await results.put((item, await func(item)))
+        except Exception as e:
+            await results.put(e)
+        # Không đặt trong finally: worker bị cancel thì không được chờ hàng đợi đầy
+        await results.put(_DONE)
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    running = len(workers)
+    try:
+        while running:
+            result = await results.get()
+            if result is _DONE:
+                running -= 1
+            elif isinstance(result, Exception):
+                raise result
+            else:
+                yield result
+    finally:
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        await source.aclose()
+
+async def run_bounded(func, items, concurrency):
+    # Chạy func cho mọi item, không giữ kết quả; trả về số item đã xử lý
+    count = 0
+    async for _ in map_unordered(func, items, concurrency):
+        count += 1
+    return count
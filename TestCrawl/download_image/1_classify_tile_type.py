@@ -1,90 +1,83 @@
 import aiohttp
 import asyncio
 import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.layout_cache import LayoutCache, signature_name
+from common.grid_discovery import BASE_URL
+from common.http_cache import HttpCache
+from common.rate_controller import RateController, backoff_delay
+from common.worker_pool import run_bounded
+from common.line_writer import LineWriterGroup
+from common.telemetry import Metrics
 
-BASE_URL = "https://imgscdn.ajun720.cn"
 OUTPUT_DIR = "output_structure"
-MAX_LEVEL = 6
-MAX_ROW = 10
-MAX_COL = 20
-FACE = "b"
 TIMEOUT = aiohttp.ClientTimeout(total=10)
 CONCURRENT_PRODUCTS = 20  # chỉ xử lý 20 product một lúc
 RETRY = 3
+METRICS_STAGE = "classify"
 
 os.makedirs(OUTPUT_DIR, exist_ok=True)
-sema = asyncio.Semaphore(CONCURRENT_PRODUCTS)
+layout_cache = LayoutCache()
+# Mọi HEAD dò layout đi qua cùng một controller; product chỉ là trần song song
+metrics = Metrics()
+controller = RateController(metrics=metrics)
+# Ô đã thấy 200 ở lần chạy trước không cần HEAD lại
+http_cache = HttpCache(controller=controller)
 
 async def check_url(session, url, retries=RETRY):
+    # Chỉ 200/404 là câu trả lời chắc chắn; 5xx hay 429 mà coi là "không có" thì layout bị nhận sai
     for attempt in range(retries):
         try:
-            async with session.head(url) as resp:
-                return resp.status == 200
+            status = await http_cache.head(session, url, METRICS_STAGE)
+            if status in (200, 404):
+                return status == 200
         except Exception as e:
-            if attempt < retries - 1:
-                await asyncio.sleep(0.5)
-            else:
-                return False
+            pass
+        if attempt < retries - 1:
+            await asyncio.sleep(backoff_delay(attempt))
+    return False
 
 async def get_structure(session, cdn_path):
-    cdn_id = cdn_path.split("/")[-1]
-    full_cdn_url = f"{BASE_URL}/{cdn_path}/{FACE}"
-    structure = []
-
-    for level_num in range(1, MAX_LEVEL + 1):
-        level = f"l{level_num}"
-        first_image_url = f"{full_cdn_url}/{level}/1/{level}_{FACE}_1_1.jpg"
-        if not await check_url(session, first_image_url):
-            break
-
-        max_row, max_col = 0, 0
-        for row in range(1, MAX_ROW + 1):
-            col_count = 0
-            for col in range(1, MAX_COL + 1):
-                image_url = f"{full_cdn_url}/{level}/{row}/{level}_{FACE}_{row}_{col}.jpg"
-                if await check_url(session, image_url):
-                    col_count += 1
-                else:
-                    break
-            if col_count == 0:
-                break
-            max_row += 1
-            max_col = max(max_col, col_count)
-
-        structure.append((level, max_row, max_col))
+    # Thử các layout phổ biến trước, chỉ dò đầy đủ (song song + tìm nhị phân) khi không khớp
+    structure, requests, hit = await layout_cache.classify(lambda url: check_url(session, url), cdn_path, BASE_URL)
     return structure
 
 def format_filename(structure):
-    parts = [f"l{len(structure)}"]
-    for level, row, col in structure:
-        parts.append(f"{level}_{row}_{col}")
-    return "_".join(parts) + ".txt"
+    return signature_name(structure) + ".txt"
+
+async def process_key(session, outputs, product_key, cdn_key_full):
+    print(f"📦 Bắt đầu: {product_key}")
+    structure = await get_structure(session, cdn_key_full)
+    if not structure:
+        print(f"❌ Không tìm thấy: {product_key}")
+        return
+    filename = format_filename(structure)
+    filepath = os.path.join(OUTPUT_DIR, filename)
+    await outputs.write(filepath, f"{product_key},{cdn_key_full}")
+    print(f"✅ Ghi vào: {filename}")
 
-async def process_key(session, product_key, cdn_key_full):
-    async with sema:
-        print(f"📦 Bắt đầu: {product_key}")
-        structure = await get_structure(session, cdn_key_full)
-        if not structure:
-            print(f"❌ Không tìm thấy: {product_key}")
-            return
-        filename = format_filename(structure)
-        filepath = os.path.join(OUTPUT_DIR, filename)
-        with open(filepath, "a") as f:
-            f.write(f"{product_key},{cdn_key_full}\n")
-        print(f"✅ Ghi vào: {filename}")
+def read_mapping(path):
+    with open(path) as f:
+        for line in f:
+            if "," in line.strip():
+                yield line.strip().split(",", 1)
 
 async def main():
-    with open("has_image.txt") as f:
-        lines = [line.strip() for line in f if line.strip()]
-    async with aiohttp.ClientSession(timeout=TIMEOUT) as session:
-        tasks = []
-        for line in lines:
-            try:
-                product_key, cdn_key = line.split(",", 1)
-                tasks.append(process_key(session, product_key, cdn_key))
-            except:
-                continue
-        await asyncio.gather(*tasks)
+    layout_cache.seed_from_dir(OUTPUT_DIR)
+    # Mỗi file cấu trúc có một writer riêng, dòng được gom theo lô thay vì mở file cho từng product
+    async with aiohttp.ClientSession(timeout=TIMEOUT) as session, LineWriterGroup() as outputs, metrics:
+        # CONCURRENT_PRODUCTS worker đọc dần has_image.txt, không giữ cả file trong bộ nhớ
+        await run_bounded(lambda pair: process_key(session, outputs, *pair), read_mapping("has_image.txt"),
+                          CONCURRENT_PRODUCTS)
+
+    print(layout_cache.report())
+    layout_cache.save()
+    print(http_cache.report())
+    print(controller.report())
+    print(metrics.summary())
+    http_cache.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
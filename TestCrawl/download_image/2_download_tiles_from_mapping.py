@@ -1,133 +1,170 @@
 import os
-import aiohttp
+import sys
 import asyncio
 
-FACES = ["f", "b", "l", "r", "u", "d"]
-BASE_URL = "https://imgscdn.ajun720.cn"
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.tile_downloader import (
+    ProductJob,
+    TileDownloader,
+    make_session,
+    parse_structure_from_filename,
+    tile_count,
+)
+from common.job_ledger import JobLedger, DONE, FAILED
+from common.tile_store import TileStore
+from common.http_cache import HttpCache
+from common.rate_controller import RateController
+from common.tile_integrity import TileVerifier
+from common.telemetry import Metrics
+
 OUTPUT_DIR = "image_crawled"
 INPUT_FOLDER = "output_structure"
-MAX_CONCURRENT = 40
-MAX_RETRY = 3
-TIMEOUT = 10
-
-sem = asyncio.Semaphore(MAX_CONCURRENT)
-lock = asyncio.Lock()
-
-def parse_structure_from_filename(filename):
-    parts = filename.replace(".txt", "").split("_")
-    levels = []
-    i = 0
-    while i < len(parts):
-        if parts[i].startswith("l") and i + 2 < len(parts):
-            try:
-                lv = int(parts[i][1:])
-                row = int(parts[i + 1])
-                col = int(parts[i + 2])
-                levels.append((lv, row, col))
-                i += 3
-            except ValueError:
-                i += 1
-        else:
-            i += 1
-    return levels
-
-async def fetch(session, url, log_id):
-    for attempt in range(1, MAX_RETRY + 1):
-        try:
-            async with session.get(url, timeout=TIMEOUT) as resp:
-                if resp.status == 200:
-                    print(f"[\u2705] ({log_id}) Success: {url}")
-                    return await resp.read()
-                else:
-                    print(f"[\u26a0\ufe0f] ({log_id}) Attempt {attempt}: Status {resp.status}")
-        except Exception as e:
-            print(f"[\u274c] ({log_id}) Attempt {attempt}: {e}")
-        await asyncio.sleep(1)
-    return None
-
-async def download_images_for_product(session, key, image_path, levels, subfolder_name):
-    folder_path = os.path.join(OUTPUT_DIR, subfolder_name, key)
-    os.makedirs(folder_path, exist_ok=True)
-
-    print(f"\n📦 Crawling product: {key} in file {subfolder_name}")
-    preview_url = f"{BASE_URL}/{image_path}/preview.jpg"
-    preview_content = await fetch(session, preview_url, f"{key} - preview")
-    if not preview_content:
-        return False
-
-    with open(os.path.join(folder_path, "preview.jpg"), "wb") as f:
-        f.write(preview_content)
-
-    tasks = []
-
-    async def download_tile(face, lv, r, c):
-        img_name = f"l{lv}_{face}_{r}_{c}.jpg"
-        url = f"{BASE_URL}/{image_path}/{face}/l{lv}/{r}/{img_name}"
-        content = await fetch(session, url, f"{key} - {img_name}")
-        if not content:
-            return False
-        save_dir = os.path.join(folder_path, face, f"l{lv}", str(r))
-        os.makedirs(save_dir, exist_ok=True)
-        with open(os.path.join(save_dir, img_name), "wb") as f:
-            f.write(content)
-        return True
-
-    for face in FACES:
-        for lv, rows, cols in levels:
-            for r in range(1, rows + 1):
-                for c in range(1, cols + 1):
-                    tasks.append(download_tile(face, lv, r, c))
-
-    results = await asyncio.gather(*tasks)
-    return all(results)
-
-async def process_file(filepath):
-    filename = os.path.basename(filepath)
-    levels = parse_structure_from_filename(filename)
-    subfolder_name = filename.replace(".txt", "")
-    print(f"\n📂 Processing file: {filename} with structure {levels}")
-
-    while True:
-        # Đọc lại file mỗi vòng
-        if not os.path.exists(filepath):
+# Trần số request song song, RateController tự tìm mức an toàn bên dưới
+MAX_CONCURRENT = 128
+LEDGER_STAGE = "download"
+# Đặt thành thư mục (ví dụ "tile_store") để lưu tile theo hash trong pack file thay vì image_crawled/
+TILE_STORE_DIR = None
+# True để hỏi lại CDN (request có điều kiện, 304 nếu không đổi) cả với tile đã tải đủ
+REVALIDATE = False
+# Kiểm tra SOI/EOI và kích thước từng tile ngay khi tải, tile hỏng được tải lại
+VERIFY_TILES = True
+# True để giải mã thêm ở chế độ draft, bắt được cả JPEG hỏng ở giữa (chậm hơn)
+DECODE_TILES = False
+# Tải dần: lượt 1 lấy preview + level thấp nhất của mọi product, các lượt sau lấy level kế tiếp.
+# Mọi product có panorama dùng được (từ level thấp) sớm thay vì chờ product trước tải đủ độ phân giải
+PROGRESSIVE = True
+
+def load_jobs(ledger, filepaths):
+    jobs = []
+    for filepath in filepaths:
+        filename = os.path.basename(filepath)
+        levels = parse_structure_from_filename(filename)
+        subfolder_name = filename.replace(".txt", "")
+
+        # Trạng thái nằm trong ledger, file txt chỉ được đọc phần mới thêm vào
+        added = ledger.import_txt(LEDGER_STAGE, filepath, grp=subfolder_name, require_payload=True)
+        rows = ledger.unfinished(LEDGER_STAGE, grp=subfolder_name)
+        jobs.extend(ProductJob(key, path, levels, subfolder_name) for key, path, _ in rows)
+        print(f"\n📂 Processing file: {filename} with structure {levels} "
+              f"({len(rows)} product còn lại, {added} dòng mới)")
+    return jobs
+
+def export_remaining(ledger, filepaths):
+    # Ghi lại file structure một lần ở cuối để zip_if_done.sh vẫn dựa vào file rỗng
+    for filepath in filepaths:
+        subfolder_name = os.path.basename(filepath).replace(".txt", "")
+        left = ledger.export_txt(LEDGER_STAGE, filepath, grp=subfolder_name, unfinished=True)
+        if not left:
+            print(f"✅ Hoàn tất file {os.path.basename(filepath)}")
+
+async def download_all(session, jobs, on_product_done, store=None, cache=None, controller=None, verifier=None,
+                       metrics=None):
+    while jobs:
+        downloader = TileDownloader(session, OUTPUT_DIR, max_in_flight=MAX_CONCURRENT,
+                                    on_product_done=on_product_done, store=store, cache=cache,
+                                    controller=controller, verifier=verifier, metrics=metrics)
+        await downloader.run(jobs)
+        if not downloader.products_ok:
+            print(f"⚠️ Không product nào thành công trong vòng này, dừng với {len(jobs)} product lỗi.")
             break
 
-        with open(filepath, "r") as f:
-            lines = [line.strip() for line in f if line.strip()]
-
-        if not lines:
-            print(f"\u2705 Hoàn tất file {filename}")
-            break
+        jobs = [job for job in jobs if job.failed]
+        for job in jobs:
+            job.failed = False
+        if jobs:
+            print(f"🔁 Thử lại {len(jobs)} product lỗi...")
+            await asyncio.sleep(2)
 
-        current_line = lines[0]
-        try:
-            key, path = current_line.split(",", 1)
-        except ValueError:
-            print(f"\u274c Bỏ qua dòng lỗi: {current_line}")
-            lines = lines[1:]
-            with open(filepath, "w") as f:
-                f.write("\n".join(lines) + ("\n" if lines else ""))
+def level_stage(lv):
+    # Tiến độ từng level trong ledger, product chỉ DONE ở LEDGER_STAGE khi mọi level đã xong
+    return f"{LEDGER_STAGE}_l{lv}"
+
+def level_passes(ledger, jobs):
+    # Lượt i gồm level thứ i (từ thấp lên) của mọi product còn level đó chưa xong
+    ledger.flush()
+    rows = {}
+    for job in jobs:
+        for lv, _, _ in job.levels:
+            rows.setdefault((lv, job.subfolder_name), []).append((job.key, job.image_path))
+    for (lv, grp), level_rows in rows.items():
+        ledger.add(level_stage(lv), level_rows, grp=grp)
+    done = {}
+    for lv in {lv for lv, _ in rows}:
+        for key, _, _ in ledger.jobs(level_stage(lv), status=DONE):
+            done.setdefault(key, set()).add(lv)
+
+    passes = []
+    for index in range(max((len(job.levels) for job in jobs), default=0)):
+        pass_jobs = []
+        for job in jobs:
+            levels = sorted(job.levels)
+            if index < len(levels) and levels[index][0] not in done.get(job.key, ()):
+                pass_jobs.append(ProductJob(job.key, job.image_path, job.levels, job.subfolder_name,
+                                            [levels[index]], preview=index == 0))
+        passes.append(pass_jobs)
+    return passes, done
+
+async def download_progressive(session, ledger, jobs, store=None, cache=None, controller=None, verifier=None,
+                               metrics=None):
+    passes, done = level_passes(ledger, jobs)
+
+    def on_level_done(job, success):
+        lv = job.fetch_levels[0][0]
+        ledger.set_status(level_stage(lv), job.key, DONE if success else FAILED)
+        if not success:
+            ledger.set_status(LEDGER_STAGE, job.key, FAILED)
+            return
+        levels = done.setdefault(job.key, set())
+        levels.add(lv)
+        if len(levels) == len(job.levels):
+            ledger.set_status(LEDGER_STAGE, job.key, DONE)
+
+    for index, pass_jobs in enumerate(passes, 1):
+        if not pass_jobs:
             continue
-
-        async with aiohttp.ClientSession() as session:
-            success = await download_images_for_product(session, key, path, levels, subfolder_name)
-
-        if success:
-            lines = lines[1:]
-            with open(filepath, "w") as f:
-                f.write("\n".join(lines) + ("\n" if lines else ""))
-        else:
-            print(f"⚠️ Product {key} failed. Sẽ được thử lại sau.")
-            await asyncio.sleep(2)
+        tiles = sum(tile_count(job.fetch_levels, job.preview) for job in pass_jobs)
+        print(f"\n🪜 Lượt {index}/{len(passes)}: level thứ {index} của {len(pass_jobs)} product ({tiles} tile)")
+        await download_all(session, pass_jobs, on_level_done, store, cache, controller, verifier, metrics)
 
 async def main():
     if not os.path.exists(INPUT_FOLDER):
         print(f"❌ Không tìm thấy thư mục {INPUT_FOLDER}")
         return
 
-    for fname in sorted(os.listdir(INPUT_FOLDER)):
-        if fname.endswith(".txt"):
-            await process_file(os.path.join(INPUT_FOLDER, fname))
+    filepaths = [os.path.join(INPUT_FOLDER, fname)
+                 for fname in sorted(os.listdir(INPUT_FOLDER)) if fname.endswith(".txt")]
+    ledger = JobLedger()
+    jobs = load_jobs(ledger, filepaths)
+    store = TileStore(TILE_STORE_DIR) if TILE_STORE_DIR else None
+    # Product lỗi được thử lại nhưng tile đã tải đủ thì không tải lại
+    # Window và backoff giữ nguyên giữa các vòng thử lại
+    # Latency/lỗi theo host in mỗi 10s và ghi ra crawl_metrics.prom/.json thay cho print từng tile
+    metrics = Metrics()
+    controller = RateController(metrics=metrics, max_window=MAX_CONCURRENT)
+    cache = HttpCache(revalidate=REVALIDATE, controller=controller)
+    verifier = TileVerifier(decode=DECODE_TILES) if VERIFY_TILES else None
+
+    def on_product_done(job, success):
+        ledger.set_status(LEDGER_STAGE, job.key, DONE if success else FAILED)
+
+    try:
+        # Một session dùng chung cho mọi product, tile của nhiều product chạy xen kẽ
+        async with make_session(MAX_CONCURRENT) as session, metrics:
+            if PROGRESSIVE:
+                await download_progressive(session, ledger, jobs, store, cache, controller, verifier, metrics)
+            else:
+                await download_all(session, jobs, on_product_done, store, cache, controller, verifier, metrics)
+    finally:
+        cache.close()
+        if verifier:
+            verifier.close()
+        if store:
+            print(store.report())
+            store.close()
+        print(metrics.summary())
+        export_remaining(ledger, filepaths)
+        print(f"📒 Ledger: {ledger.counts(LEDGER_STAGE)}")
+        ledger.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
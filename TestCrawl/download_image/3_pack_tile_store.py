@@ -0,0 +1,64 @@
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.tile_store import TileStore, TILE_STORE_DIR
+from common.tile_integrity import load_levels
+
+INPUT_DIR = "image_crawled"
+# Đặt True để xóa file gốc sau khi product đã được commit vào store
+REMOVE_ORIGINALS = False
+
+def product_files(product_dir):
+    for root, dirs, files in os.walk(product_dir):
+        for file in files:
+            path = os.path.join(root, file)
+            yield path, os.path.relpath(path, product_dir)
+
+def pack_product(store, structure, key, product_dir):
+    store.add_product(key, structure)
+    tiles, new_blobs = 0, 0
+    for path, rel_path in product_files(product_dir):
+        with open(path, "rb") as f:
+            _, is_new = store.put(key, rel_path, f.read())
+        tiles += 1
+        new_blobs += is_new
+    # Product tải dần chỉ có các level trong levels.txt là đủ tile
+    store.commit(key, load_levels(product_dir))
+
+    if REMOVE_ORIGINALS:
+        for path, _ in product_files(product_dir):
+            os.remove(path)
+        for root, dirs, files in os.walk(product_dir, topdown=False):
+            os.rmdir(root)
+    return tiles, new_blobs
+
+def main():
+    if not os.path.exists(INPUT_DIR):
+        print(f"❌ Không tìm thấy thư mục {INPUT_DIR}")
+        return
+
+    store = TileStore(TILE_STORE_DIR)
+    start = time.perf_counter()
+    products = 0
+    try:
+        for structure in sorted(os.listdir(INPUT_DIR)):
+            structure_dir = os.path.join(INPUT_DIR, structure)
+            if not os.path.isdir(structure_dir):
+                continue
+            for key in sorted(os.listdir(structure_dir)):
+                product_dir = os.path.join(structure_dir, key)
+                if not os.path.isdir(product_dir):
+                    continue
+                tiles, new_blobs = pack_product(store, structure, key, product_dir)
+                products += 1
+                print(f"📦 {structure}/{key}: {tiles} tile, {tiles - new_blobs} trùng")
+    finally:
+        elapsed = time.perf_counter() - start
+        print(f"\n🎯 {products} product trong {elapsed:.1f}s")
+        print(store.report())
+        store.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import asyncio
+import os
+import re
+import sys
+import time
+import random
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.grid_discovery import discover_structure, get_structure_sequential
+from common.tile_downloader import parse_structure_from_filename
+from common.layout_cache import LayoutCache
+
+STRUCTURE_DIR = "output_structure"
+PRODUCTS = 200
+LATENCY = 0.03  # giây cho mỗi HEAD, gần với RTT tới CDN
+CONCURRENT_PRODUCTS = 20
+TILE_RE = re.compile(r"/(\d+/works/\w+)/b/l(\d+)/(\d+)/l\d+_b_(\d+)_(\d+)\.jpg$")
+
+class SimulatedCdn:
+    def __init__(self, layouts, latency=LATENCY):
+        self.layouts = layouts
+        self.latency = latency
+        self.requests = 0
+
+    async def check(self, url):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        match = TILE_RE.search(url)
+        if not match:
+            return False
+        cdn_path, lv, row, _, col = match.groups()
+        for level, rows, cols in self.layouts.get(cdn_path, []):
+            if level == int(lv):
+                return int(row) <= rows and int(col) <= cols
+        return False
+
+def load_layouts():
+    # Phân bố layout theo số dòng thực tế trong output_structure/
+    weighted = []
+    for fname in sorted(os.listdir(STRUCTURE_DIR)):
+        if fname.endswith(".txt"):
+            with open(os.path.join(STRUCTURE_DIR, fname)) as f:
+                count = sum(1 for line in f if line.strip())
+            weighted.append((parse_structure_from_filename(fname), max(count, 1)))
+
+    rng = random.Random(0)
+    layouts, weights = zip(*weighted)
+    picks = rng.choices(layouts, weights=weights, k=PRODUCTS)
+    return {f"{i}/works/p{i:06d}": levels for i, levels in enumerate(picks)}
+
+async def run(name, discover, layouts):
+    cdn = SimulatedCdn(layouts)
+    sema = asyncio.Semaphore(CONCURRENT_PRODUCTS)
+    latencies = []
+    mismatches = 0
+
+    async def one(cdn_path, expected):
+        nonlocal mismatches
+        async with sema:
+            start = time.perf_counter()
+            structure, _ = await discover(cdn.check, cdn_path, "")
+            latencies.append(time.perf_counter() - start)
+        if [(int(lv[1:]), r, c) for lv, r, c in structure] != expected:
+            mismatches += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(path, expected) for path, expected in layouts.items()))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2]
+    p95 = latencies[int(len(latencies) * 0.95)]
+    print(f"{name:<12} {cdn.requests / len(layouts):7.1f} req/product  "
+          f"p50 {p50 * 1000:6.0f}ms  p95 {p95 * 1000:6.0f}ms  tổng {elapsed:6.2f}s  sai {mismatches}")
+
+async def main():
+    layouts = load_layouts()
+    print(f"🧪 {len(layouts)} product giả lập, latency {LATENCY * 1000:.0f}ms/request")
+    await run("sequential", get_structure_sequential, layouts)
+    await run("search", discover_structure, layouts)
+
+    cache = LayoutCache(path=None)
+    cache.seed_from_dir(STRUCTURE_DIR)
+
+    async def cached(check, cdn_path, base_url):
+        structure, requests, _ = await cache.classify(check, cdn_path, base_url)
+        return structure, requests
+
+    await run("cache", cached, layouts)
+    print(cache.report())
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,98 @@
+import asyncio
+import os
+import sys
+
+from aiohttp import web
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.job_ledger import JobLedger, DONE
+from common.lease_coordinator import COORDINATOR_PORT, LEASE_BATCH, LeaseCoordinator, coordinator_app
+
+# Chế độ nhiều máy: coordinator giữ crawl_jobs.sqlite3 và chia product cho distributed_worker.py.
+# Đầu vào/đầu ra giống 1_classify_tile_type.py + 2_download_tiles_from_mapping.py nên có thể chuyển qua lại
+MAPPING_FILE = "has_image.txt"
+STRUCTURE_DIR = "output_structure"
+CLASSIFY_STAGE = "classify"
+DOWNLOAD_STAGE = "download"  # cùng stage với 2_download_tiles_from_mapping.py
+STAGES = (CLASSIFY_STAGE, DOWNLOAD_STAGE)
+HOST = "0.0.0.0"
+PORT = int(os.environ.get("CRAWL_COORDINATOR_PORT", COORDINATOR_PORT))
+# Đặt ngắn khi thử trên một máy để thấy lease của worker bị kill được giao lại
+LEASE_TTL = float(os.environ.get("CRAWL_LEASE_TTL", 60))
+REPORT_INTERVAL = 10.0
+POLL_INTERVAL = 1.0
+# Chờ thêm sau khi xong để worker hỏi /status và tự thoát
+SHUTDOWN_GRACE = 5.0
+
+def structure_files():
+    return [os.path.join(STRUCTURE_DIR, fname)
+            for fname in sorted(os.listdir(STRUCTURE_DIR)) if fname.endswith(".txt")]
+
+def import_jobs(ledger):
+    added = ledger.import_txt(CLASSIFY_STAGE, MAPPING_FILE, require_payload=True)
+    print(f"📥 {MAPPING_FILE}: {added} dòng mới")
+    # Product đã phân loại bằng 1_classify_tile_type.py thì đi thẳng vào stage download
+    for filepath in structure_files():
+        name = os.path.basename(filepath)[:-4]
+        added = ledger.import_txt(DOWNLOAD_STAGE, filepath, grp=name, require_payload=True)
+        if added:
+            print(f"📥 {filepath}: {added} dòng mới")
+    with ledger.conn:
+        ledger.conn.execute("UPDATE jobs SET status = ? WHERE stage = ? AND product_key IN "
+                            "(SELECT product_key FROM jobs WHERE stage = ?)", (DONE, CLASSIFY_STAGE, DOWNLOAD_STAGE))
+
+def make_on_complete(ledger):
+    def on_complete(stage, key, payload, grp, result):
+        if stage != CLASSIFY_STAGE or not result:
+            return
+        # Vẫn ghi file cấu trúc như 1_classify_tile_type.py để zip_if_done.sh và 2_download dùng được
+        with open(os.path.join(STRUCTURE_DIR, f"{result}.txt"), "a") as f:
+            f.write(f"{key},{payload}\n")
+        ledger.add(DOWNLOAD_STAGE, [(key, payload)], grp=result)
+    return on_complete
+
+def export_remaining(ledger):
+    # Như 2_download_tiles_from_mapping.py: file cấu trúc chỉ còn product chưa tải xong
+    for filepath in structure_files():
+        name = os.path.basename(filepath)[:-4]
+        if not ledger.export_txt(DOWNLOAD_STAGE, filepath, grp=name, unfinished=True):
+            print(f"✅ Hoàn tất file {os.path.basename(filepath)}")
+
+async def main():
+    if not os.path.exists(MAPPING_FILE) and not os.path.isdir(STRUCTURE_DIR):
+        print(f"❌ Không có {MAPPING_FILE} hay {STRUCTURE_DIR}/")
+        return
+    os.makedirs(STRUCTURE_DIR, exist_ok=True)
+    ledger = JobLedger()
+    import_jobs(ledger)
+    coordinator = LeaseCoordinator(ledger, ttl=LEASE_TTL, batch_size=LEASE_BATCH,
+                                   on_complete=make_on_complete(ledger))
+    runner = web.AppRunner(coordinator_app(coordinator, STAGES), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, HOST, PORT).start()
+    print(f"🗂️ Coordinator chạy ở cổng {PORT}, lease {LEASE_TTL:.0f}s, lô {LEASE_BATCH} product")
+
+    try:
+        last_report = 0.0
+        while True:
+            # status() cũng thu hồi lease hết hạn khi không worker nào hỏi lease mới
+            status = coordinator.status(STAGES)
+            if status["finished"]:
+                break
+            now = asyncio.get_running_loop().time()
+            if now - last_report >= REPORT_INTERVAL:
+                print(f"📈 {status['stages']} | {status['leases']} lease đang chạy")
+                last_report = now
+            await asyncio.sleep(POLL_INTERVAL)
+        print("✅ Hết product, chờ worker dừng...")
+        await asyncio.sleep(SHUTDOWN_GRACE)
+    finally:
+        await runner.cleanup()
+        print(coordinator.report())
+        export_remaining(ledger)
+        for stage in STAGES:
+            print(f"📒 Ledger {stage}: {ledger.counts(stage)}")
+        ledger.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
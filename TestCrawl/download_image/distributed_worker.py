@@ -0,0 +1,151 @@
+import asyncio
+import os
+import socket
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.job_ledger import DONE, FAILED
+from common.lease_coordinator import COORDINATOR_PORT, CoordinatorClient
+from common.layout_cache import LayoutCache, signature_name
+from common.http_cache import HttpCache
+from common.rate_controller import RateController, backoff_delay
+from common.tile_downloader import BASE_URL, ProductJob, TileDownloader, make_session, parse_structure_from_filename
+from common.tile_integrity import TileVerifier
+from common.worker_pool import map_unordered
+from common.telemetry import Metrics
+
+# Chạy trên mỗi máy (hoặc nhiều process trên một máy, mỗi process một thư mục): nhận lô product từ
+# distributed_coordinator.py, phân loại layout / tải tile vào image_crawled/ của máy này rồi báo kết quả
+COORDINATOR_URL = os.environ.get("CRAWL_COORDINATOR_URL", f"http://127.0.0.1:{COORDINATOR_PORT}")
+WORKER_ID = os.environ.get("CRAWL_WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+OUTPUT_DIR = "image_crawled"
+# Stage download được ưu tiên: product đã phân loại được tải xong trước khi nhận thêm
+STAGES = ("download", "classify")
+# Số product chạy song song trong một lease, và số lease mỗi worker giữ cùng lúc
+# (lease sau bắt đầu trong khi lease trước còn vài product cuối)
+CONCURRENT = {"download": 4, "classify": 20}
+LEASES_PER_WORKER = 2
+MAX_CONCURRENT = 128
+CLASSIFY_RETRY = 3
+CLASSIFY_STAGE = "classify"
+IDLE_WAIT = 2.0
+VERIFY_TILES = True
+
+class Worker:
+    def __init__(self, client, session, cache, controller, verifier, metrics):
+        self.client = client
+        self.session = session
+        self.cache = cache
+        self.layout_cache = LayoutCache()
+        self.downloader = TileDownloader(session, OUTPUT_DIR, BASE_URL, max_in_flight=MAX_CONCURRENT, cache=cache,
+                                         controller=controller, verifier=verifier, metrics=metrics)
+        self.handlers = {"download": self.download, "classify": self.classify}
+        self.leases = 0
+        self.lost = 0
+        self.counts = {}
+
+    async def check_url(self, url):
+        # Như 1_classify_tile_type.py: chỉ 200/404 là câu trả lời chắc chắn
+        for attempt in range(1, CLASSIFY_RETRY + 1):
+            try:
+                status = await self.cache.head(self.session, url, CLASSIFY_STAGE)
+                if status in (200, 404):
+                    return status == 200
+            except Exception:
+                pass
+            if attempt < CLASSIFY_RETRY:
+                await asyncio.sleep(backoff_delay(attempt))
+        return False
+
+    async def classify(self, item):
+        key, cdn_path, _ = item
+        structure, _, _ = await self.layout_cache.classify(self.check_url, cdn_path, BASE_URL)
+        if not structure:
+            print(f"❌ Không tìm thấy cấu trúc tile: {key}")
+            return [key, FAILED, None]
+        return [key, DONE, signature_name(structure)]
+
+    async def download(self, item):
+        key, cdn_path, name = item
+        job = ProductJob(key, cdn_path, parse_structure_from_filename(name), name)
+        ok = await self.downloader.download_product(job, MAX_CONCURRENT)
+        return [key, DONE if ok else FAILED, None]
+
+    async def _keep_alive(self, lease):
+        # Gia hạn ở 1/3 TTL; mất lease thì vẫn làm nốt (kết quả DONE vẫn được nhận) nhưng ghi lại để theo dõi
+        while True:
+            await asyncio.sleep(lease["ttl"] / 3)
+            try:
+                if not await self.client.heartbeat(lease):
+                    self.lost += 1
+                    print(f"⚠️ Mất lease {lease['lease_id']}, product có thể đã giao cho worker khác")
+                    return
+            except Exception as e:
+                print(f"⚠️ Heartbeat lease {lease['lease_id']}: {e!r}")
+
+    async def run_lease(self, lease):
+        stage = lease["stage"]
+        print(f"📦 Lease {lease['lease_id']}: {len(lease['items'])} product {stage}")
+        keep_alive = asyncio.create_task(self._keep_alive(lease))
+        results = []
+        try:
+            async for _, result in map_unordered(self.handlers[stage], lease["items"], CONCURRENT[stage]):
+                results.append(result)
+        finally:
+            keep_alive.cancel()
+            await asyncio.gather(keep_alive, return_exceptions=True)
+            # Dừng giữa chừng (Ctrl+C, lỗi): product chưa xong được trả lại ngay, không chờ hết hạn
+            await self.client.complete(lease, results)
+        for _, status, _ in results:
+            self.counts[(stage, status)] = self.counts.get((stage, status), 0) + 1
+        self.leases += 1
+
+    async def next_lease(self):
+        for stage in STAGES:
+            lease = await self.client.lease(stage)
+            if lease:
+                return lease
+        return None
+
+    async def loop(self):
+        while True:
+            lease = await self.next_lease()
+            if lease:
+                await self.run_lease(lease)
+                continue
+            # Product còn lại đang nằm trong lease của worker khác: chờ xong hoặc hết hạn
+            if (await self.client.status())["finished"]:
+                return
+            await asyncio.sleep(IDLE_WAIT)
+
+    def report(self):
+        counts = ", ".join(f"{stage} {status} {count}" for (stage, status), count in sorted(self.counts.items()))
+        return f"👷 Worker {self.client.worker}: {self.leases} lease ({self.lost} bị mất), {counts or 'không có việc'}"
+
+async def main():
+    metrics = Metrics()
+    controller = RateController(metrics=metrics, max_window=MAX_CONCURRENT)
+    cache = HttpCache(controller=controller)
+    verifier = TileVerifier() if VERIFY_TILES else None
+    print(f"👷 Worker {WORKER_ID} → {COORDINATOR_URL}")
+    try:
+        # Session riêng cho coordinator: request tới CDN đang chờ không làm chậm heartbeat
+        async with make_session(MAX_CONCURRENT) as session, make_session(LEASES_PER_WORKER * 2) as coordinator, \
+                metrics:
+            client = CoordinatorClient(coordinator, COORDINATOR_URL, WORKER_ID)
+            worker = Worker(client, session, cache, controller, verifier, metrics)
+            try:
+                await asyncio.gather(*(worker.loop() for _ in range(LEASES_PER_WORKER)))
+            finally:
+                worker.layout_cache.save()
+                print(worker.report())
+    finally:
+        cache.close()
+        if verifier:
+            verifier.close()
+        print(cache.report())
+        print(controller.report())
+        print(metrics.summary())
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,47 @@
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.key_extractor import KeySet, extract_keys, page_number
+
+# Trang danh sách đã crawl (crawl_*.html), key mới được ghi thêm vào product-key.txt cho 1_crawl_script.py
+CRAWL_PAGES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "CrawlData", "crawl_*.html")
+KEY_FILE = "product-key.txt"
+MAX_WORKERS = os.cpu_count() or 1
+# Ít trang thì quét luôn trong process chính, không đáng chi phí khởi động pool
+MIN_PARALLEL_PAGES = 32
+
+def scan_pages(paths):
+    if len(paths) < MIN_PARALLEL_PAGES or MAX_WORKERS == 1:
+        for path in paths:
+            yield extract_keys(path)
+        return
+    # Regex giữ GIL nên chia trang cho nhiều process; map giữ nguyên thứ tự trang
+    with ProcessPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        yield from pool.map(extract_keys, paths, chunksize=max(1, len(paths) // (MAX_WORKERS * 8)))
+
+def main():
+    start = time.perf_counter()
+    key_set = KeySet()
+    try:
+        # Key có sẵn trong product-key.txt (lần đầu: file làm tay từ output_unique.txt) không bị ghi lại
+        synced = key_set.sync_file(KEY_FILE)
+        if synced:
+            print(f"📥 Nạp {synced} key có sẵn từ {KEY_FILE}")
+
+        pages = sorted(glob.glob(CRAWL_PAGES), key=page_number)
+        changed = [path for path in pages if key_set.page_changed(path)]
+        print(f"📄 {len(pages)} trang danh sách, {len(changed)} trang mới/thay đổi")
+
+        added = key_set.add_pages(scan_pages(changed), KEY_FILE)
+        elapsed = time.perf_counter() - start
+        print(f"\n✅ Thêm {added} key mới vào {KEY_FILE} trong {elapsed:.2f}s")
+        print(key_set.report())
+    finally:
+        key_set.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,64 +1,65 @@
 import asyncio
+from collections import Counter
 from playwright.async_api import async_playwright
-import re
 import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.cdn_extractor import SITE_URL, PlaywrightResolver, StaticResolver
+from common.tile_downloader import make_session
+from common.worker_pool import map_unordered
+from common.line_writer import LineWriter
+from common.telemetry import Metrics
 
 KEY_FILE = "product-key.txt"
 OUTPUT_FILE = "product-mapping-image-key.txt"
 ERROR_FILE = "error_fetch_image_key.txt"
 MAX_CONCURRENT = 20
+STATIC_CONCURRENT = 50
 MAX_RETRY = 3
-CDN_PATTERN = re.compile(r"https?://imgscdn\.ajun720\.cn/(\d+/works/[a-zA-Z0-9]+)")
-
-# Đọc danh sách product keys
-with open(KEY_FILE, "r") as f:
-    keys = [line.strip() for line in f if line.strip()]
 
 # Xóa file output cũ nếu có
 for path in [OUTPUT_FILE, ERROR_FILE]:
     if os.path.exists(path):
         os.remove(path)
 
-async def fetch_cdn_from_tour(context, key, sema):
-    tour_url = f"http://www.ajun720.cn/tour/{key}"
-    cdn_path = None
-
-    async with sema:
-        for attempt in range(1, MAX_RETRY + 1):
-            print(f"🔍 [{key}] Thử lần {attempt}...")
-            page = await context.new_page()
-
-            def handle_request(request):
-                nonlocal cdn_path
-                match = CDN_PATTERN.search(request.url)
-                if match and not cdn_path:
-                    cdn_path = match.group(1)
-
-            page.on("request", handle_request)
-
-            try:
-                await page.goto(tour_url, timeout=60000)
-                await page.wait_for_timeout(10000)
-            except Exception as e:
-                print(f"⚠️ Lỗi {key} lần {attempt}: {e}")
-                await page.wait_for_timeout(5000)
-            finally:
-                await page.close()
-
-            if cdn_path:
-                print(f"✅ {key} → {cdn_path}")
-                async with asyncio.Lock():
-                    with open(OUTPUT_FILE, "a") as out:
-                        out.write(f"{key},{cdn_path}\n")
-                return
-
-        print(f"❌ Không tìm thấy CDN cho {key} sau {MAX_RETRY} lần")
-        async with asyncio.Lock():
-            with open(ERROR_FILE, "a") as err:
-                err.write(f"{key}\n")
+resolved_by = Counter()
+# Latency/lỗi của GET trang tour và lần mở trang Playwright, in mỗi 10s và ghi crawl_metrics.prom/.json
+metrics = Metrics()
+
+async def fetch_cdn_from_tour(resolver, output, key, retries=MAX_RETRY):
+    for attempt in range(1, retries + 1):
+        print(f"🔍 [{key}] Thử lần {attempt} ({resolver.name})...")
+        cdn_path = await resolver.resolve(key)
+
+        if cdn_path:
+            print(f"✅ {key} → {cdn_path} ({resolver.name})")
+            resolved_by[resolver.name] += 1
+            # Chỉ task của LineWriter ghi file, các coroutine không tranh nhau mở file
+            await output.write(f"{key},{cdn_path}")
+            return True
+        if attempt < retries:
+            await asyncio.sleep(1)
+    return False
+
+def read_keys(path):
+    # Đọc dần product keys, không nạp cả file vào bộ nhớ
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                yield line.strip()
+
+async def resolve_keys(resolver, output, keys, retries=MAX_RETRY, limit=MAX_CONCURRENT):
+    # Trả về các key chưa tìm được đường dẫn CDN
+    pending = []
+    results = map_unordered(lambda key: fetch_cdn_from_tour(resolver, output, key, retries), keys, limit)
+    async for key, ok in results:
+        if not ok:
+            pending.append(key)
+    return pending
 
 async def check_connection():
-    print("🌐 Kiểm tra kết nối đến http://www.ajun720.cn ...")
+    print(f"🌐 Kiểm tra kết nối đến {SITE_URL} ...")
     try:
         import aiohttp
     except ImportError:
@@ -67,7 +68,7 @@ async def check_connection():
 
     try:
         async with aiohttp.ClientSession() as session:
-            async with session.get("http://www.ajun720.cn", timeout=10) as resp:
+            async with session.get(SITE_URL, timeout=10) as resp:
                 if resp.status == 200:
                     print("✅ Kết nối thành công!")
                 else:
@@ -78,14 +79,34 @@ async def check_connection():
 async def main():
     await check_connection()
 
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)
-        context = await browser.new_context(user_agent="Mozilla/5.0")
-        sema = asyncio.Semaphore(MAX_CONCURRENT)
-
-        tasks = [fetch_cdn_from_tour(context, key, sema) for key in keys]
-        await asyncio.gather(*tasks)
+    # Mapping được ghi theo lô và fsync định kỳ, dừng giữa chừng vẫn giữ các key đã tìm được
+    async with LineWriter(OUTPUT_FILE) as output, metrics:
+        # Thử HTTP thuần trước: không có đường dẫn CDN trong HTML/script thì mới cần trình duyệt.
+        # StaticResolver tự retry lỗi mạng, "không tìm thấy" thì thử lại cũng vô ích.
+        async with make_session(STATIC_CONCURRENT) as session:
+            static = StaticResolver(session, metrics=metrics)
+            pending = await resolve_keys(static, output, read_keys(KEY_FILE), retries=1, limit=STATIC_CONCURRENT)
+            total = static.resolved + len(pending)
+            print(f"📊 Static: {static.resolved}/{total} key, {static.keys_per_minute():.0f} key/phút")
+
+        if pending:
+            print(f"🌐 Dùng Playwright cho {len(pending)} key còn lại...")
+            async with async_playwright() as p:
+                browser = await p.chromium.launch(headless=True)
+                # Pool MAX_CONCURRENT trang dùng lại giữa các key, cũng là giới hạn song song
+                async with PlaywrightResolver(browser, MAX_CONCURRENT, metrics=metrics) as resolver:
+                    pending = await resolve_keys(resolver, output, pending)
+                    print(f"📊 Playwright: {resolver.keys_per_minute():.0f} key/phút")
+
+                await browser.close()
+
+    for key in pending:
+        print(f"❌ Không tìm thấy CDN cho {key} sau {MAX_RETRY} lần")
+    async with LineWriter(ERROR_FILE, atomic=True) as errors:
+        for key in pending:
+            await errors.write(key)
 
-        await browser.close()
+    print("📊 Nguồn: " + ", ".join(f"{name} {count}" for name, count in resolved_by.items()))
+    print(metrics.summary())
 
 asyncio.run(main())
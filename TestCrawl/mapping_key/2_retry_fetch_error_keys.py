@@ -1,85 +1,81 @@
 import asyncio
 from playwright.async_api import async_playwright
-import re
 import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.job_ledger import JobLedger, DONE, FAILED, parse_line
+from common.cdn_extractor import ChainResolver, PlaywrightResolver, StaticResolver
+from common.tile_downloader import make_session
+from common.worker_pool import run_bounded
+from common.line_writer import LineWriter
 
 ERROR_FILE = "error_fetch_image_key.txt"
 OUTPUT_FILE = "product-mapping-image-key.txt"
 MAX_CONCURRENT = 10
 MAX_RETRY = 3
-CDN_PATTERN = re.compile(r"https?://imgscdn\.ajun720\.cn/(\d+/works/[a-zA-Z0-9]+)")
-
-def remove_key_from_error_file(key):
-    if not os.path.exists(ERROR_FILE):
-        return
-    with open(ERROR_FILE, "r") as f:
-        lines = f.readlines()
-    with open(ERROR_FILE, "w") as f:
-        for line in lines:
-            if line.strip() != key:
-                f.write(line)
-
-async def fetch_and_handle(context, key, sema, lock):
-    tour_url = f"http://www.ajun720.cn/tour/{key}"
-    cdn_path = None
-
-    async with sema:
-        for attempt in range(1, MAX_RETRY + 1):
-            print(f"🔁 [{key}] Thử lần {attempt}")
-            page = await context.new_page()
-
-            def handle_request(request):
-                nonlocal cdn_path
-                match = CDN_PATTERN.search(request.url)
-                if match and not cdn_path:
-                    cdn_path = match.group(1)
-
-            page.on("request", handle_request)
-
-            try:
-                print(f"🌐 Đang truy cập {tour_url}...")
-                await page.goto(tour_url, timeout=60000)
-                await page.wait_for_timeout(8000)
-            except Exception as e:
-                print(f"⚠️ Lỗi {key} lần {attempt}: {e}")
-                await page.wait_for_timeout(3000)
-            finally:
-                await page.close()
-
-            if cdn_path:
-                print(f"✅ {key} → {cdn_path}")
-                async with lock:
-                    with open(OUTPUT_FILE, "a") as out:
-                        out.write(f"{key},{cdn_path}\n")
-                    remove_key_from_error_file(key)
-                return True
-
-        print(f"❌ Không tìm thấy CDN cho {key}")
-        return False
+LEDGER_STAGE = "cdn_mapping"
 
-async def retry_errors():
-    lock = asyncio.Lock()
+async def fetch_and_handle(resolver, key, output, ledger):
+    for attempt in range(1, MAX_RETRY + 1):
+        print(f"🔁 [{key}] Thử lần {attempt}")
+        cdn_path = await resolver.resolve(key)
 
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)
-        context = await browser.new_context()
-        sema = asyncio.Semaphore(MAX_CONCURRENT)
+        if cdn_path:
+            print(f"✅ {key} → {cdn_path} ({resolver.source[key]})")
+            # Ledger chỉ đánh dấu DONE khi dòng đã fsync xong (xem mark_done)
+            await output.write(f"{key},{cdn_path}")
+            return True
+        await asyncio.sleep(1)
 
-        while True:
-            if not os.path.exists(ERROR_FILE):
-                print("🎉 Không còn lỗi để retry.")
-                break
+    print(f"❌ Không tìm thấy CDN cho {key}")
+    ledger.set_status(LEDGER_STAGE, key, FAILED)
+    return False
 
-            with open(ERROR_FILE, "r") as f:
-                keys = [line.strip() for line in f if line.strip()]
+async def retry_errors():
+    ledger = JobLedger()
 
-            if not keys:
-                print("🎉 Retry hoàn tất, không còn key.")
-                break
+    def mark_done(lines):
+        for line in lines:
+            key, cdn_path = parse_line(line)
+            ledger.set_status(LEDGER_STAGE, key, DONE, cdn_path)
 
-            print(f"🚀 Đang retry {len(keys)} key lỗi...")
+    output = await LineWriter(OUTPUT_FILE, on_flush=mark_done).start()
 
-            await asyncio.gather(*(fetch_and_handle(context, key, sema, lock) for key in keys))
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        session = make_session(MAX_CONCURRENT)
+        playwright_resolver = await PlaywrightResolver(browser, MAX_CONCURRENT).start()
+        # Thử HTTP thuần trước, trình duyệt chỉ cho key mà HTML/script không chứa đường dẫn CDN
+        resolver = ChainResolver(StaticResolver(session), playwright_resolver)
+
+        try:
+            while True:
+                if not os.path.exists(ERROR_FILE):
+                    print("🎉 Không còn lỗi để retry.")
+                    break
+
+                ledger.import_txt(LEDGER_STAGE, ERROR_FILE)
+                keys = [key for key, _, _ in ledger.unfinished(LEDGER_STAGE)]
+
+                if not keys:
+                    print("🎉 Retry hoàn tất, không còn key.")
+                    break
+
+                print(f"🚀 Đang retry {len(keys)} key lỗi...")
+
+                # Pool trang Playwright chỉ có MAX_CONCURRENT trang, không cần tạo trước coroutine cho mọi key
+                await run_bounded(lambda key: fetch_and_handle(resolver, key, output, ledger), keys, MAX_CONCURRENT)
+                # Các key vừa tìm được phải có trong ledger trước khi tính lại danh sách lỗi
+                await output.flush()
+                # File lỗi chỉ ghi lại một lần sau mỗi vòng
+                ledger.export_txt(LEDGER_STAGE, ERROR_FILE, unfinished=True)
+                print(f"📊 Nguồn: {resolver.report()}")
+        finally:
+            await output.close()
+            ledger.close()
+            await playwright_resolver.close()
+            await session.close()
 
         await browser.close()
 
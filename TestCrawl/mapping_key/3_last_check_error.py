@@ -1,52 +1,56 @@
 import aiohttp
 import asyncio
 import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.rate_controller import RateController
+from common.worker_pool import map_unordered
+from common.line_writer import LineWriter
+from common.product_validator import ProductValidator
 
 ERROR_FILE = "error_fetch_image_key.txt"
 OUTPUT_FILE = "hacking_attempt_keys.txt"
-CHECK_STRING = "hacking attempt"
-BASE_URL = "http://www.ajun720.cn"
-MAX_CONCURRENT = 10
-MAX_RETRY = 3
-
-sem = asyncio.Semaphore(MAX_CONCURRENT)
-
-async def check_key(session, key):
-    url = f"{BASE_URL}/{key}"
-
-    for attempt in range(1, MAX_RETRY + 1):
-        async with sem:
-            try:
-                async with session.get(url, timeout=10) as resp:
-                    text = await resp.text()
-                    if CHECK_STRING in text.lower():
-                        print(f"❌ [HACK BLOCKED] {key}")
-                        return key
-                    else:
-                        print(f"✅ [OK] {key}")
-                        return None
-            except Exception as e:
-                print(f"⚠️ [ERROR] {key} lần {attempt}: {e}")
-                await asyncio.sleep(1)  # nhỏ delay trước khi thử lại
-    return None
+# Trần số key song song, RateController tự giảm khi origin trả "hacking attempt"
+MAX_CONCURRENT = 32
+
+controller = RateController(max_window=MAX_CONCURRENT)
+
+async def check_key(validator, key):
+    # Có thể chỉ do gửi quá nhanh: validator lùi lại rồi hỏi lại, chặn cả MAX_RETRY lần mới ghi nhận
+    if await validator.tour_blocked(key):
+        print(f"❌ [HACK BLOCKED] {key}")
+        return True
+    print(f"✅ [OK] {key}")
+    return False
+
+def read_keys(path):
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                yield line.strip()
 
 async def main():
     if not os.path.exists(ERROR_FILE):
         print("❗ File lỗi không tồn tại.")
         return
 
-    with open(ERROR_FILE, "r") as f:
-        keys = [line.strip() for line in f if line.strip()]
-
+    # MAX_CONCURRENT worker đọc dần file lỗi, key bị chặn được ghi ngay khi có kết quả
+    blocked = 0
     async with aiohttp.ClientSession() as session:
-        results = await asyncio.gather(*(check_key(session, key) for key in keys))
-
-    blocked_keys = list(filter(None, results))
-
-    if blocked_keys:
-        with open(OUTPUT_FILE, "w") as f:
-            f.write("\n".join(blocked_keys))
-        print(f"\n🔒 Đã ghi {len(blocked_keys)} key bị chặn vào {OUTPUT_FILE}")
+        validator = ProductValidator(session, controller=controller)
+        # Ghi vào file tạm, chỉ thay OUTPUT_FILE khi đã kiểm tra xong mọi key
+        async with LineWriter(OUTPUT_FILE, atomic=True) as output:
+            results = map_unordered(lambda key: check_key(validator, key), read_keys(ERROR_FILE), MAX_CONCURRENT)
+            async for key, is_blocked in results:
+                if is_blocked:
+                    await output.write(key)
+                    blocked += 1
+
+    print(controller.report())
+
+    if blocked:
+        print(f"\n🔒 Đã ghi {blocked} key bị chặn vào {OUTPUT_FILE}")
     else:
         print("\n✅ Không có key nào bị chặn.")
 
@@ -1,69 +1,73 @@
 import aiohttp
 import asyncio
 import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.job_ledger import JobLedger, DONE, FAILED, format_line, parse_line
+from common.http_cache import HttpCache
+from common.rate_controller import RateController
+from common.product_validator import ProductValidator, VALID
+from common.worker_pool import run_bounded
+from common.line_writer import LineWriter
 
 MAPPING_FILE = "product-mapping-image-key.txt"
 OUTPUT_FILE = "has_image.txt"
-MAX_CONCURRENT = 20
-MAX_RETRY = 3
-BASE_URL = "https://imgscdn.ajun720.cn"
-
-sem = asyncio.Semaphore(MAX_CONCURRENT)
-lock = asyncio.Lock()
-
-async def check_image_exists(session, url):
-    for _ in range(MAX_RETRY):
-        try:
-            async with session.head(url, timeout=10) as resp:
-                if resp.status == 200:
-                    return True
-        except:
-            await asyncio.sleep(1)
-    return False
+# Trần số product kiểm tra song song, RateController quyết định số request thực tế
+MAX_CONCURRENT = 64
+LEDGER_STAGE = "check_image"
 
-async def process_line(session, line):
+async def process_line(validator, ledger, output, line):
     line = line.strip()
     if not line:
         return
 
     product_key, image_path = line.split(",", 1)
-    preview_url = f"{BASE_URL}/{image_path}/preview.jpg"
-    image_url = f"{BASE_URL}/{image_path}/b/l1/1/l1_b_1_1.jpg"
+    # preview.jpg và l1_b_1_1.jpg được HEAD song song (common/product_validator.py)
+    record = await validator.validate(product_key, image_path)
 
-    async with sem:
-        preview_ok = await check_image_exists(session, preview_url)
-        img_ok = await check_image_exists(session, image_url)
-
-        if preview_ok and img_ok:
-            print(f"✅ {product_key}")
-            async with lock:
-                with open(OUTPUT_FILE, "a") as f:
-                    f.write(line + "\n")
-                if os.path.exists(MAPPING_FILE):
-                    with open(MAPPING_FILE, "r") as f:
-                        lines = f.readlines()
-                    with open(MAPPING_FILE, "w") as f:
-                        for l in lines:
-                            if l.strip() != line:
-                                f.write(l)
-        else:
-            print(f"❌ {product_key} - Thiếu: ", end="")
-            if not preview_ok:
-                print("preview.jpg", end=" ")
-            if not img_ok:
-                print("l1_b_1_1.jpg", end="")
-            print()
+    if record["status"] == VALID:
+        print(f"✅ {product_key}")
+        # DONE được ghi vào ledger khi dòng đã fsync xong (xem mark_done)
+        await output.write(line)
+    else:
+        ledger.set_status(LEDGER_STAGE, product_key, FAILED)
+        print(f"❌ {product_key} - Thiếu: ", end="")
+        if not record["preview"]:
+            print("preview.jpg", end=" ")
+        if not record["tile"]:
+            print("l1_b_1_1.jpg", end="")
+        print()
 
 async def main():
     if not os.path.exists(MAPPING_FILE):
         print("❌ File mapping không tồn tại.")
         return
 
-    with open(MAPPING_FILE, "r") as f:
-        lines = f.readlines()
+    ledger = JobLedger()
+    ledger.import_txt(LEDGER_STAGE, MAPPING_FILE, require_payload=True)
+    lines = (format_line(key, path) for key, path, _ in ledger.unfinished(LEDGER_STAGE))
+    # HEAD 200 còn hạn không cần hỏi lại CDN khi chạy lại
+    controller = RateController(max_window=MAX_CONCURRENT)
+    cache = HttpCache(controller=controller)
+
+    def mark_done(lines):
+        for line in lines:
+            ledger.set_status(LEDGER_STAGE, parse_line(line)[0], DONE)
 
-    async with aiohttp.ClientSession() as session:
-        await asyncio.gather(*(process_line(session, line) for line in lines))
+    try:
+        async with aiohttp.ClientSession() as session, LineWriter(OUTPUT_FILE, on_flush=mark_done) as output:
+            validator = ProductValidator(session, cache, controller)
+            # MAX_CONCURRENT worker lấy dần từng dòng thay vì tạo sẵn một coroutine cho mỗi product
+            await run_bounded(lambda line: process_line(validator, ledger, output, line),
+                              lines, MAX_CONCURRENT)
+    finally:
+        print(cache.report())
+        print(controller.report())
+        cache.close()
+        # File mapping chỉ được ghi lại một lần với các key chưa có ảnh
+        ledger.export_txt(LEDGER_STAGE, MAPPING_FILE, unfinished=True)
+        ledger.close()
 
     print("\n🎯 Hoàn tất xử lý.")
 
@@ -0,0 +1,77 @@
+import aiohttp
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.job_ledger import parse_line, format_line
+from common.http_cache import HttpCache
+from common.rate_controller import RateController
+from common.worker_pool import map_unordered
+from common.line_writer import LineWriter
+from common.product_validator import ProductValidator, VALID, BLOCKED, format_record
+from common.telemetry import Metrics
+
+# Một lượt thay cho 3_last_check_error.py + 4_check_image_exists.py: mọi product trong file mapping
+# và file lỗi được kiểm tra song song, mỗi product một dòng trạng thái "key,status,image_path"
+MAPPING_FILE = "product-mapping-image-key.txt"
+ERROR_FILE = "error_fetch_image_key.txt"
+STATUS_FILE = "validation_status.txt"
+HAS_IMAGE_FILE = "has_image.txt"
+BLOCKED_FILE = "hacking_attempt_keys.txt"
+# Trần số product kiểm tra song song, RateController quyết định số request thực tế
+MAX_CONCURRENT = 64
+
+def read_products():
+    # (key, image_path) cho product đã có CDN path, (key, None) cho key còn lỗi
+    if os.path.exists(MAPPING_FILE):
+        with open(MAPPING_FILE) as f:
+            for line in f:
+                key, image_path = parse_line(line.strip())
+                if key and image_path:
+                    yield key, image_path
+    if os.path.exists(ERROR_FILE):
+        with open(ERROR_FILE) as f:
+            for line in f:
+                if line.strip():
+                    yield line.strip(), None
+
+async def main():
+    metrics = Metrics()
+    controller = RateController(metrics=metrics, max_window=MAX_CONCURRENT)
+    # HEAD preview/l1 đi qua cùng cache với 1_classify_tile_type.py, stage sau không hỏi lại CDN
+    cache = HttpCache(controller=controller)
+    start = time.perf_counter()
+
+    try:
+        async with aiohttp.ClientSession() as session, metrics, \
+                LineWriter(STATUS_FILE, atomic=True) as status_out, \
+                LineWriter(HAS_IMAGE_FILE, atomic=True) as image_out, \
+                LineWriter(BLOCKED_FILE, atomic=True) as blocked_out:
+            validator = ProductValidator(session, cache, controller)
+            results = map_unordered(lambda product: validator.validate(*product), read_products(), MAX_CONCURRENT)
+            async for _, record in results:
+                await status_out.write(format_record(record))
+                if record["status"] == VALID:
+                    print(f"✅ {record['key']}")
+                    await image_out.write(format_line(record["key"], record["image_path"]))
+                elif record["status"] == BLOCKED:
+                    print(f"🔒 {record['key']}")
+                    await blocked_out.write(record["key"])
+                else:
+                    print(f"❌ {record['key']} - {record['status']}")
+    finally:
+        cache.close()
+
+    elapsed = time.perf_counter() - start
+    total = sum(validator.counts.values())
+    print(f"\n🎯 {total} product trong {elapsed:.1f}s ({total / elapsed if elapsed else 0:.0f} product/s)")
+    print(validator.report())
+    print(cache.report())
+    print(controller.report())
+    print(metrics.summary())
+    print(f"📄 {STATUS_FILE}, {HAS_IMAGE_FILE}, {BLOCKED_FILE}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
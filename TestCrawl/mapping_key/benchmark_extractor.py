@@ -0,0 +1,101 @@
+import asyncio
+import os
+import sys
+import time
+from aiohttp import web
+from playwright.async_api import async_playwright
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.cdn_extractor import CDN_PATTERN, PlaywrightResolver
+
+HOST = "127.0.0.1"
+PORT = 8766
+KEYS = [f"{i:016x}" for i in range(40)]
+MAX_CONCURRENT = 10
+LEGACY_WAIT = 10000  # ms, giống wait_for_timeout(10000) của 1_crawl_script.py cũ
+CDN_DELAY = 300  # ms trước khi script của trang gọi tới CDN
+
+# Trang tour giả: ảnh/font nặng phục vụ tại chỗ, script gọi CDN sau một khoảng trễ
+TOUR_HTML = """<!DOCTYPE html>
+<html><head><link rel="stylesheet" href="/static/style.css"></head>
+<body>
+<img src="/static/big.jpg"><img src="/static/big.jpg?2">
+<script>
+setTimeout(function () {{
+  new Image().src = "https://imgscdn.ajun720.cn/{cdn_id}/works/{key}/preview.jpg";
+}}, {delay});
+</script>
+</body></html>"""
+
+def expected_path(key):
+    return f"{int(key, 16) % 900 + 100}/works/{key}"
+
+async def tour(request):
+    key = request.match_info["key"]
+    cdn_id = expected_path(key).split("/")[0]
+    return web.Response(text=TOUR_HTML.format(cdn_id=cdn_id, key=key, delay=CDN_DELAY), content_type="text/html")
+
+async def static(request):
+    await asyncio.sleep(0.2)
+    return web.Response(body=b"\0" * 2_000_000, content_type="application/octet-stream")
+
+async def start_server():
+    app = web.Application()
+    app.router.add_get("/tour/{key}", tour)
+    app.router.add_get("/static/{name}", static)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, HOST, PORT).start()
+    return runner
+
+async def legacy(browser, tour_url):
+    # Cách cũ: mỗi lần thử một trang mới, tải mọi tài nguyên, chờ cố định
+    context = await browser.new_context()
+    # Route đăng ký một lần cho cả context, không cộng dồn handler theo từng key
+    await context.route(CDN_PATTERN, lambda route: route.abort())
+    sema = asyncio.Semaphore(MAX_CONCURRENT)
+    results = {}
+
+    async def one(key):
+        async with sema:
+            page = await context.new_page()
+            found = []
+            page.on("request", lambda r: found.append(r.url) if CDN_PATTERN.search(r.url) else None)
+            try:
+                await page.goto(tour_url.format(key=key), timeout=60000)
+                await page.wait_for_timeout(LEGACY_WAIT)
+            finally:
+                await page.close()
+            results[key] = CDN_PATTERN.search(found[0]).group(1) if found else None
+
+    await asyncio.gather(*(one(key) for key in KEYS))
+    await context.close()
+    return results
+
+async def pooled(browser, tour_url):
+    async with PlaywrightResolver(browser, MAX_CONCURRENT, tour_url=tour_url) as resolver:
+        paths = await asyncio.gather(*(resolver.resolve(key) for key in KEYS))
+    return dict(zip(KEYS, paths))
+
+async def measure(name, fn, browser, tour_url):
+    start = time.perf_counter()
+    results = await fn(browser, tour_url)
+    elapsed = time.perf_counter() - start
+    correct = sum(results[key] == expected_path(key) for key in KEYS)
+    print(f"{name:<8} {elapsed:6.1f}s  {len(KEYS) / elapsed * 60:7.0f} key/phút  đúng {correct}/{len(KEYS)}")
+
+async def main():
+    runner = await start_server()
+    tour_url = f"http://{HOST}:{PORT}/tour/{{key}}"
+    try:
+        async with async_playwright() as p:
+            browser = await p.chromium.launch(headless=True)
+            print(f"🧪 {len(KEYS)} key, {MAX_CONCURRENT} song song, fixture tại {tour_url}")
+            await measure("legacy", legacy, browser, tour_url)
+            await measure("pooled", pooled, browser, tour_url)
+            await browser.close()
+    finally:
+        await runner.cleanup()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,148 @@
+import asyncio
+import glob
+import os
+import re
+import sys
+import time
+from aiohttp import web
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.cdn_extractor import RESOURCE_PATTERN, PlaywrightResolver, StaticResolver, extract_cdn_path
+from common.tile_downloader import make_session
+
+CRAWL_PAGES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "CrawlData", "crawl_*.html")
+MAPPING_FILE = "product-mapping-image-key.txt"
+KEY_PATTERN = re.compile(r"tour/([0-9a-f]{16})")
+HOST = "127.0.0.1"
+PORT = 8767
+STATIC_CONCURRENT = 50
+PLAYWRIGHT_CONCURRENT = 10
+SCRIPT_LATENCY = 0.02  # giây cho mỗi file tĩnh của fixture
+SCRIPT_SIZE = 90_000
+
+# Ba kiểu trang tour: đường dẫn nằm ngay trong HTML, trong script riêng của key,
+# hoặc chỉ được ghép lúc chạy JS (bắt buộc phải có trình duyệt)
+INLINE = '<script>embedpano({{xml: "https://imgscdn.ajun720.cn/{path}/tour.xml"}});</script>'
+EXTERNAL = '<script src="/tour/{key}/pano.js"></script>'
+RUNTIME = ('<script>new Image().src = "https://imgscdn." + "ajun720.cn/" + "{cdn_id}" + '
+           '"/works/" + "{hash}" + "/preview.jpg";</script>')
+VARIANTS = ("inline", "inline", "external", "runtime")
+
+def load_pages():
+    pages = []
+    for path in sorted(glob.glob(CRAWL_PAGES)):
+        with open(path, encoding="utf-8", errors="ignore") as f:
+            pages.append(f.read())
+    return pages
+
+def load_expected(pages):
+    mapping = {}
+    if os.path.exists(MAPPING_FILE):
+        with open(MAPPING_FILE) as f:
+            for line in f:
+                if "," in line:
+                    key, path = line.strip().split(",", 1)
+                    mapping[key] = path
+    keys = list(dict.fromkeys(key for page in pages for key in KEY_PATTERN.findall(page)))
+    # Key chưa có trong file mapping thì dùng đường dẫn giả lập
+    return {key: mapping.get(key, f"{int(key, 16) % 900 + 100}/works/{key[::-1]}") for key in keys}
+
+def offline_scan(pages):
+    # Trang danh sách chỉ có thumb của nhiều product, extractor phải trả về None
+    start = time.perf_counter()
+    found = sum(extract_cdn_path(page) is not None for page in pages)
+    resources = sum(len(RESOURCE_PATTERN.findall(page)) for page in pages)
+    elapsed = time.perf_counter() - start
+    size = sum(len(page) for page in pages) / 1e6
+    print(f"📄 {len(pages)} trang lưu sẵn ({size:.1f} MB): {size / elapsed:.0f} MB/s, "
+          f"{resources} script tham chiếu, {found} trang bị nhận nhầm đường dẫn")
+
+def build_app(pages, expected):
+    keys = list(expected)
+
+    def variant(key):
+        return VARIANTS[keys.index(key) % len(VARIANTS)]
+
+    async def tour(request):
+        key = request.match_info["key"]
+        path = expected[key]
+        cdn_id, _, hash_ = path.split("/")
+        embed = {
+            "inline": INLINE.format(path=path),
+            "external": EXTERNAL.format(key=key),
+            "runtime": RUNTIME.format(cdn_id=cdn_id, hash=hash_),
+        }[variant(key)]
+        page = pages[keys.index(key) % len(pages)]
+        return web.Response(text=page.replace("</body>", embed + "</body>"), content_type="text/html")
+
+    async def pano_js(request):
+        path = expected[request.match_info["key"]]
+        return web.Response(text=f'var panoXml = "https://imgscdn.ajun720.cn/{path}/tour.xml";',
+                            content_type="application/javascript")
+
+    async def static(request):
+        await asyncio.sleep(SCRIPT_LATENCY)
+        return web.Response(text="/*" + "x" * SCRIPT_SIZE + "*/", content_type="application/javascript")
+
+    app = web.Application()
+    app.router.add_get("/tour/{key}", tour)
+    app.router.add_get("/tour/{key}/pano.js", pano_js)
+    app.router.add_get("/{tail:.*}", static)
+    return app, variant
+
+async def run_resolver(name, resolver, keys, expected, limit):
+    sema = asyncio.Semaphore(limit)
+
+    async def one(key):
+        async with sema:
+            return await resolver.resolve(key)
+
+    start = time.perf_counter()
+    paths = await asyncio.gather(*(one(key) for key in keys))
+    elapsed = time.perf_counter() - start
+    correct = sum(path == expected[key] for key, path in zip(keys, paths))
+    unresolved = [key for key, path in zip(keys, paths) if path is None]
+    wrong = len(keys) - correct - len(unresolved)
+    print(f"{name:<11} {elapsed:6.2f}s  {len(keys) / elapsed * 60:8.0f} key/phút  "
+          f"đúng {correct}/{len(keys)}  sai {wrong}  chưa tìm được {len(unresolved)}")
+    return unresolved
+
+async def main():
+    pages = load_pages()
+    if not pages:
+        print(f"❌ Không tìm thấy {CRAWL_PAGES}")
+        return
+    offline_scan(pages)
+
+    expected = load_expected(pages)
+    keys = list(expected)
+    app, variant = build_app(pages, expected)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, HOST, PORT).start()
+    tour_url = f"http://{HOST}:{PORT}/tour/{{key}}"
+
+    try:
+        async with make_session(STATIC_CONCURRENT) as session:
+            resolver = StaticResolver(session, tour_url=tour_url)
+            unresolved = await run_resolver("static", resolver, keys, expected, STATIC_CONCURRENT)
+            print(f"   {resolver.requests / len(keys):.1f} request/key, "
+                  f"{sum(variant(key) == 'runtime' for key in unresolved)}/{len(unresolved)} "
+                  f"key chưa tìm được là trang chỉ ghép đường dẫn bằng JS")
+
+        try:
+            from playwright.async_api import async_playwright
+            async with async_playwright() as p:
+                browser = await p.chromium.launch(headless=True)
+                async with PlaywrightResolver(browser, PLAYWRIGHT_CONCURRENT, tour_url=tour_url) as pw:
+                    await run_resolver("playwright", pw, keys, expected, PLAYWRIGHT_CONCURRENT)
+                async with PlaywrightResolver(browser, PLAYWRIGHT_CONCURRENT, tour_url=tour_url) as pw:
+                    await run_resolver("fallback", pw, unresolved, expected, PLAYWRIGHT_CONCURRENT)
+                await browser.close()
+        except Exception as e:
+            print(f"⚠️ Bỏ qua phần Playwright: {str(e).splitlines()[0]}")
+    finally:
+        await runner.cleanup()
+
+if __name__ == "__main__":
+    asyncio.run(main())
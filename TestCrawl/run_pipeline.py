@@ -0,0 +1,226 @@
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from common.job_ledger import JobLedger, LEDGER_FILE, DONE, FAILED, PENDING
+from common.cdn_extractor import TOUR_URL, ChainResolver, PlaywrightResolver, StaticResolver
+from common.product_validator import TOUR_URL as VALIDATE_TOUR_URL, ProductValidator, VALID, BLOCKED, REACHABLE
+from common.layout_cache import LAYOUT_CACHE_FILE, LayoutCache, signature_name
+from common.http_cache import HTTP_CACHE_FILE, HttpCache
+from common.rate_controller import RateController, backoff_delay
+from common.tile_downloader import BASE_URL, ProductJob, TileDownloader, make_session, parse_structure_from_filename
+from common.tile_integrity import TileVerifier
+from common.line_writer import LineWriter, LineWriterGroup
+from common.pipeline import Stage, Pipeline
+from common.telemetry import METRICS_FILE, METRICS_JSON_FILE, Metrics
+
+# Một lệnh thay cho 1_crawl_script → 2_retry → 3_last_check → 4_check_image_exists
+# → 1_classify_tile_type → 2_download_tiles: key đi sang stage sau ngay khi xong stage trước.
+# File đầu ra giống các script cũ nên vẫn có thể chạy lại từng script riêng
+ROOT = os.path.dirname(os.path.abspath(__file__))
+MAPPING_DIR = os.path.join(ROOT, "mapping_key")
+DOWNLOAD_DIR = os.path.join(ROOT, "download_image")
+KEY_FILE = os.path.join(MAPPING_DIR, "product-key.txt")
+MAPPING_FILE = os.path.join(MAPPING_DIR, "product-mapping-image-key.txt")
+ERROR_FILE = os.path.join(MAPPING_DIR, "error_fetch_image_key.txt")
+BLOCKED_FILE = os.path.join(MAPPING_DIR, "hacking_attempt_keys.txt")
+HAS_IMAGE_FILE = os.path.join(DOWNLOAD_DIR, "has_image.txt")
+STRUCTURE_DIR = os.path.join(DOWNLOAD_DIR, "output_structure")
+OUTPUT_DIR = os.path.join(DOWNLOAD_DIR, "image_crawled")
+
+# Số worker của từng stage; số request thật tới mỗi host do RateController quyết định
+RESOLVE_CONCURRENT = 50
+PLAYWRIGHT_POOL = 10
+VALIDATE_CONCURRENT = 32
+CLASSIFY_CONCURRENT = 20
+DOWNLOAD_PRODUCTS = 4
+MAX_IN_FLIGHT = 128  # trần request tile song song, chia cho mọi product đang tải
+RESOLVE_RETRY = 3
+CLASSIFY_RETRY = 3
+CLASSIFY_STAGE = "classify"
+PRODUCT_RETRY = 3
+# Thử trình duyệt cho key mà HTML/script không chứa đường dẫn CDN (cần playwright)
+USE_PLAYWRIGHT = True
+VERIFY_TILES = True
+PIPELINE_STAGE = "pipeline"
+DOWNLOAD_STAGE = "download"  # cùng stage với 2_download_tiles_from_mapping.py
+
+class CrawlPipeline:
+    def __init__(self, resolver, cdn_session, ledger, outputs, controller, cache, verifier, metrics):
+        self.resolver = resolver
+        self.ledger = ledger
+        self.outputs = outputs
+        self.cache = cache
+        self.cdn_session = cdn_session
+        self.validator = ProductValidator(cdn_session, cache, controller, BASE_URL, VALIDATE_TOUR_URL)
+        self.layout_cache = LayoutCache(os.path.join(DOWNLOAD_DIR, LAYOUT_CACHE_FILE))
+        self.layout_cache.seed_from_dir(STRUCTURE_DIR)
+        self.downloader = TileDownloader(cdn_session, OUTPUT_DIR, BASE_URL, max_in_flight=MAX_IN_FLIGHT,
+                                         on_product_done=self._product_done, cache=cache,
+                                         controller=controller, verifier=verifier, metrics=metrics)
+        self.stages = [
+            Stage("resolve", self.resolve, RESOLVE_CONCURRENT),
+            Stage("validate", self.validate, VALIDATE_CONCURRENT),
+            Stage("classify", self.classify, CLASSIFY_CONCURRENT),
+            Stage("download", self.download, DOWNLOAD_PRODUCTS),
+        ]
+
+    def _product_done(self, job, success):
+        self.ledger.set_status(DOWNLOAD_STAGE, job.key, DONE if success else FAILED)
+
+    async def resolve(self, item):
+        key, cdn_path = item
+        if cdn_path:
+            return item  # đã tìm được ở lần chạy trước
+        for attempt in range(1, RESOLVE_RETRY + 1):
+            cdn_path = await self.resolver.resolve(key)
+            if cdn_path:
+                print(f"✅ {key} → {cdn_path}")
+                await self.outputs.write(MAPPING_FILE, f"{key},{cdn_path}")
+                self.ledger.set_status(PIPELINE_STAGE, key, PENDING, cdn_path)
+                break
+            if attempt < RESOLVE_RETRY:
+                await asyncio.sleep(1)
+        # Key không có CDN path vẫn sang validate để kiểm tra trang tour có bị chặn không
+        return key, cdn_path
+
+    async def validate(self, item):
+        key, cdn_path = item
+        record = await self.validator.validate(key, cdn_path)
+        status = record["status"]
+        if status == VALID:
+            await self.outputs.write(HAS_IMAGE_FILE, f"{key},{cdn_path}")
+            return item
+        if status == BLOCKED:
+            print(f"🔒 {key}")
+            await self.outputs.write(BLOCKED_FILE, key)
+            self.ledger.set_status(PIPELINE_STAGE, key, DONE)
+        elif status == REACHABLE:
+            # Không tìm được CDN nhưng trang không bị chặn: để 2_retry hoặc lần chạy sau thử lại
+            print(f"❌ Không tìm thấy CDN cho {key}")
+            self.ledger.set_status(PIPELINE_STAGE, key, FAILED)
+        else:
+            print(f"❌ {key} - {status}")
+            self.ledger.set_status(PIPELINE_STAGE, key, DONE)
+        return None
+
+    async def check_url(self, url):
+        # Như 1_classify_tile_type.py: 5xx/429 được thử lại, không bị coi là ô không tồn tại
+        for attempt in range(1, CLASSIFY_RETRY + 1):
+            try:
+                status = await self.cache.head(self.cdn_session, url, CLASSIFY_STAGE)
+                if status in (200, 404):
+                    return status == 200
+            except Exception:
+                pass
+            if attempt < CLASSIFY_RETRY:
+                await asyncio.sleep(backoff_delay(attempt))
+        return False
+
+    async def classify(self, item):
+        key, cdn_path = item
+        structure, _, _ = await self.layout_cache.classify(self.check_url, cdn_path, BASE_URL)
+        if not structure:
+            print(f"❌ Không tìm thấy cấu trúc tile: {key}")
+            self.ledger.set_status(PIPELINE_STAGE, key, FAILED)
+            return None
+        name = signature_name(structure)
+        await self.outputs.write(os.path.join(STRUCTURE_DIR, f"{name}.txt"), f"{key},{cdn_path}")
+        # 2_download_tiles_from_mapping.py thấy product đã DONE trong ledger, không tải lại
+        self.ledger.add(DOWNLOAD_STAGE, [(key, cdn_path)], grp=name)
+        # Level trong structure ở dạng "l1", job tải cần số như khi đọc từ tên file
+        return ProductJob(key, cdn_path, parse_structure_from_filename(name), name)
+
+    async def download(self, job):
+        for attempt in range(1, PRODUCT_RETRY + 1):
+            if await self.downloader.download_product(job):
+                self.ledger.set_status(PIPELINE_STAGE, job.key, DONE)
+                return job
+            job.failed = False
+            if attempt < PRODUCT_RETRY:
+                await asyncio.sleep(backoff_delay(attempt))
+        self.ledger.set_status(PIPELINE_STAGE, job.key, FAILED)
+        return None
+
+def pending_keys(ledger):
+    # Chỉ phần mới của product-key.txt được nhập; key đã xong ở lần trước được bỏ qua,
+    # key đã có CDN path thì đi thẳng qua resolve
+    added = ledger.import_txt(PIPELINE_STAGE, KEY_FILE)
+    rows = ledger.unfinished(PIPELINE_STAGE)
+    print(f"📥 {len(rows)} key cần xử lý ({added} key mới)")
+    for key, cdn_path, _ in rows:
+        yield key, cdn_path or None
+
+async def make_resolver(session, browser, metrics):
+    static = StaticResolver(session, TOUR_URL, metrics=metrics)
+    if not browser:
+        return ChainResolver(static), None
+    playwright_resolver = await PlaywrightResolver(browser, PLAYWRIGHT_POOL, TOUR_URL, metrics=metrics).start()
+    return ChainResolver(static, playwright_resolver), playwright_resolver
+
+async def run(browser=None):
+    os.makedirs(STRUCTURE_DIR, exist_ok=True)
+    ledger = JobLedger(os.path.join(DOWNLOAD_DIR, LEDGER_FILE))
+    # Cùng cache với các script trong download_image/, HEAD và tile đã có không bị hỏi lại
+    # Latency theo stage/host, lỗi theo nguyên nhân và tile/s: in định kỳ và ghi crawl_metrics.prom/.json
+    metrics = Metrics(os.path.join(ROOT, METRICS_FILE), os.path.join(ROOT, METRICS_JSON_FILE))
+    controller = RateController(metrics=metrics, max_window=MAX_IN_FLIGHT)
+    cache = HttpCache(os.path.join(DOWNLOAD_DIR, HTTP_CACHE_FILE), controller=controller)
+    verifier = TileVerifier() if VERIFY_TILES else None
+    playwright_resolver = None
+
+    try:
+        # Session riêng cho trang tour và CDN: tải tile không chiếm hết kết nối của stage resolve
+        async with make_session(RESOLVE_CONCURRENT) as resolve_session, \
+                make_session(MAX_IN_FLIGHT) as cdn_session, \
+                LineWriterGroup() as outputs, \
+                LineWriter(ERROR_FILE, atomic=True) as errors, \
+                metrics:
+            resolver, playwright_resolver = await make_resolver(resolve_session, browser, metrics)
+            crawl = CrawlPipeline(resolver, cdn_session, ledger, outputs, controller, cache, verifier, metrics)
+            pipeline = Pipeline(crawl.stages)
+            try:
+                await pipeline.run(pending_keys(ledger))
+            finally:
+                # Key còn lỗi ghi lại một lần ở cuối, như 1_crawl_script.py
+                ledger.flush()
+                for key, cdn_path, _ in ledger.jobs(PIPELINE_STAGE, status=FAILED):
+                    if not cdn_path:
+                        await errors.write(key)
+                crawl.layout_cache.save()
+                print(pipeline.report())
+                print(f"📊 Nguồn: {resolver.report()}")
+                print(crawl.validator.report())
+                print(crawl.layout_cache.report())
+                print(metrics.summary())
+    finally:
+        if playwright_resolver:
+            await playwright_resolver.close()
+        cache.close()
+        if verifier:
+            verifier.close()
+        print(cache.report())
+        print(controller.report())
+        print(f"📒 Ledger: {ledger.counts(PIPELINE_STAGE)}")
+        ledger.close()
+
+async def main():
+    if not USE_PLAYWRIGHT:
+        await run()
+        return
+    try:
+        from playwright.async_api import async_playwright
+    except ImportError:
+        print("⚠️ Thiếu playwright — chỉ dùng StaticResolver.")
+        await run()
+        return
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        try:
+            await run(browser)
+        finally:
+            await browser.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
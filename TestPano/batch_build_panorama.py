@@ -0,0 +1,175 @@
+import os
+import sys
+import time
+import cv2
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from pano_pipeline import stitch_cube_faces, usable_level
+from remap_cache import render_equirectangular_cached
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "TestCrawl"))
+from common.tile_store import TileStore
+from common.tile_integrity import LEVELS_FILE, check_tile, manifest_matches
+
+# Cây image_crawled/<structure>/<product_key>/ do 2_download_tiles_from_mapping.py ghi ra
+INPUT_DIR = "../TestCrawl/download_image/image_crawled"
+OUTPUT_DIR = "./panorama_output"
+FACES = ['l', 'r', 'f', 'b', 'u', 'd']
+OUT_WIDTH = 8192
+OUT_HEIGHT = 4096
+INTERPOLATION = 'nearest'
+MAX_WORKERS = os.cpu_count() or 1
+# Đặt True để ghi thêm 6 mặt cube cạnh panorama
+WRITE_FACES = False
+STAGES = ['stitch', 'convert', 'save']
+# Đặt thành thư mục tile store (ví dụ "../TestCrawl/download_image/tile_store") để đọc tile
+# từ pack file thay vì INPUT_DIR
+TILE_STORE_DIR = None
+
+# Mỗi tiến trình mở store của riêng nó, kết nối SQLite không dùng chung giữa các tiến trình
+_stores = {}
+
+def open_store(store_dir):
+    if store_dir not in _stores:
+        _stores[store_dir] = TileStore(store_dir)
+    return _stores[store_dir]
+
+def find_products(input_dir):
+    products = []
+    for structure in sorted(os.listdir(input_dir)):
+        structure_dir = os.path.join(input_dir, structure)
+        if not os.path.isdir(structure_dir):
+            continue
+        for key in sorted(os.listdir(structure_dir)):
+            product_dir = os.path.join(structure_dir, key)
+            if os.path.isdir(product_dir):
+                products.append((structure, key, product_dir))
+    return products
+
+def find_products_in_store(store):
+    # Với store, product_dir chính là product key; updated_at = 0 là product chưa commit lần nào
+    return [(structure, key, key) for key, structure, updated_at in store.products() if updated_at > 0]
+
+def newest_tile_mtime(product_dir):
+    newest = 0
+    for face in FACES:
+        for root, dirs, files in os.walk(os.path.join(product_dir, face)):
+            for file in files:
+                newest = max(newest, os.path.getmtime(os.path.join(root, file)))
+    return newest
+
+def is_up_to_date(product_dir, output_path, store=None):
+    if not os.path.exists(output_path):
+        return False
+    levels_path = os.path.join(product_dir, LEVELS_FILE)
+    if store:
+        newest = store.product_mtime(product_dir)
+    elif os.path.exists(levels_path):
+        # Tile của level đang tải dở không làm panorama cũ hết hạn, chỉ khi có thêm level đủ
+        newest = os.path.getmtime(levels_path)
+    else:
+        newest = newest_tile_mtime(product_dir)
+    return os.path.getmtime(output_path) > newest
+
+def has_all_faces(product_dir, store=None):
+    if store:
+        return all(store.list(f"{product_dir}/{face}") for face in FACES)
+    return all(os.path.isdir(os.path.join(product_dir, face)) for face in FACES)
+
+def find_corrupt_tiles(product_dir, store=None):
+    # Tile trong store đã được kiểm tra trước khi put, product có manifest khớp thì tin manifest.
+    # Chỉ product tải trước khi có manifest mới phải đọc lại header từng tile.
+    if store or manifest_matches(product_dir):
+        return []
+    corrupt = []
+    for face in FACES:
+        for root, dirs, files in os.walk(os.path.join(product_dir, face)):
+            for file in files:
+                path = os.path.join(root, file)
+                with open(path, "rb") as f:
+                    if check_tile(f.read()):
+                        corrupt.append(path)
+    return corrupt
+
+def build_product(structure, key, product_dir, output_dir, store_dir=None):
+    timings = {}
+    output_path = os.path.join(output_dir, structure, f"{key}.jpg")
+    store = open_store(store_dir) if store_dir else None
+
+    # Product đang tải dần: ghép từ level cao nhất đã đủ tile, chưa có level nào đủ thì chờ
+    ready, level = usable_level(product_dir, store)
+    if not ready:
+        return key, "incomplete", timings
+    if not has_all_faces(product_dir, store):
+        return key, "incomplete", timings
+
+    if is_up_to_date(product_dir, output_path, store):
+        return key, "skipped", timings
+
+    if find_corrupt_tiles(product_dir, store):
+        return key, "corrupt", timings
+
+    faces_dir = os.path.join(output_dir, structure, f"{key}_cube_faces") if WRITE_FACES else None
+    start = time.perf_counter()
+    faces = stitch_cube_faces(product_dir, faces_dir, store, OUT_WIDTH // 4, level)
+    timings['stitch'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    output = render_equirectangular_cached(faces, OUT_WIDTH, OUT_HEIGHT, INTERPOLATION)
+    timings['convert'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    cv2.imwrite(output_path, output)
+    timings['save'] = time.perf_counter() - start
+
+    return key, "built", timings
+
+def main():
+    if TILE_STORE_DIR:
+        products = find_products_in_store(open_store(TILE_STORE_DIR))
+    elif not os.path.exists(INPUT_DIR):
+        print(f"❌ Không tìm thấy thư mục {INPUT_DIR}")
+        return
+    else:
+        products = find_products(INPUT_DIR)
+    print(f"📂 {len(products)} product, {MAX_WORKERS} tiến trình")
+
+    counts = {"built": 0, "skipped": 0, "incomplete": 0, "corrupt": 0, "failed": 0}
+    stage_totals = {stage: 0.0 for stage in STAGES}
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        futures = {
+            pool.submit(build_product, structure, key, product_dir, OUTPUT_DIR, TILE_STORE_DIR): key
+            for structure, key, product_dir in products
+        }
+        for future in as_completed(futures):
+            try:
+                key, status, timings = future.result()
+            except Exception as e:
+                print(f"❌ {futures[future]}: {e}")
+                counts["failed"] += 1
+                continue
+
+            counts[status] += 1
+            for stage, seconds in timings.items():
+                stage_totals[stage] += seconds
+            if status == "built":
+                detail = ", ".join(f"{stage} {timings[stage]:.2f}s" for stage in STAGES)
+                print(f"✅ {key} ({detail})")
+            elif status == "incomplete":
+                print(f"⚠️ {key} thiếu mặt, bỏ qua")
+            elif status == "corrupt":
+                print(f"🧪 {key} có tile hỏng, cần tải lại")
+
+    elapsed = time.perf_counter() - start
+    built = counts["built"]
+    print(f"\n🎯 Xong {len(products)} product trong {elapsed:.1f}s: {counts}")
+    if built:
+        print(f"🚀 {built / elapsed:.2f} panorama/s")
+        for stage in STAGES:
+            print(f"⏱️ {stage}: tổng {stage_totals[stage]:.1f}s, trung bình {stage_totals[stage] / built:.2f}s/panorama")
+
+if __name__ == "__main__":
+    main()
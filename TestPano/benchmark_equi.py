@@ -0,0 +1,51 @@
+import time
+import numpy as np
+import cv2
+
+from convert_cube_to_equi import (
+    load_face_images,
+    render_equirectangular,
+    convert_cube_to_equirectangular_loop,
+)
+from remap_cache import render_equirectangular_cached
+
+INPUT_FOLDER = "./cube_faces"
+# Bản lặp rất chậm nên chỉ đo ở kích thước nhỏ
+LOOP_WIDTH = 512
+LOOP_HEIGHT = 256
+FULL_WIDTH = 8192
+FULL_HEIGHT = 4096
+LOOP_OUTPUT = "./benchmark_loop.jpg"
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def main():
+    faces = load_face_images(INPUT_FOLDER)
+
+    # Bản lặp ghi ra file jpg (mất dữ liệu) nên so sánh bằng cách ghi cùng định dạng
+    _, loop_time = timed(convert_cube_to_equirectangular_loop, INPUT_FOLDER, LOOP_OUTPUT, LOOP_WIDTH, LOOP_HEIGHT)
+    vec, vec_time = timed(render_equirectangular, faces, LOOP_WIDTH, LOOP_HEIGHT)
+    cv2.imwrite("./benchmark_vectorized.jpg", vec)
+    same = np.array_equal(cv2.imread(LOOP_OUTPUT), cv2.imread("./benchmark_vectorized.jpg"))
+
+    pixels = LOOP_WIDTH * LOOP_HEIGHT
+    print(f"📐 {LOOP_WIDTH}x{LOOP_HEIGHT} ({pixels} pixel)")
+    print(f"🐢 Loop      : {loop_time:.2f}s ({pixels / loop_time:,.0f} px/s)")
+    print(f"⚡ Vectorized: {vec_time:.3f}s ({pixels / vec_time:,.0f} px/s) - nhanh hơn {loop_time / vec_time:.0f}x")
+    print(f"{'✅' if same else '❌'} Kết quả nearest giống hệt bản lặp: {same}")
+
+    for interpolation in ("nearest", "bilinear"):
+        _, full_time = timed(render_equirectangular, faces, FULL_WIDTH, FULL_HEIGHT, interpolation)
+        est_loop = loop_time / pixels * FULL_WIDTH * FULL_HEIGHT
+        print(f"🚀 {FULL_WIDTH}x{FULL_HEIGHT} {interpolation}: {full_time:.2f}s (bản lặp ước tính {est_loop / 60:.0f} phút)")
+
+        # Lần đầu dựng bảng remap, lần sau chỉ còn gather/cv2.remap
+        _, build_time = timed(render_equirectangular_cached, faces, FULL_WIDTH, FULL_HEIGHT, interpolation)
+        _, cached_time = timed(render_equirectangular_cached, faces, FULL_WIDTH, FULL_HEIGHT, interpolation)
+        print(f"🗂️ {FULL_WIDTH}x{FULL_HEIGHT} {interpolation} remap cache: lần đầu {build_time:.2f}s, đã cache {cached_time:.2f}s")
+
+if __name__ == "__main__":
+    main()
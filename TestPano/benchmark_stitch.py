@@ -0,0 +1,88 @@
+import os
+import sys
+import time
+import shutil
+import numpy as np
+import cv2
+
+import image_processing
+from image_processing import stitch_face_array
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "TestCrawl"))
+from common.tile_store import TileStore
+
+BENCH_DIR = "./benchmark_stitch_tiles"
+STORE_DIR = os.path.join(BENCH_DIR, "store")
+STORE_KEY = "bench"
+# Mặt level 4 giống layout l4_..._l4_10_10: 10x10 tile 512, hàng/cột cuối nhỏ hơn
+GRID = 10
+TILE_SIZE = 512
+LAST_SIZE = 300
+TARGET_SIZE = 2048  # OUT_WIDTH 8192 / 4 của batch_build_panorama
+REPEAT = 3
+# Luôn đọc store từ nhiều thread, kể cả khi máy chỉ có 1 CPU (DECODE_THREADS = 1)
+STORE_THREADS = 4
+
+def make_face(face_folder, level=4):
+    # Ảnh gradient có nhiễu để kích thước JPEG gần với tile thật
+    rng = np.random.default_rng(0)
+    for r in range(1, GRID + 1):
+        row_dir = os.path.join(face_folder, f"l{level}", str(r))
+        os.makedirs(row_dir, exist_ok=True)
+        for c in range(1, GRID + 1):
+            h = TILE_SIZE if r < GRID else LAST_SIZE
+            w = TILE_SIZE if c < GRID else LAST_SIZE
+            tile = rng.integers(0, 255, (h, w, 3), dtype=np.uint8)
+            tile = cv2.GaussianBlur(tile, (9, 9), 0)
+            cv2.imwrite(os.path.join(row_dir, f"l{level}_f_{r}_{c}.jpg"), tile)
+
+def make_store(face_folder):
+    # Cùng các tile trong TileStore, đường dẫn <key>/f/l4/<r>/<file> như TestCrawl ghi
+    store = TileStore(STORE_DIR)
+    store.add_product(STORE_KEY)
+    for dirpath, _, files in os.walk(face_folder):
+        for fname in files:
+            path = os.path.join(dirpath, fname)
+            with open(path, "rb") as f:
+                store.put(STORE_KEY, os.path.relpath(path, BENCH_DIR), f.read())
+    store.commit(STORE_KEY)
+    return store
+
+def timed(fn, *args, **kwargs):
+    best = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+def main():
+    face_folder = os.path.join(BENCH_DIR, "f")
+    if not os.path.exists(face_folder):
+        make_face(face_folder)
+
+    serial, serial_time = timed(stitch_face_array, face_folder, threads=1)
+    parallel, parallel_time = timed(stitch_face_array, face_folder)
+    reduced, reduced_time = timed(stitch_face_array, face_folder, target_size=TARGET_SIZE)
+    store = make_store(face_folder)
+    from_store, store_time = timed(stitch_face_array, f"{STORE_KEY}/f", store, threads=STORE_THREADS)
+    store.close()
+    resized, resize_time = timed(lambda: cv2.resize(stitch_face_array(face_folder), reduced.shape[1::-1],
+                                                    interpolation=cv2.INTER_AREA))
+
+    print(f"🧩 {GRID}x{GRID} tile → mặt {serial.shape[1]}x{serial.shape[0]}")
+    print(f"🐢 1 thread           : {serial_time:.3f}s")
+    print(f"⚡ {image_processing.DECODE_THREADS} thread           : {parallel_time:.3f}s "
+          f"(nhanh hơn {serial_time / parallel_time:.1f}x), giống hệt: {np.array_equal(serial, parallel)}")
+    print(f"📦 {STORE_THREADS} thread từ store : {store_time:.3f}s, "
+          f"giống hệt: {np.array_equal(serial, from_store)}")
+    print(f"🔻 giải mã thu nhỏ    : {reduced_time:.3f}s → {reduced.shape[1]}x{reduced.shape[0]} "
+          f"(target {TARGET_SIZE})")
+    diff = np.abs(reduced.astype(np.int16) - resized).mean()
+    print(f"📏 giải mã đủ + resize: {resize_time:.3f}s, sai khác trung bình {diff:.2f}/255")
+
+    shutil.rmtree(BENCH_DIR, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
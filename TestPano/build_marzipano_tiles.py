@@ -0,0 +1,243 @@
+import os
+import json
+import time
+import shutil
+import cv2
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from image_processing import stitch_face_array
+from pano_pipeline import usable_level
+from batch_build_panorama import (
+    INPUT_DIR,
+    FACES,
+    MAX_WORKERS,
+    TILE_STORE_DIR,
+    find_products,
+    find_corrupt_tiles,
+    find_products_in_store,
+    has_all_faces,
+    is_up_to_date,
+    open_store,
+)
+
+# Cây mà Panorama_Demo_Version_1/app-files/index.js đọc:
+# product-tiles/<key>/tile/{z}/{f}/{y}/{x}.jpg, product-tiles/<key>/preview.jpg, data/<key>.js
+APP_DIR = "../Panorama_Demo_Version_1/app-files"
+INDEX_FILE = "products.js"
+INDEX_PREFIX = "var productIndex = "
+KEY_LIST_FILE = "product_key_list.txt"
+TILE_SIZE = 512
+MAX_FACE_SIZE = 4096
+PREVIEW_SIZE = 256
+# Thứ tự mặt trong preview.jpg mặc định của Marzipano
+PREVIEW_ORDER = ['b', 'd', 'f', 'l', 'r', 'u']
+JPEG_QUALITY = 90
+# Đặt True để ghi thêm _f.jpg, _b.jpg... như bản Marzipano Tool tạo ra
+WRITE_FACES = False
+STAGES = ['stitch', 'tile', 'save']
+
+def level_sizes(face_size):
+    # 512, 1024, 2048... rồi level cao nhất đúng bằng mặt thật làm tròn xuống bội của TILE_SIZE
+    # (1536, 2560...): không phóng to mặt lên lũy thừa 2 kế tiếp, không vượt MAX_FACE_SIZE
+    top = max(TILE_SIZE, min(face_size, MAX_FACE_SIZE) // TILE_SIZE * TILE_SIZE)
+    sizes = [TILE_SIZE]
+    while sizes[-1] * 2 < top:
+        sizes.append(sizes[-1] * 2)
+    if sizes[-1] < top:
+        sizes.append(top)
+    return sizes
+
+def scene_data(index, key, face_size):
+    sizes = level_sizes(face_size)
+    levels = [{"tileSize": PREVIEW_SIZE, "size": PREVIEW_SIZE, "fallbackOnly": True}]
+    levels += [{"tileSize": TILE_SIZE, "size": size} for size in sizes]
+    return {
+        "scenes": [{
+            "id": f"{index}-{key}",
+            "name": key,
+            "levels": levels,
+            # Kích thước của level cao nhất đã sinh, không phải của mặt gốc
+            "faceSize": sizes[-1],
+            "initialViewParameters": {"pitch": 0, "yaw": 0, "fov": np.pi / 2},
+            "linkHotspots": [],
+            "infoHotspots": [],
+        }],
+        "name": f"Product {key}",
+        "settings": {
+            "mouseViewMode": "drag",
+            "autorotateEnabled": True,
+            "fullscreenButton": True,
+            "viewControlButtons": True,
+        },
+    }
+
+def resize_face(face, size):
+    if face.shape[0] == size and face.shape[1] == size:
+        return face
+    interpolation = cv2.INTER_AREA if size < face.shape[0] else cv2.INTER_CUBIC
+    return cv2.resize(face, (size, size), interpolation=interpolation)
+
+def split_tiles(image, tile_size=TILE_SIZE):
+    # (n*T, n*T, 3) -> (n, n, T, T, 3) bằng view, không copy từng ô
+    count = image.shape[0] // tile_size
+    return image.reshape(count, tile_size, count, tile_size, 3).swapaxes(1, 2)
+
+def write_jpeg(path, image):
+    ok, data = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    if not ok:
+        raise IOError(f"Không mã hóa được {path}")
+    with open(path, "wb") as f:
+        f.write(data.tobytes())
+
+def write_product_tiles(faces, product_dir):
+    face_size = max(face.shape[0] for face in faces.values())
+    sizes = level_sizes(face_size)
+    count = 0
+
+    for short, face in faces.items():
+        for z, size in enumerate(sizes, start=1):
+            tiles = split_tiles(resize_face(face, size))
+            for y in range(tiles.shape[0]):
+                row_dir = os.path.join(product_dir, "tile", str(z), short, str(y))
+                os.makedirs(row_dir, exist_ok=True)
+                for x in range(tiles.shape[1]):
+                    write_jpeg(os.path.join(row_dir, f"{x}.jpg"), tiles[y, x])
+                    count += 1
+        if WRITE_FACES:
+            write_jpeg(os.path.join(product_dir, f"_{short}.jpg"), face)
+
+    preview = np.vstack([resize_face(faces[short], PREVIEW_SIZE) for short in PREVIEW_ORDER])
+    write_jpeg(os.path.join(product_dir, "preview.jpg"), preview)
+    return face_size, count
+
+def write_scene_data(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write("var APP_DATA = " + json.dumps(data, indent=2) + ";\n")
+    os.replace(tmp_path, path)
+
+def build_product(index, key, product_dir, app_dir=APP_DIR, store_dir=None):
+    timings = {}
+    store = open_store(store_dir) if store_dir else None
+    data_path = os.path.join(app_dir, "data", f"{key}.js")
+    tiles_dir = os.path.join(app_dir, "product-tiles")
+
+    # Product đang tải dần: dựng từ level cao nhất đã đủ tile, chưa có level nào đủ thì chờ
+    ready, level = usable_level(product_dir, store)
+    if not ready or not has_all_faces(product_dir, store):
+        return key, "incomplete", timings
+    # data/<key>.js được ghi sau cùng nên mtime của nó đánh dấu lần build hoàn chỉnh
+    if is_up_to_date(product_dir, data_path, store):
+        return key, "skipped", timings
+    if find_corrupt_tiles(product_dir, store):
+        return key, "corrupt", timings
+
+    start = time.perf_counter()
+    # Không lật u/d: Marzipano dùng cùng quy ước mặt cube với tile krpano
+    faces = {}
+    for short in FACES:
+        face_folder = os.path.join(product_dir, short) if store is None else f"{product_dir}/{short}"
+        faces[short] = stitch_face_array(face_folder, store, MAX_FACE_SIZE, level=level)
+    timings['stitch'] = time.perf_counter() - start
+
+    # Ghi vào thư mục tạm rồi đổi tên, viewer không bao giờ thấy product dở dang
+    start = time.perf_counter()
+    output_dir = os.path.join(tiles_dir, key)
+    tmp_dir = f"{output_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    face_size, _ = write_product_tiles(faces, tmp_dir)
+    timings['tile'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.replace(tmp_dir, output_dir)
+    os.makedirs(os.path.dirname(data_path), exist_ok=True)
+    write_scene_data(data_path, scene_data(index, key, face_size))
+    timings['save'] = time.perf_counter() - start
+
+    return key, "built", timings
+
+def load_product_index(app_dir=APP_DIR):
+    index_path = os.path.join(app_dir, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return {}
+    with open(index_path) as f:
+        text = f.read()
+    start = text.index(INDEX_PREFIX) + len(INDEX_PREFIX)
+    entries = json.loads(text[start:text.index(";\n", start)])
+    return {entry["key"]: entry["structure"] for entry in entries}
+
+def write_product_index(structures, app_dir=APP_DIR):
+    # Giữ cả những product đã build trước đây nhưng không còn trong image_crawled
+    known = load_product_index(app_dir)
+    known.update(structures)
+    data_dir = os.path.join(app_dir, "data")
+    built = {name[:-3] for name in os.listdir(data_dir) if name.endswith(".js")}
+    entries = sorted(({"key": key, "structure": known.get(key, "")} for key in built),
+                     key=lambda entry: (entry["structure"], entry["key"]))
+
+    index_path = os.path.join(app_dir, INDEX_FILE)
+    tmp_path = f"{index_path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write("// Sinh bởi TestPano/build_marzipano_tiles.py, không sửa tay\n")
+        # Mỗi product một dòng để diff gọn khi thêm product mới
+        f.write(INDEX_PREFIX + "[\n  " + ",\n  ".join(json.dumps(entry) for entry in entries) + "\n];\n")
+        f.write("var availableProducts = productIndex.map(function(product) { return product.key; });\n")
+    os.replace(tmp_path, index_path)
+
+    key_list_path = os.path.join(app_dir, KEY_LIST_FILE)
+    with open(key_list_path, "w") as f:
+        f.writelines(f"{key}\n" for key in sorted(built))
+    return entries
+
+def main():
+    if TILE_STORE_DIR:
+        products = find_products_in_store(open_store(TILE_STORE_DIR))
+    elif not os.path.exists(INPUT_DIR):
+        print(f"❌ Không tìm thấy thư mục {INPUT_DIR}")
+        return
+    else:
+        products = find_products(INPUT_DIR)
+    print(f"📂 {len(products)} product, {MAX_WORKERS} tiến trình")
+
+    counts = {"built": 0, "skipped": 0, "incomplete": 0, "corrupt": 0, "failed": 0}
+    stage_totals = {stage: 0.0 for stage in STAGES}
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        futures = {
+            pool.submit(build_product, index, key, product_dir, APP_DIR, TILE_STORE_DIR): key
+            for index, (structure, key, product_dir) in enumerate(products)
+        }
+        for future in as_completed(futures):
+            try:
+                key, status, timings = future.result()
+            except Exception as e:
+                print(f"❌ {futures[future]}: {e}")
+                counts["failed"] += 1
+                continue
+
+            counts[status] += 1
+            for stage, seconds in timings.items():
+                stage_totals[stage] += seconds
+            if status == "built":
+                detail = ", ".join(f"{stage} {timings[stage]:.2f}s" for stage in STAGES)
+                print(f"✅ {key} ({detail})")
+            elif status == "incomplete":
+                print(f"⚠️ {key} thiếu mặt, bỏ qua")
+            elif status == "corrupt":
+                print(f"🧪 {key} có tile hỏng, cần tải lại")
+
+    entries = write_product_index({key: structure for structure, key, _ in products})
+    elapsed = time.perf_counter() - start
+    built = counts["built"]
+    print(f"\n🎯 Xong {len(products)} product trong {elapsed:.1f}s: {counts}")
+    print(f"📇 {os.path.join(APP_DIR, INDEX_FILE)}: {len(entries)} product")
+    if built:
+        print(f"🚀 {built / elapsed:.2f} product/s")
+        for stage in STAGES:
+            print(f"⏱️ {stage}: tổng {stage_totals[stage]:.1f}s, trung bình {stage_totals[stage] / built:.2f}s/product")
+
+if __name__ == "__main__":
+    main()
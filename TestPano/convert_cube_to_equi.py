@@ -2,12 +2,12 @@ import cv2
 import numpy as np
 import os
 
+FACE_FOLDERS = {'r': 'right', 'l': 'left', 'u': 'top', 'd': 'bottom', 'f': 'front', 'b': 'back'}
+
 def load_face_images(base_path):
     faces = {}
-    face_names = ['right', 'left', 'top', 'bottom', 'front', 'back']
-    folder_names = {'r': 'right', 'l': 'left', 'u': 'top', 'd': 'bottom', 'f': 'front', 'b': 'back'}
 
-    for short, full in folder_names.items():
+    for short, full in FACE_FOLDERS.items():
         path = os.path.join(base_path, f'{short}.jpg')
         if not os.path.exists(path):
             raise FileNotFoundError(f"Missing face image: {path}")
@@ -40,7 +40,98 @@ def vector_to_face(x, y, z):
             face = 'back'
     return face
 
-def convert_cube_to_equirectangular(input_folder, output_path, width=8192, height=4096):
+# Thứ tự mặt dùng cho chỉ số face trong các mảng vector hóa
+FACE_NAMES = ['right', 'left', 'top', 'bottom', 'front', 'back']
+CHUNK_ROWS = 256
+
+def equirect_directions(width, height, y_start=0, y_stop=None):
+    if y_stop is None:
+        y_stop = height
+    x = np.arange(width, dtype=np.float64)
+    y = np.arange(y_start, y_stop, dtype=np.float64)
+
+    theta = ((x / width) * 2 * np.pi - np.pi)[np.newaxis, :]
+    phi = (((height - y) / height) * np.pi - (np.pi / 2))[:, np.newaxis]
+
+    vx = np.cos(phi) * np.sin(theta)
+    vy = np.broadcast_to(np.sin(phi), (y_stop - y_start, width))
+    vz = np.cos(phi) * np.cos(theta)
+    return vx, vy, vz
+
+def vectors_to_faces(vx, vy, vz):
+    # Giống vector_to_face: khi bằng nhau ưu tiên trục x, rồi y, rồi z
+    absX, absY, absZ = np.abs(vx), np.abs(vy), np.abs(vz)
+    maxAxis = np.maximum(np.maximum(absX, absY), absZ)
+
+    onX = absX == maxAxis
+    onY = ~onX & (absY == maxAxis)
+    face_idx = np.where(onX, np.where(vx > 0, 0, 1),
+                        np.where(onY, np.where(vy > 0, 2, 3),
+                                 np.where(vz > 0, 4, 5))).astype(np.uint8)
+
+    # Thành phần thứ 3 của sc luôn là trục lớn nhất nên max(|sc|) == maxAxis
+    conds = [face_idx == i for i in range(5)]
+    sc_u = np.select(conds, [-vz, vz, vx, vx, vx], -vx) / maxAxis
+    sc_v = np.select(conds, [vy, vy, vz, -vz, vy], vy) / maxAxis
+    return face_idx, sc_u, sc_v
+
+def face_pixel_coords(sc_u, sc_v, face_width, face_height):
+    ix = (sc_u + 1) / 2 * (face_width - 1)
+    iy = (1 - (sc_v + 1) / 2) * (face_height - 1)
+
+    ix = np.clip(ix, 0, face_width - 1)
+    iy = np.clip(iy, 0, face_height - 1)
+    return ix, iy
+
+def sample_nearest(img, ix, iy):
+    return img[iy.astype(np.intp), ix.astype(np.intp)]
+
+def sample_bilinear(img, ix, iy):
+    x0 = ix.astype(np.intp)
+    y0 = iy.astype(np.intp)
+    x1 = np.minimum(x0 + 1, img.shape[1] - 1)
+    y1 = np.minimum(y0 + 1, img.shape[0] - 1)
+    wx = (ix - x0).astype(np.float32)[:, np.newaxis]
+    wy = (iy - y0).astype(np.float32)[:, np.newaxis]
+
+    top = img[y0, x0] * (1 - wx) + img[y0, x1] * wx
+    bottom = img[y1, x0] * (1 - wx) + img[y1, x1] * wx
+    return np.rint(top * (1 - wy) + bottom * wy).astype(img.dtype)
+
+SAMPLERS = {'nearest': sample_nearest, 'bilinear': sample_bilinear}
+
+def render_equirectangular(faces, width=8192, height=4096, interpolation='nearest', chunk_rows=CHUNK_ROWS):
+    if interpolation not in SAMPLERS:
+        raise ValueError(f"Unknown interpolation: {interpolation}")
+    sampler = SAMPLERS[interpolation]
+
+    channels = faces[FACE_NAMES[0]].shape[2]
+    output = np.zeros((height, width, channels), dtype=np.uint8)
+
+    # Xử lý theo dải hàng để bộ nhớ tạm không phụ thuộc kích thước ảnh ra
+    for y_start in range(0, height, chunk_rows):
+        y_stop = min(y_start + chunk_rows, height)
+        face_idx, sc_u, sc_v = vectors_to_faces(*equirect_directions(width, height, y_start, y_stop))
+        band = output[y_start:y_stop]
+
+        for i, name in enumerate(FACE_NAMES):
+            mask = face_idx == i
+            if not mask.any():
+                continue
+            img = faces[name]
+            ix, iy = face_pixel_coords(sc_u[mask], sc_v[mask], img.shape[1], img.shape[0])
+            band[mask] = sampler(img, ix, iy)
+
+    return output
+
+def convert_cube_to_equirectangular(input_folder, output_path, width=8192, height=4096, interpolation='nearest'):
+    faces = load_face_images(input_folder)
+    output = render_equirectangular(faces, width, height, interpolation)
+    cv2.imwrite(output_path, output)
+    print(f"Saved Equirectangular Panorama at {output_path}")
+
+# Bản lặp từng pixel ban đầu, giữ lại làm chuẩn so sánh cho benchmark
+def convert_cube_to_equirectangular_loop(input_folder, output_path, width=8192, height=4096):
     faces = load_face_images(input_folder)
 
     output = np.zeros((height, width, 3), dtype=np.uint8)
@@ -1,26 +1,89 @@
+import io
 import os
+import cv2
+import numpy as np
 from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
 
-def stitch_face(face_folder, face_short_name):
-    levels = [d for d in os.listdir(face_folder) if os.path.isdir(os.path.join(face_folder, d))]
-    if not levels:
+TILE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+# cv2 nhả GIL khi giải mã nên các thread giải mã tile song song thật sự
+DECODE_THREADS = min(8, os.cpu_count() or 1)
+# Giải mã JPEG ở 1/2, 1/4, 1/8 kích thước ngay trong libjpeg, nhanh hơn giải mã đủ rồi thu nhỏ
+REDUCED_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+_decode_pool = None
+
+def tile_coords(filename):
+    name = os.path.splitext(os.path.basename(filename))[0]
+    numbers = [p for p in name.split('_') if p.isdigit()]
+    if len(numbers) >= 2:
+        return tuple(map(int, numbers[-2:]))
+    return None
+
+def find_tiles_in_store(store, face_folder, level=None):
+    # Đường dẫn trong store có dạng <key>/<face>/l<lv>/<r>/l<lv>_<face>_<r>_<c>.jpg
+    if level is None:
+        # Level cao nhất store ghi là đã đủ tile, không phải level cao nhất có tile (có thể còn dở)
+        levels = store.product_levels(face_folder.split('/')[0])
+        level = max(levels) if levels else None
+    by_level = {}
+    for path in store.list(face_folder):
+        parts = path.split('/')
+        if len(parts) >= 5 and path.lower().endswith(TILE_EXTENSIONS):
+            by_level.setdefault(parts[2], []).append(path)
+    if not by_level:
         raise ValueError(f"No level folders found in {face_folder}")
+    level_name = f"l{level}" if level is not None else max(by_level, key=level_number)
+    if level_name not in by_level:
+        raise ValueError(f"Level {level_name} not found in {face_folder}")
+
+    tile_map = {}
+    for path in by_level[level_name]:
+        coords = tile_coords(path)
+        if coords:
+            tile_map[coords] = path
+    return tile_map
 
-    levels.sort()
-    highest_level = levels[-1]
+def level_number(name):
+    return int(name[1:]) if name.startswith('l') and name[1:].isdigit() else -1
 
-    level_path = os.path.join(face_folder, highest_level)
+def find_tiles(face_folder, store=None, level=None):
+    # level: level đã tải đủ (levels.txt của TestCrawl), mặc định là level cao nhất có trên đĩa
+    if store is not None:
+        return find_tiles_in_store(store, face_folder, level)
+
+    # Layout cố định l<lv>/<r>/l<lv>_<face>_<r>_<c>.jpg: chỉ liệt kê các thư mục hàng của level cần dùng
+    # (so theo số, "l10" > "l9"), không đi qua các level khác
+    if level is not None:
+        level_path = os.path.join(face_folder, f"l{level}")
+        if not os.path.isdir(level_path):
+            raise ValueError(f"Level l{level} not found in {face_folder}")
+    else:
+        levels = [entry.name for entry in os.scandir(face_folder)
+                  if entry.is_dir() and level_number(entry.name) >= 0]
+        if not levels:
+            raise ValueError(f"No level folders found in {face_folder}")
+        level_path = os.path.join(face_folder, max(levels, key=level_number))
 
     tile_map = {}
-    for root, dirs, files in os.walk(level_path):
-        for file in files:
-            if file.lower().endswith(('.jpg', '.jpeg', '.png', '.webp')):
-                name = os.path.splitext(file)[0]
-                parts = name.split('_')
-                numbers = [p for p in parts if p.isdigit()]
-                if len(numbers) >= 2:
-                    y, x = map(int, numbers[-2:])
-                    tile_map[(y, x)] = os.path.join(root, file)
+    for row in os.scandir(level_path):
+        if not (row.is_dir() and row.name.isdigit()):
+            continue
+        for file in os.listdir(row.path):
+            if file.lower().endswith(TILE_EXTENSIONS):
+                coords = tile_coords(file)
+                if coords:
+                    tile_map[coords] = os.path.join(row.path, file)
+
+    return tile_map
+
+def stitch_face(face_folder, face_short_name, output_dir="./cube_faces"):
+    tile_map = find_tiles(face_folder)
 
     rows = [coord[0] for coord in tile_map.keys()]
     cols = [coord[1] for coord in tile_map.keys()]
@@ -36,28 +99,110 @@ def stitch_face(face_folder, face_short_name):
         tile = Image.open(filepath)
         face_image.paste(tile, ((x - 1) * tile_width, (y - 1) * tile_height))
 
-    output_name = f"./cube_faces/{face_short_name}.jpg"
-    os.makedirs("./cube_faces", exist_ok=True)
+    output_name = os.path.join(output_dir, f"{face_short_name}.jpg")
+    os.makedirs(output_dir, exist_ok=True)
     face_image.save(output_name)
     print(f"Saved {output_name}")
 
-def rotate_faces():
-    u_img = Image.open('./cube_faces/u.jpg')
+def decode_pool():
+    global _decode_pool
+    if _decode_pool is None:
+        _decode_pool = ThreadPoolExecutor(max_workers=DECODE_THREADS, thread_name_prefix="tile-decode")
+    return _decode_pool
+
+def reduce_factor(face_size, target_size):
+    # Hệ số giảm lớn nhất (1, 2, 4, 8) mà mặt giải mã ra vẫn không nhỏ hơn target_size
+    factor = 1
+    if target_size:
+        while factor < 8 and face_size / (factor * 2) >= target_size:
+            factor *= 2
+    return factor
+
+def decode_tile(data, factor=1):
+    # Ảnh BGR như cv2.imread; cv2 không đọc được (ví dụ webp lạ) thì dùng PIL
+    pixels = cv2.imdecode(np.frombuffer(data, np.uint8), REDUCED_FLAGS[factor])
+    if pixels is None:
+        with Image.open(io.BytesIO(data)) as tile:
+            pixels = np.asarray(tile.convert('RGB'))[:, :, ::-1]
+        if factor > 1:
+            height, width = pixels.shape[:2]
+            size = (-(-width // factor), -(-height // factor))
+            pixels = cv2.resize(pixels, size, interpolation=cv2.INTER_AREA)
+    return pixels
+
+def stitch_face_array(face_folder, store=None, target_size=None, threads=None, level=None):
+    # store là TileStore của TestCrawl/common/tile_store.py, face_folder khi đó là "<key>/<face>".
+    # target_size: cạnh mặt cần dùng; khi nhỏ hơn mặt của level cao nhất từ 2 lần trở lên,
+    # tile được giải mã thu nhỏ (1/2, 1/4, 1/8) thay vì giải mã đủ rồi resize.
+    tile_map = find_tiles(face_folder, store, level)
+    if store is not None:
+        # Kết nối SQLite của TileStore chỉ dùng được trên thread đã mở nó: đọc hết blob ở đây,
+        # pool chỉ giải mã và dán
+        blobs = {path: store.read(path) for path in tile_map.values()}
+        read_tile = blobs.__getitem__
+    else:
+        read_tile = read_file
+    max_row = max(y for y, x in tile_map)
+    max_col = max(x for y, x in tile_map)
+
+    # Ô (1,1) có kích thước đầy đủ, hàng/cột cuối có thể nhỏ hơn; chỉ đọc header
+    with Image.open(io.BytesIO(read_tile(tile_map[(1, 1)]))) as tile:
+        tile_width, tile_height = tile.size
+    with Image.open(io.BytesIO(read_tile(tile_map[(max_row, max_col)]))) as tile:
+        last_width, last_height = tile.size
+
+    full_width = (max_col - 1) * tile_width + last_width
+    full_height = (max_row - 1) * tile_height + last_height
+    factor = reduce_factor(min(full_width, full_height), target_size)
+    # libjpeg làm tròn lên khi giải mã thu nhỏ, tile 512 chia hết cho 8 nên chỉ ô cuối bị làm tròn
+    step_x, step_y = tile_width // factor, tile_height // factor
+    face = np.zeros(((max_row - 1) * step_y + -(-last_height // factor),
+                     (max_col - 1) * step_x + -(-last_width // factor), 3), dtype=np.uint8)
+
+    def paste(item):
+        (y, x), path = item
+        pixels = decode_tile(read_tile(path), factor)
+        top, left = (y - 1) * step_y, (x - 1) * step_x
+        # Các thread ghi vào những vùng không chồng nhau của cùng một canvas
+        region = face[top:top + pixels.shape[0], left:left + pixels.shape[1]]
+        region[...] = pixels[:region.shape[0], :region.shape[1]]
+
+    if (threads or DECODE_THREADS) > 1 and len(tile_map) > 1:
+        pool = decode_pool() if threads is None else ThreadPoolExecutor(max_workers=threads)
+        list(pool.map(paste, tile_map.items()))
+        if threads is not None:
+            pool.shutdown()
+    else:
+        for item in tile_map.items():
+            paste(item)
+
+    return face
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def rotate_faces(faces_dir="./cube_faces"):
+    u_path = os.path.join(faces_dir, 'u.jpg')
+    u_img = Image.open(u_path)
     u_img = u_img.rotate(-180, expand=True)
-    u_img.save('./cube_faces/u.jpg')
+    u_img.save(u_path)
 
-    d_img = Image.open('./cube_faces/d.jpg')
+    d_path = os.path.join(faces_dir, 'd.jpg')
+    d_img = Image.open(d_path)
     d_img = d_img.rotate(180, expand=True)
-    d_img.save('./cube_faces/d.jpg')
+    d_img.save(d_path)
 
-def flip_faces():
-    u_img = Image.open('./cube_faces/u.jpg')
+def flip_faces(faces_dir="./cube_faces"):
+    u_path = os.path.join(faces_dir, 'u.jpg')
+    u_img = Image.open(u_path)
     u_img = u_img.transpose(Image.FLIP_LEFT_RIGHT)
-    u_img.save('./cube_faces/u.jpg')
+    u_img.save(u_path)
 
-    d_img = Image.open('./cube_faces/d.jpg')
+    d_path = os.path.join(faces_dir, 'd.jpg')
+    d_img = Image.open(d_path)
     d_img = d_img.transpose(Image.FLIP_LEFT_RIGHT)
-    d_img.save('./cube_faces/d.jpg')
+    d_img.save(d_path)
 
 if __name__ == "__main__":
     faces = ['l', 'r', 'f', 'b', 'u', 'd']
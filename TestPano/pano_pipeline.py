@@ -0,0 +1,60 @@
+import os
+import sys
+import cv2
+
+from image_processing import stitch_face_array
+from convert_cube_to_equi import FACE_FOLDERS, render_equirectangular
+from remap_cache import render_equirectangular_cached
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "TestCrawl"))
+from common.tile_integrity import load_levels
+
+# rotate_faces (xoay 180) rồi flip_faces (lật trái-phải) tương đương lật trên-dưới
+FLIPPED_FACES = ('u', 'd')
+
+def usable_level(tiles_dir, store=None):
+    # (dựng được chưa, level): level cao nhất đã tải đủ theo levels.txt / store. Product tải trước khi có
+    # levels.txt trả về (True, None) để dùng level cao nhất có tile; chưa có level nào đủ thì (False, None)
+    levels = store.product_levels(tiles_dir) if store else load_levels(tiles_dir)
+    if levels is None:
+        return True, None
+    return bool(levels), max(levels, default=None)
+
+def stitch_cube_faces(tiles_dir, faces_dir=None, store=None, target_size=None, level=None):
+    # Với store, tiles_dir là product key và đường dẫn luôn dùng '/'
+    # target_size: cạnh mặt đủ cho ảnh đầu ra, tile được giải mã thu nhỏ khi level cao nhất dư nhiều
+    # level: level dùng để ghép (level cao nhất đã tải đủ khi product đang tải dần), mặc định level cao nhất
+    faces = {}
+    for short, full in FACE_FOLDERS.items():
+        face_folder = os.path.join(tiles_dir, short) if store is None else f"{tiles_dir}/{short}"
+        face = stitch_face_array(face_folder, store, target_size, level=level)
+        if short in FLIPPED_FACES:
+            face = face[::-1]
+        faces[full] = face
+
+        # Chỉ ghi mặt trung gian khi cần xem lại, pipeline không đọc lại chúng
+        if faces_dir:
+            os.makedirs(faces_dir, exist_ok=True)
+            cv2.imwrite(os.path.join(faces_dir, f"{short}.jpg"), face)
+    return faces
+
+def build_panorama(tiles_dir, output_path=None, width=8192, height=4096, interpolation='nearest',
+                   faces_dir=None, use_cache=True, store=None):
+    # Product đang tải dần chỉ được ghép từ level đã đủ tile
+    ready, level = usable_level(tiles_dir, store)
+    if not ready:
+        raise ValueError(f"No complete level in {tiles_dir}")
+    # Mỗi mặt cube phủ 90° nên chỉ cần width / 4 pixel theo chiều ngang
+    faces = stitch_cube_faces(tiles_dir, faces_dir, store, width // 4, level)
+    if use_cache:
+        output = render_equirectangular_cached(faces, width, height, interpolation)
+    else:
+        output = render_equirectangular(faces, width, height, interpolation)
+
+    if output_path:
+        cv2.imwrite(output_path, output)
+        print(f"Saved Equirectangular Panorama at {output_path}")
+    return output
+
+if __name__ == "__main__":
+    build_panorama("./tiles", "./equirectangular_output.jpg")
@@ -0,0 +1,127 @@
+import os
+import cv2
+import numpy as np
+
+from convert_cube_to_equi import (
+    FACE_NAMES,
+    CHUNK_ROWS,
+    load_face_images,
+    equirect_directions,
+    vectors_to_faces,
+    face_pixel_coords,
+    sample_bilinear,
+)
+
+REMAP_CACHE_DIR = "./remap_cache"
+# cv2.remap chỉ nhận ảnh nguồn có cạnh < SHRT_MAX
+CV2_REMAP_LIMIT = 32767
+
+# Bảng đã nạp trong tiến trình, theo (face_size, width, height, interpolation)
+_tables = {}
+
+def table_name(face_size, width, height, interpolation):
+    return f"{interpolation}_f{face_size}_{width}x{height}"
+
+def build_remap_table(face_size, width, height, interpolation='nearest'):
+    if interpolation not in ('nearest', 'bilinear'):
+        raise ValueError(f"Unknown interpolation: {interpolation}")
+
+    face_idx = np.empty((height, width), dtype=np.int16)
+    if interpolation == 'nearest':
+        # Toạ độ pixel trong từng mặt, cắt phần thập phân như int() của bản gốc
+        src_x = np.empty((height, width), dtype=np.int16)
+        src_y = np.empty((height, width), dtype=np.int16)
+    else:
+        # Toạ độ thực trong atlas 6 mặt xếp dọc, dùng trực tiếp cho cv2.remap
+        src_x = np.empty((height, width), dtype=np.float32)
+        src_y = np.empty((height, width), dtype=np.float32)
+
+    for y_start in range(0, height, CHUNK_ROWS):
+        y_stop = min(y_start + CHUNK_ROWS, height)
+        idx, sc_u, sc_v = vectors_to_faces(*equirect_directions(width, height, y_start, y_stop))
+        ix, iy = face_pixel_coords(sc_u, sc_v, face_size, face_size)
+
+        face_idx[y_start:y_stop] = idx
+        if interpolation == 'nearest':
+            src_x[y_start:y_stop] = ix.astype(np.int16)
+            src_y[y_start:y_stop] = iy.astype(np.int16)
+        else:
+            src_x[y_start:y_stop] = ix
+            src_y[y_start:y_stop] = iy + idx.astype(np.float64) * face_size
+
+    return face_idx, src_x, src_y
+
+def _save_array(path, array):
+    # Ghi ra file tạm rồi đổi tên để các tiến trình khác không đọc phải file dở
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+def get_remap_table(face_size, width, height, interpolation='nearest', cache_dir=REMAP_CACHE_DIR):
+    key = (face_size, width, height, interpolation)
+    if key in _tables:
+        return _tables[key]
+
+    name = table_name(*key)
+    paths = [os.path.join(cache_dir, f"{name}_{part}.npy") for part in ('face', 'x', 'y')]
+
+    if not all(os.path.exists(p) for p in paths):
+        print(f"🧮 Tạo bảng remap {name}...")
+        os.makedirs(cache_dir, exist_ok=True)
+        for path, array in zip(paths, build_remap_table(*key)):
+            _save_array(path, array)
+
+    table = tuple(np.load(p, mmap_mode='r') for p in paths)
+    _tables[key] = table
+    return table
+
+def cube_face_size(faces):
+    sizes = {faces[name].shape[:2] for name in FACE_NAMES}
+    if len(sizes) != 1:
+        raise ValueError(f"Cube faces must share one size, got {sorted(sizes)}")
+    face_h, face_w = sizes.pop()
+    if face_h != face_w:
+        raise ValueError(f"Cube faces must be square, got {face_w}x{face_h}")
+    return face_w
+
+def apply_remap_table(faces, table, interpolation='nearest'):
+    face_idx, src_x, src_y = table
+    height, width = face_idx.shape
+
+    if interpolation == 'nearest':
+        stack = np.stack([faces[name] for name in FACE_NAMES])
+        output = np.empty((height, width, stack.shape[3]), dtype=stack.dtype)
+        for y_start in range(0, height, CHUNK_ROWS):
+            rows = slice(y_start, min(y_start + CHUNK_ROWS, height))
+            output[rows] = stack[face_idx[rows], src_y[rows], src_x[rows]]
+        return output
+
+    atlas = np.concatenate([faces[name] for name in FACE_NAMES], axis=0)
+    if max(atlas.shape[:2]) < CV2_REMAP_LIMIT:
+        return cv2.remap(atlas, np.asarray(src_x), np.asarray(src_y), cv2.INTER_LINEAR,
+                         borderMode=cv2.BORDER_REPLICATE)
+
+    output = np.empty((height, width, atlas.shape[2]), dtype=atlas.dtype)
+    for y_start in range(0, height, CHUNK_ROWS):
+        rows = slice(y_start, min(y_start + CHUNK_ROWS, height))
+        band_x = src_x[rows].astype(np.float64).ravel()
+        band_y = src_y[rows].astype(np.float64).ravel()
+        output[rows] = sample_bilinear(atlas, band_x, band_y).reshape(output[rows].shape)
+    return output
+
+def render_equirectangular_cached(faces, width=8192, height=4096, interpolation='nearest', cache_dir=REMAP_CACHE_DIR):
+    table = get_remap_table(cube_face_size(faces), width, height, interpolation, cache_dir)
+    return apply_remap_table(faces, table, interpolation)
+
+def convert_cube_to_equirectangular_cached(input_folder, output_path, width=8192, height=4096,
+                                           interpolation='nearest', cache_dir=REMAP_CACHE_DIR):
+    faces = load_face_images(input_folder)
+    output = render_equirectangular_cached(faces, width, height, interpolation, cache_dir)
+    cv2.imwrite(output_path, output)
+    print(f"Saved Equirectangular Panorama at {output_path}")
+
+if __name__ == "__main__":
+    # Tạo sẵn bảng cho các kích thước mặt hay gặp trong dữ liệu demo
+    for face_size in (512, 1024, 1280, 2560, 3072, 4096):
+        get_remap_table(face_size, 8192, 4096, 'nearest')